@@ -1,4 +1,6 @@
+from .response_cache import ResponseCache
 from .base_agent import Agent, AgentOptions, AgentCallbacks, AgentResponse
+from .tool_call_stream import ToolArgumentsStreamParser
 from .text_classifier_agent import TextClassifierAgent, TextClassifierAgentOptions
 from .reasoning_agent import ReasoningAgent, ReasoningAgentOptions
 from .data_retrieval_agent import DataRetrievalAgent, DataRetrievalAgentOptions
@@ -8,6 +10,8 @@ __all__ = [
     'AgentOptions',
     'AgentCallbacks',
     'AgentResponse',
+    'ResponseCache',
+    'ToolArgumentsStreamParser',
     'TextClassifierAgent',
     'TextClassifierAgentOptions',
     'ReasoningAgent',
@@ -1,7 +1,10 @@
 from typing import Dict, List, Union, AsyncIterable, Optional, Any
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from orchestrator_types import ConversationMessage
+from orchestrator_types import ConversationMessage, ConversationRole, RequestContext
+from prompts import compile_template
+from token_counting import TokenUsage, default_tokenizer
+from .response_cache import ResponseCache
 import re
 
 @dataclass
@@ -13,6 +16,10 @@ class AgentCallbacks:
     def on_llm_new_token(self, token: str) -> None:
         pass
 
+    async def on_llm_new_token_async(self, token: str) -> None:
+        """Awaited by agents for every token; override to apply backpressure."""
+        self.on_llm_new_token(token)
+
 @dataclass
 class AgentOptions:
     name: str
@@ -20,6 +27,8 @@ class AgentOptions:
     save_chat: bool = True
     streaming: bool = False
     callbacks: Optional[AgentCallbacks] = None
+    response_cache: Optional[ResponseCache] = None
+    history_token_budget: Optional[int] = None
 
 class Agent(ABC):
     def __init__(self, options: AgentOptions):
@@ -27,10 +36,21 @@ class Agent(ABC):
         self.id = self.generate_key_from_name(options.name)
         self.description = options.description
         self.save_chat = options.save_chat
+        self.callbacks = options.callbacks
+        self.response_cache = options.response_cache
+        self.history_token_budget = options.history_token_budget
 
     def is_streaming_enabled(self) -> bool:
         return False
 
+    def supports_fused_answer(self) -> bool:
+        """
+        Whether the classifier may answer this agent's single-hop requests itself, in
+        the agent's persona, when the orchestrator runs in fused mode. Only agents that
+        answer from the model alone, with output and short_output, should say yes.
+        """
+        return False
+
     @staticmethod
     def generate_key_from_name(name: str) -> str:
         import re
@@ -43,17 +63,98 @@ class Agent(ABC):
     @abstractmethod
     async def handle_request(
         self,
-        original_user_input: str,
+        context: RequestContext,
         input_text: str,
-        user_id: str,
-        session_id: str,
-        chat_history: List[ConversationMessage],
-        additional_params: Optional[Dict[str, str]] = None,
+        chat_history: List[ConversationMessage]
     ) -> Union[ConversationMessage, AsyncIterable[Any]]:
         pass
 
-    def set_history(self, messages: List[ConversationMessage]) -> None:
-        self.chat_history = self.format_messages(messages)
+    async def process_request(
+        self,
+        context: RequestContext,
+        input_text: str,
+        chat_history: List[ConversationMessage]
+    ) -> Union[ConversationMessage, AsyncIterable[Any]]:
+        """Answer from the response cache when enabled, otherwise call handle_request."""
+        cache_key = self.response_cache.request_key(context, input_text, chat_history) if self.response_cache else None
+        if cache_key is None:
+            return await self.handle_request(context, input_text, chat_history)
+
+        cached_message = self.response_cache.get(*cache_key)
+        if cached_message is not None:
+            return await self.deliver_answer(context,
+                                             cached_message.content[0]['text'],
+                                             cached_message.short_output,
+                                             cached_message.tokens)
+
+        response = await self.handle_request(context, input_text, chat_history)
+        if isinstance(response, ConversationMessage):
+            self.response_cache.set(*cache_key, response)
+        return response
+
+    async def deliver_answer(self,
+                             context: RequestContext,
+                             text: str,
+                             short_output: str,
+                             tokens: int) -> ConversationMessage:
+        """
+        Answer with text that was not generated by this call (a cached answer, or one the
+        classifier gave in the agent's persona), streamed to the request's callbacks the
+        way the agent streams its own answers.
+        """
+        callbacks = self.get_callbacks(context)
+        if callbacks and self.is_streaming_enabled():
+            await callbacks.on_llm_new_token_async("\n")
+            await callbacks.on_llm_new_token_async(f"\nGenerated response from {self.name}")
+            await callbacks.on_llm_new_token_async("\n")
+            await callbacks.on_llm_new_token_async(text)
+        return ConversationMessage(
+            role=ConversationRole.ASSISTANT.value,
+            original_user_input=context.original_user_input,
+            short_output=short_output,
+            tokens=tokens,
+            content=[{'text': text}]
+        )
+
+    @staticmethod
+    def budgeted_max_tokens(context: RequestContext, configured: Optional[int]) -> Optional[int]:
+        """max_tokens for a model call, lowered to the tokens the request's budget has left."""
+        return context.budget.max_output_tokens(configured) if context.budget else configured
+
+    @staticmethod
+    def check_budget_cutoff(context: RequestContext,
+                            finish_reason: Optional[str],
+                            configured: Optional[int],
+                            max_tokens: Optional[int]) -> None:
+        """Stop the request on its token budget if the call was cut off at the max_tokens the budget lowered."""
+        if context.budget:
+            context.budget.check_output(finish_reason, configured, max_tokens)
+
+    def record_usage(self, context: RequestContext, usage: Any, model: Optional[str] = None) -> Optional[TokenUsage]:
+        """
+        Charge the usage a model call reported to the request's budget and usage.
+        Returns:
+            Optional[TokenUsage]: The usage, None if the call reported none.
+        """
+        token_usage = TokenUsage.from_response(usage, model or getattr(self, 'model', None))
+        if token_usage is None:
+            return None
+        if context.budget:
+            context.budget.record_usage(token_usage)
+        if context.usage:
+            context.usage.record(self.id, context.hop, token_usage, getattr(self, 'api_key', None))
+        return token_usage
+
+    @staticmethod
+    def output_tokens(usage: Optional[TokenUsage], text: str) -> int:
+        """Completion tokens of an answer: as reported by the model, counted locally if it reported none."""
+        if usage is not None and usage.completion_tokens:
+            return usage.completion_tokens
+        return default_tokenizer().count(text)
+
+    def get_callbacks(self, context: RequestContext) -> Optional[AgentCallbacks]:
+        """Callbacks of the request take precedence over the ones the agent was built with."""
+        return context.callbacks or self.callbacks
 
     @staticmethod
     def format_messages(messages: List[ConversationMessage]) -> str:
@@ -62,18 +163,14 @@ class Agent(ABC):
             f"{message.role}: {' '.join([message.content[0]['text']])}" for message in messages
         ])
 
-    def update_system_prompt(self) -> None:
+    def build_system_prompt(self,
+                            context: RequestContext,
+                            input_text: str,
+                            chat_history: List[ConversationMessage]) -> str:
         all_variables: Dict[str, Union[str, List[str]]] = {
-            "ORIGINAL_USER_INPUT": self.original_user_input,
-            "SUBTASK_INPUT": self.subtask_input,
-            "HISTORY": self.chat_history
+            "ORIGINAL_USER_INPUT": context.original_user_input,
+            "SUBTASK_INPUT": input_text,
+            "HISTORY": self.format_messages(chat_history)
         }
-        self.system_prompt = self.replace_placeholders(self.prompt_template, all_variables)
-
-    @staticmethod
-    def replace_placeholders(template: str, variables: Dict[str, Union[str, List[str]]]) -> str:
-
-        return re.sub(r'{{(\w+)}}',
-                      lambda m: '\n'.join(variables.get(m.group(1), [m.group(0)]))
-                      if isinstance(variables.get(m.group(1)), list)
-                      else variables.get(m.group(1), m.group(0)), template)
\ No newline at end of file
+        # Compiled on first use; the text before the first per-request value is a stable prefix
+        return compile_template(self.prompt_template).render(all_variables)
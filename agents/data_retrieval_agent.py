@@ -6,12 +6,15 @@ from phi.agent import Agent as phiAgent
 from phi.agent import RunResponse
 from phi.model.openai import OpenAIChat
 from agents import Agent, AgentOptions
+from clients import get_openai_client
 from orchestrator_types import (
     ConversationMessage,
-    ConversationRole
+    ConversationRole,
+    RequestContext
 )
 from loguru import logger
 from retrievers import Retriever, JSONRetriever
+from token_counting import TokenUsage
 
 OPENAI_MODEL_ID_GPT_O_MINI = "gpt-4o-mini"
 
@@ -40,7 +43,6 @@ class DataRetrievalAgent(Agent):
         self.model = options.model or OPENAI_MODEL_ID_GPT_O_MINI
         self.api_key = options.api_key
         self.streaming = options.streaming or False
-        self.callbacks = options.callbacks
 
         # Initialize system prompt
         self.prompt_template = f"""You are a {self.name}.
@@ -62,7 +64,9 @@ class DataRetrievalAgent(Agent):
         - Ask for clarification if any part of the question or prompt is ambiguous.
         - Maintain a consistent, respectful, and engaging tone tailored to the human's communication style.
         - Seamlessly transition between topics as the human introduces new subjects.""" + """
+
         ###Guidelines###
+        - make sure to provide answer the sub-task with appropriate retrievals labels in original_user_input
         - Original user input is 
         <original_user_input>
          {{ORIGINAL_USER_INPUT}}
@@ -78,37 +82,17 @@ class DataRetrievalAgent(Agent):
         <history>
         {{HISTORY}}
         </history>
-
-        - make sure to provide answer the sub-task with appropriate retrievals labels in original_user_input
         """
 
-        if options.client:
-            self.client = options.client
+        # phi agents keep run state and memory on the instance, so unless a client is provided
+        # a fresh one is built per request around the shared tools and knowledge base
+        self.client = options.client
+        self.tools = None
+        self.retriever: Optional[Retriever] = None
+        if options.use_google_tool:
+            self.tools = [GoogleSearch()]
         else:
-            if options.use_google_tool:
-                self.client = phiAgent(
-                        model=OpenAIChat(id="gpt-4o-mini", api_key=self.api_key),
-                        show_tool_calls=False,
-                        markdown=True,
-                        description=self.description,
-                        instructions=[self.prompt_template],
-                        tools=[GoogleSearch()],
-                        response_model=OutputFormat,
-                        structured_outputs=True
-                    )
-            else:
-                self.retriever: Optional[Retriever] = JSONRetriever().get_retriever(options.api_key)
-                self.client = phiAgent(
-                        model=OpenAIChat(id="gpt-4o-mini", api_key=self.api_key),
-                        show_tool_calls=False,
-                        markdown=True,
-                        description=self.description,
-                        instructions=[self.prompt_template],
-                        # Add the knowledge base to the agent
-                        knowledge=self.retriever,
-                        response_model=OutputFormat,
-                        structured_outputs=True
-                    )
+            self.retriever = JSONRetriever().get_retriever(options.api_key)
 
         # Default inference configuration
         default_agent_config = {
@@ -123,27 +107,53 @@ class DataRetrievalAgent(Agent):
         else:
             self.agent_config = default_agent_config
 
-        self.system_prompt = ""
-
     def is_streaming_enabled(self) -> bool:
         return self.streaming is True
 
+    def create_client(self, max_tokens: Optional[int] = None) -> phiAgent:
+        return phiAgent(
+                model=OpenAIChat(id="gpt-4o-mini", api_key=self.api_key, max_tokens=max_tokens,
+                                 async_client=get_openai_client(self.api_key)),
+                show_tool_calls=False,
+                markdown=True,
+                description=self.description,
+                instructions=[self.prompt_template],
+                tools=self.tools,
+                # Add the knowledge base to the agent
+                knowledge=self.retriever,
+                response_model=OutputFormat,
+                structured_outputs=True
+            )
+
+    async def run_agent(self, request_options: Dict[str, Any]) -> RunResponse:
+        # phi ignores max_tokens among the run arguments; it is set on the model of the client
+        # built for the run, while a provided client keeps the max_tokens of its own model
+        max_tokens = request_options.pop('max_tokens', None)
+        client = self.client or self.create_client(max_tokens)
+        return await client.arun(**request_options)
+
+    @staticmethod
+    def run_usage(run_response: RunResponse) -> Dict[str, int]:
+        """Usage of every model call of a phi run, tool calls included."""
+        metrics = run_response.metrics or {}
+        return {
+            'prompt_tokens': sum(metrics.get('input_tokens', [])),
+            'completion_tokens': sum(metrics.get('output_tokens', []))
+        }
+
+    def answer_tokens(self, run_response: RunResponse, answer: str) -> int:
+        """Completion tokens of the model call that wrote the answer, the last one of the run."""
+        output_tokens = (run_response.metrics or {}).get('output_tokens') or []
+        return self.output_tokens(TokenUsage(completion_tokens=output_tokens[-1]) if output_tokens else None, answer)
+
     async def handle_request(
         self,
-        original_user_input: str,
+        context: RequestContext,
         input_text: str,
-        user_id: str,
-        session_id: str,
-        chat_history: List[ConversationMessage],
-        additional_params: Optional[Dict[str, str]] = None
+        chat_history: List[ConversationMessage]
     ) -> Union[ConversationMessage, AsyncIterable[Any]]:
         try:
-            self.original_user_input = original_user_input
-            self.subtask_input = input_text
-            self.set_history(chat_history)
-
-            self.update_system_prompt()
-            system_prompt = self.system_prompt
+            system_prompt = self.build_system_prompt(context, input_text, chat_history)
             messages = [
                 {"role": "system", "content": system_prompt},
                 *[{
@@ -156,38 +166,37 @@ class DataRetrievalAgent(Agent):
             request_options = {
                 "model": self.model,
                 "messages": messages,
-                "max_tokens": self.agent_config.get('maxTokens'),
+                "max_tokens": self.budgeted_max_tokens(context, self.agent_config.get('maxTokens')),
                 "temperature": self.agent_config.get('temperature'),
                 "top_p": self.agent_config.get('topP'),
                 "stop": self.agent_config.get('stopSequences'),
                 "stream": self.streaming
             }
             if self.streaming:
-                return await self.handle_streaming_response(request_options)
+                return await self.handle_streaming_response(request_options, context)
             else:
-                return await self.handle_single_response(request_options)
+                return await self.handle_single_response(request_options, context)
 
         except Exception as error:
             logger.error(f"Error in OpenAI API call: {str(error)}")
             raise error
 
-    async def handle_single_response(self, request_options: Dict[str, Any]) -> ConversationMessage:
+    async def handle_single_response(self,
+                                     request_options: Dict[str, Any],
+                                     context: RequestContext) -> ConversationMessage:
         try:
-            chat_completion: RunResponse = self.client.run(**request_options)
+            chat_completion: RunResponse = await self.run_agent(request_options)
+            self.record_usage(context, self.run_usage(chat_completion), getattr(chat_completion, 'model', None))
             assistant_message: OutputFormat = chat_completion.content
             
             if not isinstance(assistant_message, OutputFormat):
                 raise ValueError('Unexpected response format from OpenAI API')
             
-            tokens = 0
-            if len(chat_completion.metrics['output_tokens']) >= 2:
-                tokens = chat_completion.metrics['output_tokens'][1]
-            else:
-                tokens = len(assistant_message.output.split(' '))
+            tokens = self.answer_tokens(chat_completion, assistant_message.output)
 
             return ConversationMessage(
                 role=ConversationRole.ASSISTANT.value,
-                original_user_input=self.original_user_input,
+                original_user_input=context.original_user_input,
                 short_output=assistant_message.short_output,
                 tokens=tokens,
                 content=[{"text": assistant_message.output}]
@@ -197,29 +206,29 @@ class DataRetrievalAgent(Agent):
             logger.error(f'Error in OpenAI API call: {str(error)}')
             raise error
 
-    async def handle_streaming_response(self, request_options: Dict[str, Any]) -> ConversationMessage:
+    async def handle_streaming_response(self,
+                                        request_options: Dict[str, Any],
+                                        context: RequestContext) -> ConversationMessage:
         try:
             request_options['stream'] = False
-            streams: RunResponse = self.client.run(**request_options)
+            streams: RunResponse = await self.run_agent(request_options)
+            self.record_usage(context, self.run_usage(streams), getattr(streams, 'model', None))
             assistant_message: OutputFormat = streams.content
             accumulated_message = [assistant_message.output]
 
-            if self.callbacks:
-                self.callbacks.on_llm_new_token("\n")
-                self.callbacks.on_llm_new_token(f"\nGenerated response from {self.name}")
-                self.callbacks.on_llm_new_token("\n")
-                self.callbacks.on_llm_new_token(assistant_message.output)
+            callbacks = self.get_callbacks(context)
+            if callbacks:
+                await callbacks.on_llm_new_token_async("\n")
+                await callbacks.on_llm_new_token_async(f"\nGenerated response from {self.name}")
+                await callbacks.on_llm_new_token_async("\n")
+                await callbacks.on_llm_new_token_async(assistant_message.output)
             
-            tokens = 0
-            if len(streams.metrics['output_tokens']) >= 2:
-                tokens = streams.metrics['output_tokens'][1]
-            else:
-                tokens = len(assistant_message.output.split(' '))
+            tokens = self.answer_tokens(streams, assistant_message.output)
 
             # Store the complete message in the instance for later access if needed
             return ConversationMessage(
                 role=ConversationRole.ASSISTANT.value,
-                original_user_input=self.original_user_input,
+                original_user_input=context.original_user_input,
                 short_output=assistant_message.short_output,
                 tokens=tokens,
                 content=[{"text": ''.join(accumulated_message)}]
@@ -1,10 +1,12 @@
 from typing import Dict, List, Union, AsyncIterable, Optional, Any
 from dataclasses import dataclass
-from openai import OpenAI
-from agents import Agent, AgentOptions
+from openai import AsyncOpenAI
+from agents import Agent, AgentOptions, ToolArgumentsStreamParser
+from clients import get_openai_client
 from orchestrator_types import (
     ConversationMessage,
-    ConversationRole
+    ConversationRole,
+    RequestContext
 )
 from loguru import logger
 import json
@@ -27,11 +29,9 @@ class ReasoningAgent(Agent):
         if not options.api_key:
             raise ValueError("OpenAI API key is required")
         
-        if options.client:
-            self.client = options.client
-        else:
-            self.client = OpenAI(api_key=options.api_key)
-        self.callbacks = options.callbacks
+        self.api_key = options.api_key
+        # Without an explicit client the agent draws from the shared connection pool per request
+        self.client: Optional[AsyncOpenAI] = options.client
                 
         self.model = options.model or OPENAI_MODEL_ID_GPT_O_MINI
         self.streaming = options.streaming or False
@@ -69,7 +69,9 @@ class ReasoningAgent(Agent):
         - Ask for clarification if any part of the question or prompt is ambiguous.
         - Maintain a consistent, respectful, and engaging tone tailored to the human's communication style.
         - Seamlessly transition between topics as the human introduces new subjects.""" + """
+
         ###Guidelines###
+        - make sure to provide answer the sub-task with appropriate reasoning demanded in original_user_input
         - Original user input is 
         <original_user_input>
          {{ORIGINAL_USER_INPUT}}
@@ -85,12 +87,8 @@ class ReasoningAgent(Agent):
         <history>
         {{HISTORY}}
         </history>
-
-        - make sure to provide answer the sub-task with appropriate reasoning demanded in original_user_input
         """
 
-        self.system_prompt = ""
-
         self.tools = [
             {
                 'type': 'function',
@@ -122,22 +120,20 @@ class ReasoningAgent(Agent):
     def is_streaming_enabled(self) -> bool:
         return self.streaming is True
 
+    def supports_fused_answer(self) -> bool:
+        return True
+
+    def get_client(self) -> AsyncOpenAI:
+        return self.client or get_openai_client(self.api_key)
+
     async def handle_request(
         self,
-        original_user_input: str,
+        context: RequestContext,
         input_text: str,
-        user_id: str,
-        session_id: str,
-        chat_history: List[ConversationMessage],
-        additional_params: Optional[Dict[str, str]] = None
+        chat_history: List[ConversationMessage]
     ) -> Union[ConversationMessage, AsyncIterable[Any]]:
         try:
-            self.original_user_input = original_user_input
-            self.subtask_input = input_text
-            self.set_history(chat_history)
-            
-            self.update_system_prompt()
-            system_prompt = self.system_prompt
+            system_prompt = self.build_system_prompt(context, input_text, chat_history)
 
             messages = [
                 {"role": "system", "content": system_prompt},
@@ -152,7 +148,7 @@ class ReasoningAgent(Agent):
             request_options = {
                 "model": self.model,
                 "messages": messages,
-                "max_tokens": self.agent_config.get('maxTokens'),
+                "max_tokens": self.budgeted_max_tokens(context, self.agent_config.get('maxTokens')),
                 "temperature": self.agent_config.get('temperature'),
                 "top_p": self.agent_config.get('topP'),
                 "stop": self.agent_config.get('stopSequences'),
@@ -161,21 +157,26 @@ class ReasoningAgent(Agent):
                 "tool_choice":{"type": "function", "function": {"name": "processPrompt"}}
             }
             if self.streaming:
-                return await self.handle_streaming_response(request_options)
+                return await self.handle_streaming_response(request_options, context)
             else:
-                return await self.handle_single_response(request_options)
+                return await self.handle_single_response(request_options, context)
 
         except Exception as error:
             logger.error(f"Error in OpenAI API call: {str(error)}")
             raise error
 
-    async def handle_single_response(self, request_options: Dict[str, Any]) -> ConversationMessage:
+    async def handle_single_response(self,
+                                     request_options: Dict[str, Any],
+                                     context: RequestContext) -> ConversationMessage:
         try:
             request_options['stream'] = False
-            chat_completion = self.client.chat.completions.create(**request_options)
+            chat_completion = await self.get_client().chat.completions.create(**request_options)
+            usage = self.record_usage(context, chat_completion.usage, chat_completion.model)
 
             if not chat_completion.choices:
                 raise ValueError('No choices returned from OpenAI API')
+            self.check_budget_cutoff(context, chat_completion.choices[0].finish_reason,
+                                     self.agent_config.get('maxTokens'), request_options['max_tokens'])
 
             tool_response = chat_completion.choices[0].message.tool_calls[0]
 
@@ -191,9 +192,9 @@ class ReasoningAgent(Agent):
 
             return ConversationMessage(
                 role=ConversationRole.ASSISTANT.value,
-                original_user_input=self.original_user_input,
+                original_user_input=context.original_user_input,
                 short_output=tool_input['short_output'],
-                tokens=len(assistant_message.split(' ')),
+                tokens=self.output_tokens(usage, assistant_message),
                 content=[{"text": assistant_message}]
             )
 
@@ -201,31 +202,48 @@ class ReasoningAgent(Agent):
             logger.error(f'Error in OpenAI API call: {str(error)}')
             raise error
 
-    async def handle_streaming_response(self, request_options: Dict[str, Any]) -> ConversationMessage:
+    async def handle_streaming_response(self,
+                                        request_options: Dict[str, Any],
+                                        context: RequestContext) -> ConversationMessage:
         try:
-            stream = self.client.chat.completions.create(**request_options)
-            accumulated_message = []
-            tokens = 0
-            for chunk in stream:
-                if chunk.choices[0].delta.tool_calls:
+            # The last chunk then carries the usage of the whole call
+            request_options['stream_options'] = {"include_usage": True}
+            stream = await self.get_client().chat.completions.create(**request_options)
+            # Characters of the "output" argument are forwarded while the tool call is still streaming
+            parser = ToolArgumentsStreamParser('output')
+            callbacks = self.get_callbacks(context)
+            if callbacks:
+                await callbacks.on_llm_new_token_async("\n")
+                await callbacks.on_llm_new_token_async(f"\nGenerated response from {self.name}")
+                await callbacks.on_llm_new_token_async("\n")
+
+            stream_usage = None
+            model = None
+            finish_reason = None
+            async for chunk in stream:
+                if chunk.usage:
+                    stream_usage = chunk.usage
+                    model = chunk.model
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                if chunk.choices and chunk.choices[0].delta.tool_calls:
                     tool_response = chunk.choices[0].delta.tool_calls[0]
-                    accumulated_message.append(tool_response.function.arguments)
+                    if tool_response.function and tool_response.function.arguments:
+                        output_text = parser.feed(tool_response.function.arguments)
+                        if output_text and callbacks:
+                            await callbacks.on_llm_new_token_async(output_text)
 
-            # Store the complete message in the instance for later access if needed
-            tool_input = json.loads(''.join(accumulated_message))
-            if self.callbacks:
-                self.callbacks.on_llm_new_token("\n")
-                self.callbacks.on_llm_new_token(f"\nGenerated response from {self.name}")
-                self.callbacks.on_llm_new_token("\n")
-                self.callbacks.on_llm_new_token(tool_input['output'])
-                tokens = len(tool_input['output'].split(' '))
+            usage = self.record_usage(context, stream_usage, model)
+            self.check_budget_cutoff(context, finish_reason, self.agent_config.get('maxTokens'), request_options['max_tokens'])
+            tool_input = json.loads(parser.get_arguments())
+            tokens = self.output_tokens(usage, tool_input['output'])
 
             return ConversationMessage(
                 role=ConversationRole.ASSISTANT.value,
-                original_user_input=self.original_user_input,
+                original_user_input=context.original_user_input,
                 short_output=tool_input['short_output'],
                 tokens=tokens,
-                content=[{"text": ''.join(tool_input['output'])}]
+                content=[{"text": tool_input['output']}]
             )
 
         except Exception as error:
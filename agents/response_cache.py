@@ -0,0 +1,148 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from orchestrator_types import ConversationMessage, RequestContext
+from text_similarity import CharNgramIndex
+
+class ResponseCache:
+    """
+    Cache of agent responses keyed on the sub-task input, within a scope.
+
+    The cached text is the sub-task input, preceded by the original user input when
+    the two differ. Requests without chat history send a prompt built from that text
+    alone, so their answers are shared by every user, in SHARED_SCOPE. Requests that
+    come with chat history bypass the cache unless cache_with_history is set, since
+    prompts that include the history can answer a follow-up like "yes" in many ways;
+    with it, their scope is the user and a fingerprint of the history, and answers are
+    never shared across scopes.
+
+    Lookups first try an exact match on the normalized text, then the most similar
+    cached text of the same scope by character n-gram TF-IDF cosine similarity,
+    accepted at or above similarity_threshold. Every scope has its own similarity
+    index, so entries of other scopes are never scored. Entries expire after
+    ttl_seconds and the least recently used one is evicted once max_entries is
+    reached. A similar text is only accepted when it contains the same numbers in the
+    same order, since word problems that differ in a single number score as
+    near-identical but have different answers.
+
+    Only attach a cache to agents whose answer depends on the input alone; agents
+    that search the web or sample at a high temperature should not use one.
+    """
+    SHARED_SCOPE = "shared"
+
+    def __init__(self,
+                 max_entries: int = 1000,
+                 ttl_seconds: Optional[float] = 3600,
+                 similarity_threshold: Optional[float] = 0.95,
+                 cache_with_history: bool = False):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.cache_with_history = cache_with_history
+        self.entries: "OrderedDict[str, Tuple[str, Optional[float], ConversationMessage]]" = OrderedDict()
+        self.indexes: Dict[str, CharNgramIndex] = {}
+        self.counters: Dict[str, int] = {
+            'exact_hits': 0,
+            'similar_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'bypassed': 0
+        }
+
+    def request_key(self,
+                    context: RequestContext,
+                    input_text: str,
+                    chat_history: List[ConversationMessage]) -> Optional[Tuple[str, str]]:
+        """
+        Scope and text the answer to a request is cached under.
+        Returns:
+            Optional[Tuple[str, str]]: The scope and the text, None if the request bypasses the cache.
+        """
+        if not chat_history:
+            scope = self.SHARED_SCOPE
+        elif not self.cache_with_history:
+            self.counters['bypassed'] += 1
+            return None
+        else:
+            fingerprint = hashlib.sha256()
+            fingerprint.update(context.user_id.encode())
+            for message in chat_history:
+                text = message.content[0].get('text', '') if message.content else ''
+                fingerprint.update(f"\x1e{message.role}\x1f{text}".encode())
+            scope = fingerprint.hexdigest()
+
+        text = input_text
+        original = context.original_user_input
+        if original and CharNgramIndex.normalize(original) != CharNgramIndex.normalize(input_text):
+            text = f"{original}\n{input_text}"
+        return scope, text
+
+    def get(self, scope: str, text: str) -> Optional[ConversationMessage]:
+        normalized = CharNgramIndex.normalize(text)
+        message = self._get_entry(f"{scope}:{normalized}")
+        if message is not None:
+            self.counters['exact_hits'] += 1
+            return message
+
+        index = self.indexes.get(scope)
+        if index is not None and self.similarity_threshold is not None:
+            numbers = self.numbers(normalized)
+            for score, similar_key, similar_numbers in index.query(normalized, limit=10):
+                if score < self.similarity_threshold:
+                    break
+                if similar_numbers != numbers:
+                    continue
+                message = self._get_entry(similar_key)
+                if message is not None:
+                    self.counters['similar_hits'] += 1
+                    return message
+
+        self.counters['misses'] += 1
+        return None
+
+    def set(self, scope: str, text: str, message: ConversationMessage) -> None:
+        normalized = CharNgramIndex.normalize(text)
+        key = f"{scope}:{normalized}"
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        self.entries[key] = (scope, expires_at, message)
+        self.entries.move_to_end(key)
+        self.indexes.setdefault(scope, CharNgramIndex()).add(key, normalized, self.numbers(normalized))
+        while len(self.entries) > self.max_entries:
+            oldest, (oldest_scope, _, _) = self.entries.popitem(last=False)
+            self._unindex(oldest_scope, oldest)
+            self.counters['evictions'] += 1
+
+    @staticmethod
+    def numbers(text: str) -> Tuple[str, ...]:
+        return tuple(re.findall(r"\d+(?:[.,]\d+)*", text))
+
+    def _get_entry(self, key: str) -> Optional[ConversationMessage]:
+        item = self.entries.get(key)
+        if item is None:
+            return None
+        scope, expires_at, message = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self.entries[key]
+            self._unindex(scope, key)
+            self.counters['expirations'] += 1
+            return None
+        self.entries.move_to_end(key)
+        return message
+
+    def _unindex(self, scope: str, key: str) -> None:
+        index = self.indexes[scope]
+        index.remove(key)
+        if not len(index):
+            del self.indexes[scope]
+
+    def metrics(self) -> Dict[str, float]:
+        hits = self.counters['exact_hits'] + self.counters['similar_hits']
+        lookups = hits + self.counters['misses']
+        return {
+            **self.counters,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'size': len(self.entries)
+        }
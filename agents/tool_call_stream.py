@@ -0,0 +1,108 @@
+from typing import List, Optional
+
+JSON_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t'
+}
+
+class ToolArgumentsStreamParser:
+    """
+    Incremental parser for the JSON arguments of a streamed tool call.
+
+    Fragments are fed as they arrive and the decoded characters of one top-level
+    string field (e.g. "output") are returned as soon as they are known, so they can
+    be forwarded to callbacks before the tool call completes. The raw fragments are
+    kept, and the complete arguments are available from get_arguments() at the end.
+    """
+    def __init__(self, field: str):
+        self.field = field
+        self.fragments: List[str] = []
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.unicode_digits: Optional[str] = None
+        self.high_surrogate: Optional[int] = None
+        self.expect_key = False
+        self.is_key = False
+        self.key_chars: List[str] = []
+        self.last_key = ""
+        self.in_field = False
+
+    def feed(self, fragment: str) -> str:
+        """
+        Consume the next fragment of the arguments.
+        Returns:
+            str: The newly decoded characters of the field value, possibly empty.
+        """
+        self.fragments.append(fragment)
+        emitted: List[str] = []
+        for char in fragment:
+            if self.in_string:
+                self._consume_string_char(char, emitted)
+            elif char == '"':
+                self.in_string = True
+                self.is_key = self.depth == 1 and self.expect_key
+                self.in_field = self.depth == 1 and not self.is_key and self.last_key == self.field
+                self.key_chars = []
+            elif char in '{[':
+                self.depth += 1
+                self.expect_key = char == '{'
+            elif char in '}]':
+                self.depth -= 1
+            elif char == ',' and self.depth == 1:
+                self.expect_key = True
+            elif char == ':' and self.depth == 1:
+                self.expect_key = False
+        return ''.join(emitted)
+
+    def get_arguments(self) -> str:
+        return ''.join(self.fragments)
+
+    def _consume_string_char(self, char: str, emitted: List[str]) -> None:
+        if self.unicode_digits is not None:
+            self.unicode_digits += char
+            if len(self.unicode_digits) == 4:
+                code_point = int(self.unicode_digits, 16)
+                self.unicode_digits = None
+                self._append_code_point(code_point, emitted)
+            return
+
+        if self.escape:
+            self.escape = False
+            if char == 'u':
+                self.unicode_digits = ""
+            else:
+                self._append(JSON_ESCAPES.get(char, char), emitted)
+            return
+
+        if char == '\\':
+            self.escape = True
+        elif char == '"':
+            self.in_string = False
+            if self.is_key:
+                self.last_key = ''.join(self.key_chars)
+            self.in_field = False
+        else:
+            self._append(char, emitted)
+
+    def _append_code_point(self, code_point: int, emitted: List[str]) -> None:
+        if 0xD800 <= code_point <= 0xDBFF:
+            # High surrogate: wait for the low half before emitting the character
+            self.high_surrogate = code_point
+            return
+        if 0xDC00 <= code_point <= 0xDFFF and self.high_surrogate is not None:
+            code_point = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code_point - 0xDC00)
+        self.high_surrogate = None
+        self._append(chr(code_point), emitted)
+
+    def _append(self, text: str, emitted: List[str]) -> None:
+        if self.is_key:
+            self.key_chars.append(text)
+        elif self.in_field:
+            emitted.append(text)
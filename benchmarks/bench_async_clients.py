@@ -0,0 +1,99 @@
+"""
+Concurrent LLM calls against the local fake endpoint.
+
+Fires N classifier calls and N agent calls at once and checks that they overlap:
+with a non-blocking client the wall-clock time stays close to a single round trip,
+and later rounds reuse the pooled keep-alive connections of the first one. Exits with
+1 if the calls opened more sockets than the pool holds, i.e. connections were closed
+after use and opened again.
+
+    python -m benchmarks.bench_async_clients --concurrency 50 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from loguru import logger
+from agents import ReasoningAgent, ReasoningAgentOptions, TextClassifierAgent, TextClassifierAgentOptions
+from classifiers import OpenAIClassifier, OpenAIClassifierOptions
+from clients import close_shared_clients
+from clients.openai_client import DEFAULT_MAX_CONNECTIONS
+from orchestrator_types import RequestContext
+from benchmarks.fake_openai_server import FakeOpenAIState, run_fake_server
+
+
+async def run_benchmark(concurrency: int, rounds: int, streaming: bool) -> list[float]:
+    classifier = OpenAIClassifier(OpenAIClassifierOptions(api_key="fake-key"))
+    reasoning_agent = ReasoningAgent(ReasoningAgentOptions(
+        name="Reasoning Agent",
+        description="Evaluates given task",
+        api_key="fake-key",
+        streaming=streaming
+    ))
+    text_classification_agent = TextClassifierAgent(TextClassifierAgentOptions(
+        name="Text Classification Agent",
+        description="Classifies given sentence",
+        api_key="fake-key",
+        streaming=streaming
+    ))
+    classifier.set_agents({
+        reasoning_agent.id: reasoning_agent,
+        text_classification_agent.id: text_classification_agent
+    })
+
+    timings = []
+    for _ in range(rounds):
+        calls = []
+        for i in range(concurrency):
+            context = RequestContext(
+                user_id="bench-user",
+                session_id=f"session-{i}",
+                request_id=f"request-{i}",
+                original_user_input=f"request {i}"
+            )
+            calls.append(classifier.classify(f"request {i}", [], context))
+            agent = reasoning_agent if i % 2 else text_classification_agent
+            calls.append(agent.handle_request(context, f"request {i}", []))
+
+        start = time.perf_counter()
+        await asyncio.gather(*calls)
+        timings.append(time.perf_counter() - start)
+
+    await close_shared_clients()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--streaming', action='store_true')
+    args = parser.parse_args()
+
+    logger.disable("classifiers")
+    state = FakeOpenAIState(latency=args.latency)
+    with run_fake_server(state, args.port) as base_url:
+        os.environ['OPENAI_BASE_URL'] = base_url
+        timings = asyncio.run(run_benchmark(args.concurrency, args.rounds, args.streaming))
+
+    total_calls = args.concurrency * 2
+    print(f"LLM calls per round:        {total_calls}")
+    print(f"Per-call server latency:    {args.latency:.3f} s")
+    print(f"Serial lower bound:         {total_calls * args.latency:.3f} s")
+    for i, elapsed in enumerate(timings, start=1):
+        print(f"Wall-clock time, round {i}:  {elapsed:.3f} s")
+    print(f"Max concurrent in server:   {state.max_in_flight}")
+    print(f"Requests served:            {state.requests}")
+    print(f"Distinct client sockets:    {len(state.client_ports)}")
+
+    max_connections = int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS))
+    if len(state.client_ports) > max_connections:
+        print(f"\nMore sockets than the pool's {max_connections} connections: connections were not reused")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
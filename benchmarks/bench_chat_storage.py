@@ -0,0 +1,97 @@
+"""
+Throughput of the chat storages: save_messages, fetch_chat and fetch_all_chats.
+
+Runs the same workload against MemoryStorage and SqliteStorage (a fresh database
+file in a temporary directory): --sessions sessions, each saving --pairs message
+pairs for every one of --agents agents, --concurrency sessions at a time, with the
+orchestrator's default history cap. Then every session is read back.
+
+    python -m benchmarks.bench_chat_storage --sessions 500 --pairs 20 --agents 3
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Awaitable, Callable, List
+from loguru import logger
+from chat_storage import ChatStorage, MemoryStorage, SqliteStorage
+from orchestrator_types import ConversationMessage, ConversationRole, OrchestratorConfig
+
+MAX_HISTORY_SIZE = OrchestratorConfig().MAX_MESSAGE_PAIRS_PER_AGENT
+
+
+def message_pair(index: int) -> List[ConversationMessage]:
+    return [
+        ConversationMessage(role=ConversationRole.USER.value, original_user_input=f"question {index}",
+                            short_output="", tokens=2, content=[{'text': f"question {index}"}]),
+        ConversationMessage(role=ConversationRole.ASSISTANT.value, original_user_input=f"question {index}",
+                            short_output=f"answer {index}", tokens=2, content=[{'text': f"answer {index} " * 20}])
+    ]
+
+
+async def timed(operations: int, concurrency: int, sessions: int,
+                session_work: Callable[[int], Awaitable[None]]) -> float:
+    """Run session_work for every session, concurrency at a time; return operations per second."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(session: int) -> None:
+        async with semaphore:
+            await session_work(session)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(session) for session in range(sessions)))
+    return operations / (time.perf_counter() - start)
+
+
+async def run_storage(storage: ChatStorage, sessions: int, pairs: int, agents: int, concurrency: int) -> List[float]:
+    async def save(session: int) -> None:
+        for pair in range(pairs):
+            for agent in range(agents):
+                await storage.save_messages("user", f"session-{session}", f"agent-{agent}",
+                                            message_pair(pair), MAX_HISTORY_SIZE)
+
+    async def fetch(session: int) -> None:
+        for agent in range(agents):
+            await storage.fetch_chat("user", f"session-{session}", f"agent-{agent}")
+
+    async def fetch_all(session: int) -> None:
+        await storage.fetch_all_chats("user", f"session-{session}")
+
+    return [
+        await timed(sessions * pairs * agents, concurrency, sessions, save),
+        await timed(sessions * agents, concurrency, sessions, fetch),
+        await timed(sessions, concurrency, sessions, fetch_all)
+    ]
+
+
+async def run(sessions: int, pairs: int, agents: int, concurrency: int, pool_size: int) -> None:
+    results = {'MemoryStorage': await run_storage(MemoryStorage(), sessions, pairs, agents, concurrency)}
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SqliteStorage(os.path.join(directory, "bench.db"), pool_size=pool_size)
+        try:
+            results['SqliteStorage'] = await run_storage(storage, sessions, pairs, agents, concurrency)
+        finally:
+            storage.close()
+
+    print(f"{sessions} sessions x {agents} agents x {pairs} pairs, concurrency {concurrency}")
+    print(f"{'':<16}{'save_messages/s':>18}{'fetch_chat/s':>16}{'fetch_all_chats/s':>20}")
+    for name, (save, fetch, fetch_all) in results.items():
+        print(f"{name:<16}{save:>18.0f}{fetch:>16.0f}{fetch_all:>20.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=500)
+    parser.add_argument('--pairs', type=int, default=20)
+    parser.add_argument('--agents', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args()
+
+    logger.remove()
+    asyncio.run(run(args.sessions, args.pairs, args.agents, args.concurrency, args.pool_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Classifier prompt size and latency over a long session, with and without compaction.
+
+Replays a --turns turn session through the classifier, saving a request/answer pair
+for the selected agent after every turn, once on a plain MemoryStorage and once on a
+CompactingStorage around one. Agents answer with --answer-words words.
+
+No API key is spent. A scripted classifier builds the real classifier prompt and
+sleeps for --latency seconds plus --seconds-per-1k-tokens for every thousand prompt
+tokens, which stands in for the prefill time of the model. A scripted summarizer
+keeps the first words of every message folded into the summary, and takes
+--summary-latency seconds in the background.
+
+    python -m benchmarks.bench_compaction --turns 50 --threshold 2000 --keep-recent 600
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import Dict, List, Sequence
+from loguru import logger
+from agents import Agent, AgentOptions
+from chat_storage import ChatStorage, CompactingStorage, ConversationSummarizer, MemoryStorage
+from classifiers import Classifier, ClassifierResult
+from orchestrator_types import ConversationMessage, ConversationRole, RequestContext
+from token_counting import default_tokenizer
+
+WORDS = ("order delivery refund label sentiment positive negative neutral answer reasoning step number "
+         "price customer review product update result source search article premise conclusion").split()
+
+
+class PassiveAgent(Agent):
+    async def handle_request(self, context, input_text, chat_history):
+        raise NotImplementedError
+
+
+class ScriptedClassifier(Classifier):
+    def __init__(self, latency: float, seconds_per_1k_tokens: float):
+        super().__init__()
+        self.latency = latency
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.tokenizer = default_tokenizer()
+        self.prompt_tokens: List[int] = []
+        self.build_seconds: List[float] = []
+
+    def build_system_prompt(self, context, chat_history):
+        start = time.perf_counter()
+        prompt = super().build_system_prompt(context, chat_history)
+        self.build_seconds.append(time.perf_counter() - start)
+        return prompt
+
+    async def make_request(self, input_text: str, system_prompt: str, context=None) -> ClassifierResult:
+        tokens = self.tokenizer.count(system_prompt) + self.tokenizer.count(input_text)
+        self.prompt_tokens.append(tokens)
+        await asyncio.sleep(self.latency + self.seconds_per_1k_tokens * tokens / 1000)
+        agent = list(self.agents.values())[len(self.prompt_tokens) % len(self.agents)]
+        return ClassifierResult(input=input_text, agent_selected=agent, accuracy=0.95, action="route",
+                                next_action="respond_to_user", next_action_input="unknown")
+
+
+class ScriptedSummarizer(ConversationSummarizer):
+    def __init__(self, latency: float, max_words: int = 300):
+        self.latency = latency
+        self.max_words = max_words
+        self.calls = 0
+
+    async def summarize(self, summary: str, messages: Sequence[ConversationMessage], usage=None) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        words = summary.split()
+        for message in messages:
+            words.extend(message.content[0]['text'].split()[:12])
+        return ' '.join(words[-self.max_words:])
+
+
+def text(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)) + '.'
+
+
+async def run_session(storage: ChatStorage, turns: int, answer_words: int, latency: float,
+                      seconds_per_1k_tokens: float, seed: int) -> Dict[str, List[float]]:
+    rng = random.Random(seed)
+    classifier = ScriptedClassifier(latency, seconds_per_1k_tokens)
+    classifier.set_agents({agent.id: agent for agent in [
+        PassiveAgent(AgentOptions(name="Text Classification Agent", description="Classifies given sentences into labels")),
+        PassiveAgent(AgentOptions(name="Reasoning Agent", description="Evaluates reasoning and answers")),
+        PassiveAgent(AgentOptions(name="Data Retrieval Agent", description="Searches the web for information")),
+    ]})
+
+    classify_seconds = []
+    for turn in range(turns):
+        user_input = f"Request {turn}: {text(rng, 20)}"
+        context = RequestContext(user_id="bench", session_id="bench", request_id=str(turn), original_user_input=user_input)
+        start = time.perf_counter()
+        chat_history = await storage.fetch_all_chats("bench", "bench")
+        result = await classifier.classify(user_input, chat_history, context)
+        classify_seconds.append(time.perf_counter() - start)
+
+        await storage.save_messages("bench", "bench", result.agent_selected.id, [
+            ConversationMessage(role=ConversationRole.USER.value, original_user_input=user_input, short_output="",
+                                tokens=20, content=[{'text': user_input}]),
+            ConversationMessage(role=ConversationRole.ASSISTANT.value, original_user_input=user_input, short_output="",
+                                tokens=answer_words, content=[{'text': text(rng, answer_words)}])
+        ], 100)
+    return {'prompt_tokens': classifier.prompt_tokens, 'classify_seconds': classify_seconds,
+            'build_seconds': classifier.build_seconds}
+
+
+async def run(turns: int, answer_words: int, latency: float, seconds_per_1k_tokens: float,
+              summary_latency: float, threshold: int, keep_recent: int, seed: int) -> None:
+    summarizer = ScriptedSummarizer(summary_latency)
+    compacting = CompactingStorage(MemoryStorage(), summarizer, threshold_tokens=threshold,
+                                   keep_recent_tokens=keep_recent)
+    results = {
+        'full history': await run_session(MemoryStorage(), turns, answer_words, latency, seconds_per_1k_tokens, seed),
+        'compacted': await run_session(compacting, turns, answer_words, latency, seconds_per_1k_tokens, seed)
+    }
+    await compacting.wait_for_compactions()
+
+    checkpoints = [turn for turn in (10, 25, 50, turns) if turn <= turns]
+    checkpoints = sorted(set(checkpoints))
+    print(f"{turns} turns, {answer_words} word answers, compaction over {threshold} tokens keeping {keep_recent}")
+    print(f"{'':<14}" + ''.join(f"{f'tokens @{turn}':>13}" for turn in checkpoints)
+          + f"{'mean tokens':>13}{'p50 ms':>9}{'p95 ms':>9}{'build ms':>10}")
+    for name, result in results.items():
+        tokens, seconds = result['prompt_tokens'], result['classify_seconds']
+        quantiles = statistics.quantiles(seconds, n=20)
+        print(f"{name:<14}" + ''.join(f"{tokens[turn - 1]:>13}" for turn in checkpoints)
+              + f"{statistics.mean(tokens):>13.0f}{statistics.median(seconds) * 1000:>9.0f}"
+              + f"{quantiles[18] * 1000:>9.0f}{statistics.mean(result['build_seconds']) * 1000:>10.3f}")
+    print(f"summarizer calls: {summarizer.calls}, compaction metrics: {compacting.metrics()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=50)
+    parser.add_argument('--answer-words', type=int, default=150)
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--seconds-per-1k-tokens', type=float, default=0.1)
+    parser.add_argument('--summary-latency', type=float, default=1.0)
+    parser.add_argument('--threshold', type=int, default=2000)
+    parser.add_argument('--keep-recent', type=int, default=600)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    logger.remove()
+    asyncio.run(run(args.turns, args.answer_words, args.latency, args.seconds_per_1k_tokens,
+                    args.summary_latency, args.threshold, args.keep_recent, args.seed))
+
+
+if __name__ == '__main__':
+    main()
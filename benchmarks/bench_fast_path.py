@@ -0,0 +1,115 @@
+"""
+Hit rate, agreement and latency saved by the local fast-path pre-router.
+
+A scripted classifier stands in for the LLM: it sleeps for a fixed latency and
+routes by the template the request was generated from. Requests are drawn from a
+few templates with varying payloads, including a multi-step template that must
+keep going to the LLM. The fast path learns from the scripted routings as they come
+in; its decisions are checked against the scripted label of the same request.
+
+    python -m benchmarks.bench_fast_path --requests 500 --latency 0.4
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import List
+from loguru import logger
+from agents import Agent, AgentOptions
+from classifiers import Classifier, ClassifierResult, FastPathClassifier, FastPathClassifierOptions
+from orchestrator_types import RequestContext
+
+SUBJECTS = ["the delivery", "my order", "this phone", "the support team", "the new update", "our hotel room",
+            "the checkout page", "the refund", "this laptop", "the weather app", "your pricing", "the concert"]
+OPINIONS = ["was great", "was terrible", "arrived late", "keeps crashing", "is fine", "exceeded expectations",
+            "made me angry", "is confusing", "works as expected", "was a waste of money"]
+
+TEMPLATES = [
+    ("Classify below sentence into positive, negative or neutral: {subject} {opinion}.",
+     "text-classification-agent", "respond_to_user"),
+    ("Evaluate whether the answer '{subject} {opinion}' follows from the question about {subject}.",
+     "reasoning-agent", "respond_to_user"),
+    ("Search the web for recent news about {subject}.",
+     "data-retrieval-agent", "respond_to_user"),
+    ("Classify the sentiment of '{subject} {opinion}' and then explain the reasoning behind the label.",
+     "text-classification-agent", "route"),
+]
+
+
+class PassiveAgent(Agent):
+    async def handle_request(self, context, input_text, chat_history):
+        raise NotImplementedError
+
+
+class ScriptedClassifier(Classifier):
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.labels = {}
+
+    async def make_request(self, input_text: str, system_prompt: str, context=None) -> ClassifierResult:
+        await asyncio.sleep(self.latency)
+        agent_id, next_action = self.labels[input_text]
+        return ClassifierResult(input=input_text, agent_selected=self.agents[agent_id], accuracy=0.95,
+                                action="route", next_action=next_action, next_action_input="unknown")
+
+
+def generate_requests(count: int, seed: int) -> List[tuple]:
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        template, agent_id, next_action = rng.choice(TEMPLATES)
+        text = template.format(subject=rng.choice(SUBJECTS), opinion=rng.choice(OPINIONS))
+        requests.append((text, agent_id, next_action))
+    return requests
+
+
+async def run(requests: int, latency: float, threshold: float, seed: int) -> None:
+    scripted = ScriptedClassifier(latency)
+    classifier = FastPathClassifier(FastPathClassifierOptions(classifier=scripted, confidence_threshold=threshold))
+    classifier.set_agents({agent.id: agent for agent in [
+        PassiveAgent(AgentOptions(name="Text Classification Agent", description="Classifies given sentences into labels")),
+        PassiveAgent(AgentOptions(name="Reasoning Agent", description="Evaluates reasoning and answers")),
+        PassiveAgent(AgentOptions(name="Data Retrieval Agent", description="Searches the web for information")),
+    ]})
+
+    agreed = disagreed = early_stops = 0
+    start = time.perf_counter()
+    for index, (text, agent_id, next_action) in enumerate(generate_requests(requests, seed)):
+        scripted.labels[text] = (agent_id, next_action)
+        context = RequestContext(user_id="bench", session_id="bench", request_id=str(index), original_user_input=text)
+        hits_before = classifier.fast_path_hits
+        result = await classifier.classify(text, [], context)
+        if classifier.fast_path_hits > hits_before:
+            if result.agent_selected.id == agent_id:
+                agreed += 1
+            else:
+                disagreed += 1
+            if next_action != result.next_action:
+                early_stops += 1
+    elapsed = time.perf_counter() - start
+
+    metrics = classifier.metrics()
+    print(f"Requests:                   {requests}")
+    print(f"Fast path hit rate:         {metrics['fast_path_hit_rate'] * 100:.1f} %")
+    print(f"Fast path agreement:        {agreed} agreed, {disagreed} disagreed, {early_stops} multi-step cut short")
+    print(f"LLM classifier latency:     {metrics['average_llm_ms']:.1f} ms")
+    print(f"Fast path latency:          {metrics['average_fast_path_ms']:.3f} ms")
+    print(f"Latency saved:              {metrics['latency_saved_seconds']:.1f} s")
+    print(f"Total classification time:  {elapsed:.1f} s (all LLM: {requests * latency:.1f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.4)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    logger.remove()
+    asyncio.run(run(args.requests, args.latency, args.threshold, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+CPU cost of open but idle response streams.
+
+Serves fastapi_server.app in-process with its LLM calls pointed at the fake endpoint,
+configured with a long latency so every stream sits idle waiting for the model. Opens
+N concurrent /orchestrated_chat streams and samples the process CPU time while they
+wait. A busy-polling stream costs a full core; an awaiting one costs close to nothing.
+
+    python -m benchmarks.bench_idle_streams --streams 50 --latency 10 --window 5
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+import httpx
+import uvicorn
+from benchmarks.fake_openai_server import FakeOpenAIState, run_fake_server
+
+
+async def open_stream(client: httpx.AsyncClient, url: str, user_index: int) -> None:
+    payload = {"user_input": f"Evaluate request {user_index}", "user_id": f"user-{user_index}", "session_id": "bench"}
+    async with client.stream("POST", url, json=payload) as response:
+        async for _ in response.aiter_text():
+            pass
+
+
+async def measure(url: str, streams: int, window: float) -> float:
+    async with httpx.AsyncClient(timeout=None) as client:
+        tasks = [asyncio.create_task(open_stream(client, url, i)) for i in range(streams)]
+        # Let every request get through guards and into the (slow) model call
+        await asyncio.sleep(min(1.0, window))
+        cpu_start = time.process_time()
+        await asyncio.sleep(window)
+        cpu_used = time.process_time() - cpu_start
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return cpu_used
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=10.0)
+    parser.add_argument('--window', type=float, default=5.0)
+    parser.add_argument('--fake-port', type=int, default=8900)
+    parser.add_argument('--port', type=int, default=8901)
+    args = parser.parse_args()
+
+    state = FakeOpenAIState(latency=args.latency)
+    with run_fake_server(state, args.fake_port) as base_url:
+        os.environ['OPENAI_BASE_URL'] = base_url
+        for key in ('CLASSIFIER_API_KEY', 'TEXT_CLASSIFIER_API_KEY', 'REASONING_API_KEY', 'DATA_RETRIEVER_API_KEY'):
+            os.environ.setdefault(key, 'fake-key')
+        from fastapi_server import app
+
+        server = uvicorn.Server(uvicorn.Config(app, port=args.port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.01)
+        try:
+            cpu_used = asyncio.run(measure(f"http://127.0.0.1:{args.port}/orchestrated_chat",
+                                           args.streams, args.window))
+        finally:
+            server.should_exit = True
+            thread.join()
+
+    print(f"Idle streams:               {args.streams}")
+    print(f"Requests waiting in model:  {state.max_in_flight}")
+    print(f"Measurement window:         {args.window:.1f} s")
+    print(f"Process CPU in window:      {cpu_used:.3f} s")
+    print(f"CPU per idle stream:        {cpu_used / args.window / args.streams * 100:.3f} % of a core")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Load test of the FastAPI server against the fake OpenAI endpoint.
+
+Starts benchmarks.fake_openai_server and fastapi_server.app (through uvicorn) as child
+processes, the app's LLM calls pointed at the fake endpoint, then has --users
+concurrent users send --requests /orchestrated_chat requests each, one after the
+other, reading every streamed answer to the end. Requests are picked round robin from
+prompts that the --routing script sends to one or several agents.
+
+Reports throughput, latency and time to first byte percentiles, failed requests and the
+CPU time the app process spent per request (read from /proc, so Linux only). Pass --url
+to load an app that is already running instead; its CPU is then not measured.
+
+No API key is spent.
+
+    python -m benchmarks.bench_load --users 20 --requests 10 --latency 0.3 --jitter 0.1 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+import httpx
+
+PROMPTS = [
+    "Classify the sentiment of this review: the delivery was late but support fixed it quickly.",
+    "Evaluate the reasoning: all squares are rectangles, so all rectangles are squares.",
+    "Search for the latest release of Python and explain why it matters.",
+    "Classify this sentence as positive or negative and explain the label: I love this product.",
+]
+DEFAULT_ROUTING = os.path.join(os.path.dirname(__file__), "routing_example.json")
+FAILURE_MARKERS = ("Something went wrong", "Unable to process request", "I am Sorry, I couldn't determine")
+
+
+@dataclass
+class RequestResult:
+    seconds: float
+    first_byte_seconds: Optional[float]
+    ok: bool
+
+
+def percentile(values: List[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else float('nan')
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User and system CPU time of a process, None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+async def send_request(client: httpx.AsyncClient, url: str, user: int, index: int) -> RequestResult:
+    payload = {"user_input": PROMPTS[(user + index) % len(PROMPTS)], "user_id": f"load-user-{user}",
+               "session_id": "load"}
+    start = time.perf_counter()
+    first_byte = None
+    body = []
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            async for text in response.aiter_text():
+                if first_byte is None and text:
+                    first_byte = time.perf_counter() - start
+                body.append(text)
+            ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    answer = ''.join(body)
+    ok = ok and bool(answer.strip()) and not any(marker in answer for marker in FAILURE_MARKERS)
+    return RequestResult(seconds=time.perf_counter() - start, first_byte_seconds=first_byte, ok=ok)
+
+
+async def run_user(client: httpx.AsyncClient, url: str, user: int, requests: int) -> List[RequestResult]:
+    return [await send_request(client, url, user, index) for index in range(requests)]
+
+
+async def run_load(url: str, users: int, requests: int, warmup: int, server_pid: Optional[int]) -> None:
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(300.0), limits=limits) as client:
+        await asyncio.gather(*[send_request(client, url, user, 0) for user in range(min(warmup, users))])
+
+        cpu_start = process_cpu_seconds(server_pid) if server_pid else None
+        start = time.perf_counter()
+        per_user = await asyncio.gather(*[run_user(client, url, user, requests) for user in range(users)])
+        wall_seconds = time.perf_counter() - start
+        cpu_end = process_cpu_seconds(server_pid) if server_pid else None
+
+    results = [result for user_results in per_user for result in user_results]
+    succeeded = [result for result in results if result.ok]
+    latencies = [result.seconds for result in succeeded]
+    first_bytes = [result.first_byte_seconds for result in succeeded if result.first_byte_seconds is not None]
+
+    print(f"{users} users x {requests} requests, {len(results)} requests in {wall_seconds:.2f} s")
+    print(f"Throughput:                 {len(succeeded) / wall_seconds:.2f} requests/s")
+    print(f"Failed requests:            {len(results) - len(succeeded)} ({(len(results) - len(succeeded)) / len(results):.1%})")
+    if latencies:
+        print(f"Latency p50/p95/p99:        {percentile(latencies, 50) * 1000:.0f} / "
+              f"{percentile(latencies, 95) * 1000:.0f} / {percentile(latencies, 99) * 1000:.0f} ms")
+    if first_bytes:
+        print(f"Time to first byte p50/p95/p99: {percentile(first_bytes, 50) * 1000:.0f} / "
+              f"{percentile(first_bytes, 95) * 1000:.0f} / {percentile(first_bytes, 99) * 1000:.0f} ms")
+    if cpu_start is not None and cpu_end is not None:
+        print(f"App CPU per request:        {(cpu_end - cpu_start) / len(results) * 1000:.2f} ms")
+    else:
+        print("App CPU per request:        not measured")
+
+
+def wait_until_up(url: str, process: Optional[subprocess.Popen], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before it was up")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=10, help="Requests per user")
+    parser.add_argument('--warmup', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--chunk-delay', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--routing', default=DEFAULT_ROUTING)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--fake-port', type=int, default=8910)
+    parser.add_argument('--port', type=int, default=8911)
+    parser.add_argument('--url', help="Base URL of an app that is already running")
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    children: List[subprocess.Popen] = []
+    try:
+        server_pid = None
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            fake = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_openai_server", "--port", str(args.fake_port),
+                                     "--latency", str(args.latency), "--jitter", str(args.jitter),
+                                     "--chunk-delay", str(args.chunk_delay), "--error-rate", str(args.error_rate),
+                                     "--routing", args.routing, "--seed", str(args.seed)])
+            children.append(fake)
+            wait_until_up(f"{fake_url}/docs", fake, args.startup_timeout)
+
+            env = {**os.environ, 'OPENAI_BASE_URL': f"{fake_url}/v1"}
+            for key in ('CLASSIFIER_API_KEY', 'TEXT_CLASSIFIER_API_KEY', 'REASONING_API_KEY', 'DATA_RETRIEVER_API_KEY'):
+                env.setdefault(key, 'fake-key')
+            app = subprocess.Popen([sys.executable, "-m", "uvicorn", "fastapi_server:app", "--port", str(args.port),
+                                    "--log-level", "warning"], env=env)
+            children.append(app)
+            base_url = f"http://127.0.0.1:{args.port}"
+            wait_until_up(f"{base_url}/sessions/metrics", app, args.startup_timeout)
+            server_pid = app.pid
+
+        asyncio.run(run_load(f"{base_url}/orchestrated_chat", args.users, args.requests, args.warmup, server_pid))
+    finally:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Per-call latency of MemoryStorage.fetch_all_chats as the number of sessions grows.
+
+Fills the storage in steps up to --sessions sessions, each with a few agents and
+message pairs, and after every step times fetch_all_chats for randomly chosen
+sessions. The reads only touch the session being served, so the latency should
+stay flat while the process holds more and more sessions.
+
+    python -m benchmarks.bench_memory_storage --sessions 100000 --agents 3 --pairs 2
+"""
+import argparse
+import asyncio
+import random
+import time
+from loguru import logger
+from chat_storage import MemoryStorage
+from orchestrator_types import ConversationMessage, ConversationRole
+
+
+def message_pair(index: int):
+    return [
+        ConversationMessage(role=ConversationRole.USER.value, original_user_input=f"question {index}",
+                            short_output="", tokens=2, content=[{'text': f"question {index}"}]),
+        ConversationMessage(role=ConversationRole.ASSISTANT.value, original_user_input=f"question {index}",
+                            short_output=f"answer {index}", tokens=2, content=[{'text': f"answer {index}"}])
+    ]
+
+
+async def fill(storage: MemoryStorage, start: int, stop: int, agents: int, pairs: int) -> None:
+    for session in range(start, stop):
+        for pair in range(pairs):
+            for agent in range(agents):
+                await storage.save_messages(f"user-{session % 1000}", f"session-{session}",
+                                            f"agent-{agent}", message_pair(pair))
+
+
+async def time_fetches(storage: MemoryStorage, sessions: int, calls: int) -> float:
+    rng = random.Random(sessions)
+    start = time.perf_counter()
+    for _ in range(calls):
+        session = rng.randrange(sessions)
+        await storage.fetch_all_chats(f"user-{session % 1000}", f"session-{session}")
+    return (time.perf_counter() - start) / calls
+
+
+async def run(sessions: int, agents: int, pairs: int, calls: int) -> None:
+    storage = MemoryStorage()
+    steps = [size for size in (1000, 10000, 100000, 1000000) if size < sessions] + [sessions]
+    filled = 0
+    print(f"{'Sessions':>10}  {'Messages':>10}  {'fetch_all_chats':>16}")
+    for size in steps:
+        await fill(storage, filled, size, agents, pairs)
+        filled = size
+        latency = await time_fetches(storage, size, calls)
+        print(f"{size:>10}  {size * agents * pairs * 2:>10}  {latency * 1e6:>13.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--agents', type=int, default=3)
+    parser.add_argument('--pairs', type=int, default=2)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    logger.remove()
+    asyncio.run(run(args.sessions, args.agents, args.pairs, args.calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Memory held by MemoryStorage and allocations made by its read and write paths.
+
+Fills --sessions sessions with --pairs message pairs each (100 pairs is the
+per-agent default cap of the orchestrator) and reports, with tracemalloc:
+the bytes retained per stored message, the peak bytes allocated by fetch_chat,
+fetch_all_chats and save_messages calls. A dict-backed message class with the
+same fields, copied the way reads used to copy, is measured alongside.
+
+    python -m benchmarks.bench_message_memory --sessions 2000 --pairs 100
+"""
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+from loguru import logger
+from chat_storage import MemoryStorage
+from orchestrator_types import ConversationMessage, ConversationRole
+
+
+class DictBackedMessage:
+    """Same fields as TimestampedMessage, stored in a per-instance __dict__."""
+    def __init__(self, role, original_user_input, short_output, content=None, tokens=0, timestamp=None, agent_id=None):
+        self.role = role
+        self.original_user_input = original_user_input
+        self.short_output = short_output
+        self.tokens = tokens
+        self.content = content
+        self.timestamp = timestamp or int(time.time() * 1000)
+        self.agent_id = agent_id
+
+
+def message_pair(session: int, index: int):
+    question = f"Question {index} of session {session}"
+    return [
+        ConversationMessage(role=ConversationRole.USER.value, original_user_input=question,
+                            short_output="", tokens=5, content=[{'text': question}]),
+        ConversationMessage(role=ConversationRole.ASSISTANT.value, original_user_input=question,
+                            short_output=f"Answer {index}", tokens=2, content=[{'text': f"Answer {index} of session {session}"}])
+    ]
+
+
+def traced(function):
+    """Run function and return (its result, bytes it allocated that are still held, peak bytes allocated)."""
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def run(sessions: int, pairs: int, reads: int) -> None:
+    loop = asyncio.new_event_loop()
+    storage = MemoryStorage()
+    messages = [(session, message_pair(session, index)) for session in range(sessions) for index in range(pairs)]
+    stored = sessions * pairs * 2
+
+    async def fill():
+        for session, pair in messages:
+            await storage.save_messages("user", f"session-{session}", "reasoning-agent", pair, max_history_size=pairs * 2)
+    _, retained, _ = traced(lambda: loop.run_until_complete(fill()))
+
+    def dict_backed_copies():
+        return [DictBackedMessage(role=message.role, original_user_input=message.original_user_input,
+                                  short_output=message.short_output, content=list(message.content),
+                                  tokens=message.tokens, agent_id="reasoning-agent")
+                for _, pair in messages for message in pair]
+    _, dict_backed_retained, _ = traced(dict_backed_copies)
+
+    async def read_all(fetch):
+        for i in range(reads):
+            await fetch(i % sessions)
+    _, _, fetch_chat_peak = traced(lambda: loop.run_until_complete(read_all(
+        lambda session: storage.fetch_chat("user", f"session-{session}", "reasoning-agent"))))
+    _, _, fetch_all_peak = traced(lambda: loop.run_until_complete(read_all(
+        lambda session: storage.fetch_all_chats("user", f"session-{session}"))))
+
+    extra = message_pair(sessions, pairs)
+    _, _, save_peak = traced(lambda: loop.run_until_complete(
+        storage.save_messages("user", "session-0", "reasoning-agent", extra, max_history_size=pairs * 2)))
+    loop.close()
+
+    print(f"Stored messages:            {stored}")
+    print(f"Retained by storage:        {retained / stored:.0f} bytes per message")
+    print(f"Dict-backed copies:         {dict_backed_retained / stored:.0f} bytes per message")
+    print(f"fetch_chat peak:            {fetch_chat_peak / 1024:.1f} KiB over {reads} calls of {pairs * 2} messages")
+    print(f"fetch_all_chats peak:       {fetch_all_peak / 1024:.1f} KiB over {reads} calls of {pairs * 2} messages")
+    print(f"save_messages peak:         {save_peak / 1024:.1f} KiB for one pair")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--pairs', type=int, default=100)
+    parser.add_argument('--reads', type=int, default=1000)
+    args = parser.parse_args()
+
+    logger.remove()
+    run(args.sessions, args.pairs, args.reads)
+
+
+if __name__ == '__main__':
+    main()
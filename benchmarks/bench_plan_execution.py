@@ -0,0 +1,113 @@
+"""
+Wall-clock time of hop by hop routing versus plan-once execution.
+
+Uses a scripted classifier and agents that sleep for a fixed LLM latency, so the
+numbers isolate the orchestration strategy. The scenario is "classify N sentences,
+then reason about the results": hop by hop routing pays a classifier call and an
+agent call per sentence in series, while the plan runs the classifications
+concurrently and the reasoning step once they are done.
+
+    python -m benchmarks.bench_plan_execution --sentences 5 --latency 0.5
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+from loguru import logger
+from agents import Agent, AgentOptions
+from classifiers import Classifier, ClassifierResult, PlanStep
+from orchestrator import Orchestrator
+from orchestrator_types import ConversationMessage, ConversationRole, OrchestratorConfig, RequestContext
+
+
+class SimulatedAgent(Agent):
+    def __init__(self, options: AgentOptions, latency: float):
+        super().__init__(options)
+        self.latency = latency
+
+    async def handle_request(self,
+                             context: RequestContext,
+                             input_text: str,
+                             chat_history: List[ConversationMessage]) -> ConversationMessage:
+        await asyncio.sleep(self.latency)
+        return ConversationMessage(
+            role=ConversationRole.ASSISTANT.value,
+            original_user_input=context.original_user_input,
+            short_output=f"{self.id} result",
+            tokens=2,
+            content=[{'text': f"{self.id} answered: {input_text.splitlines()[0]}"}]
+        )
+
+
+class ScriptedClassifier(Classifier):
+    """Routes sentence i on hop i and the reasoning task on the last hop."""
+    def __init__(self, sentences: int, latency: float):
+        super().__init__()
+        self.sentences = sentences
+        self.latency = latency
+
+    async def classify(self,
+                       input_text: str,
+                       chat_history: List[ConversationMessage],
+                       context: RequestContext,
+                       fused: bool = False) -> ClassifierResult:
+        await asyncio.sleep(self.latency)
+        hop = len(chat_history) // 2
+        last_hop = hop == self.sentences
+        return ClassifierResult(
+            input="Reason about the labels" if last_hop else f"Classify sentence {hop + 1}",
+            agent_selected=self.agents['reasoning-agent' if last_hop else 'text-classification-agent'],
+            accuracy=1.0,
+            action="route",
+            next_action="respond_to_user" if last_hop else "route",
+            next_action_input="unknown"
+        )
+
+    async def make_request(self, input_text: str, system_prompt: str, context=None) -> ClassifierResult:
+        raise NotImplementedError
+
+    async def make_plan_request(self, input_text: str, system_prompt: str, context=None) -> List[PlanStep]:
+        await asyncio.sleep(self.latency)
+        steps = [PlanStep(id=f"c{i}", input=f"Classify sentence {i}",
+                          agent_selected=self.agents['text-classification-agent'])
+                 for i in range(1, self.sentences + 1)]
+        steps.append(PlanStep(id="r", input="Reason about the labels",
+                              agent_selected=self.agents['reasoning-agent'],
+                              depends_on=[step.id for step in steps]))
+        return steps
+
+
+async def run_mode(mode: str, sentences: int, latency: float, requests: int) -> float:
+    orchestrator = Orchestrator(options=OrchestratorConfig(EXECUTION_MODE=mode),
+                                classifier=ScriptedClassifier(sentences, latency))
+    orchestrator.add_agent(SimulatedAgent(AgentOptions(name="Text Classification Agent", description="classifies"), latency))
+    orchestrator.add_agent(SimulatedAgent(AgentOptions(name="Reasoning Agent", description="reasons"), latency))
+
+    start = time.perf_counter()
+    for i in range(requests):
+        results = await orchestrator.route_request("Classify the sentences then reason about them",
+                                                   "bench-user", f"{mode}-{i}", f"{mode}-request-{i}")
+        assert len(results) == sentences + 1, results
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sentences', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--requests', type=int, default=3)
+    args = parser.parse_args()
+
+    logger.remove()
+    loop_time = asyncio.run(run_mode("loop", args.sentences, args.latency, args.requests))
+    plan_time = asyncio.run(run_mode("plan", args.sentences, args.latency, args.requests))
+
+    print(f"Sub-tasks per request:      {args.sentences + 1}")
+    print(f"Simulated LLM latency:      {args.latency:.3f} s")
+    print(f"Hop by hop loop:            {loop_time:.3f} s per request")
+    print(f"Plan-once execution:        {plan_time:.3f} s per request")
+    print(f"Speed-up:                   {loop_time / plan_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
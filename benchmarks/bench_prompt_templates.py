@@ -0,0 +1,141 @@
+"""
+Prompt assembly cost and cacheable prefix of the classifier and agent prompts.
+
+For the classifier prompt, the plan prompt and every agent prompt, renders the prompt
+of --requests requests with --history messages of history:
+
+1. with the regex substitution over the raw template (replace_placeholders) and with
+   the compiled template, reporting the microseconds per prompt;
+2. for two requests of different users, the prefix both prompts share, which is what a
+   provider-side prompt cache can reuse, in tokens, for the raw and the compiled
+   template, next to the size of the whole prompt in tokens and bytes (compiled
+   templates are dedented, which a tokenizer that ignores whitespace does not show);
+3. the tokens of every section of the compiled classifier prompt.
+
+Exits with 1 if the token report of any compiled prompt has an empty cacheable prefix.
+
+No model is called.
+
+    python -m benchmarks.bench_prompt_templates --requests 2000 --history 10
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from typing import Callable, Dict, List
+from loguru import logger
+from agents import (Agent, DataRetrievalAgent, DataRetrievalAgentOptions, ReasoningAgent, ReasoningAgentOptions,
+                    TextClassifierAgent, TextClassifierAgentOptions)
+from classifiers import Classifier
+from orchestrator_types import ConversationRole, TimestampedMessage
+from prompts import compile_template
+from token_counting import default_tokenizer
+
+WORDS = ("order delivery refund label sentiment positive negative neutral answer reasoning step number "
+         "price customer review product update result source search article premise conclusion").split()
+
+
+class PassiveClassifier(Classifier):
+    async def make_request(self, input_text, system_prompt, context=None):
+        raise NotImplementedError
+
+
+def text(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)) + '.'
+
+
+def request_variables(rng: random.Random, history: int) -> Dict[str, str]:
+    messages = []
+    for index in range(history):
+        role = ConversationRole.USER.value if index % 2 == 0 else ConversationRole.ASSISTANT.value
+        messages.append(TimestampedMessage(role=role, original_user_input=text(rng, 15), short_output="",
+                                           content=[{'text': text(rng, 15 if index % 2 == 0 else 80)}],
+                                           agent_id="reasoning-agent"))
+    return {
+        "ORIGINAL_USER_INPUT": text(rng, 30),
+        "SUBTASK_INPUT": text(rng, 15),
+        "HISTORY": Classifier.format_messages(messages)
+    }
+
+
+def replace_placeholders(template: str, variables: Dict[str, str]) -> str:
+    """The regex substitution the agents and the classifier used before templates were compiled."""
+    return re.sub(r'{{(\w+)}}', lambda match: variables.get(match.group(1), match.group(0)), template)
+
+
+def per_prompt_microseconds(render: Callable[[Dict[str, str]], str], requests: List[Dict[str, str]]) -> float:
+    start = time.perf_counter()
+    for variables in requests:
+        render(variables)
+    return (time.perf_counter() - start) / len(requests) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--history', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    logger.remove()
+
+    agents: List[Agent] = [
+        TextClassifierAgent(TextClassifierAgentOptions(name="Text Classification Agent", api_key="unused",
+                                                       description="Classifies given sentenence into provided classification label.")),
+        ReasoningAgent(ReasoningAgentOptions(name="Reasoning Agent", api_key="unused",
+                                             description="Evaluates given task and provides in depth reasons to justify arrived solution.")),
+        DataRetrievalAgent(DataRetrievalAgentOptions(name="Data Retrieval Agent", api_key="unused", use_google_tool=True,
+                                                     description="Answer given question using provided knowledge base or search tool."))
+    ]
+    classifier = PassiveClassifier()
+    classifier.set_agents({agent.id: agent for agent in agents})
+
+    templates = {
+        'classifier': (classifier.prompt_template, {"AGENT_DESCRIPTIONS": classifier.agent_descriptions}),
+        'classifier fused': (classifier.fused_template, {"AGENT_DESCRIPTIONS": classifier.agent_descriptions,
+                                                          "FUSED_AGENT_DESCRIPTIONS": classifier.fused_agent_descriptions}),
+        'classifier plan': (classifier.plan_prompt_template, {"AGENT_DESCRIPTIONS": classifier.agent_descriptions}),
+        **{agent.id: (agent.prompt_template, {}) for agent in agents}
+    }
+
+    rng = random.Random(args.seed)
+    requests = [request_variables(rng, args.history) for _ in range(args.requests)]
+    tokenizer = default_tokenizer()
+
+    print(f"{args.requests} prompts with {args.history} history messages, tokens counted with {type(tokenizer).__name__}")
+    empty_prefixes = []
+    print(f"{'':<26}{'raw us':>8}{'compiled us':>13}{'raw prefix':>12}{'raw total':>11}"
+          f"{'compiled prefix':>17}{'compiled total':>16}{'raw bytes':>11}{'compiled bytes':>16}")
+    for name, (template, static) in templates.items():
+        compiled = compile_template(template).bind(**static)
+
+        def raw(variables, template=template, static=static):
+            return replace_placeholders(template, {**variables, **static})
+
+        raw_us = per_prompt_microseconds(raw, requests)
+        compiled_us = per_prompt_microseconds(compiled.render, requests)
+
+        first, second = requests[0], requests[1]
+        raw_prefix = os.path.commonprefix([raw(first), raw(second)])
+        compiled_prefix = os.path.commonprefix([compiled.render(first), compiled.render(second)])
+        print(f"{name:<26}{raw_us:>8.1f}{compiled_us:>13.1f}{tokenizer.count(raw_prefix):>12}"
+              f"{tokenizer.count(raw(first)):>11}{tokenizer.count(compiled_prefix):>17}"
+              f"{tokenizer.count(compiled.render(first)):>16}{len(raw(first).encode()):>11}"
+              f"{len(compiled.render(first).encode()):>16}")
+        if not compiled.token_report(first, tokenizer)['cacheable_prefix']:
+            empty_prefixes.append(name)
+
+    print("\nSections of the compiled classifier prompt:")
+    report = compile_template(classifier.prompt_template).bind(
+        AGENT_DESCRIPTIONS=classifier.agent_descriptions).token_report(requests[0], tokenizer)
+    for section, tokens in report.items():
+        print(f"  {section:<44}{tokens:>6}")
+
+    if empty_prefixes:
+        print(f"\nNo cacheable prefix: {', '.join(empty_prefixes)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
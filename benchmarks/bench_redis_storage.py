@@ -0,0 +1,163 @@
+"""
+Correctness and per-hop latency of RedisStorage against an in-process fake server.
+
+Starts fakeredis' TCP server on a local port in a background thread (or uses --url
+to target a real Redis), then:
+
+1. replays a scripted conversation into RedisStorage and MemoryStorage and checks
+   that fetch_chat, fetch_all_chats, trimming, the consecutive-role check and
+   delete_session agree;
+2. runs --sessions sessions, --concurrency of them at a time, each doing --hops hops
+   of the orchestrator's storage traffic (fetch_all_chats, fetch_chat, save_messages),
+   and reports the latency percentiles of each call and the server commands sent per
+   call.
+
+The fake server is pure Python and shares the interpreter (and its GIL) with the
+client, so under high concurrency it is the bottleneck and the latencies mostly show
+its queue; run with --concurrency 1 for the cost of one round trip, and against a
+real server with --url for the latency target.
+
+    python -m benchmarks.bench_redis_storage --sessions 1000 --hops 5
+    python -m benchmarks.bench_redis_storage --sessions 200 --concurrency 1
+    python -m benchmarks.bench_redis_storage --url redis://localhost:6379/0
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+import fakeredis
+from loguru import logger
+from chat_storage import MemoryStorage, RedisStorage
+from orchestrator_types import ConversationMessage, ConversationRole, OrchestratorConfig
+
+MAX_HISTORY_SIZE = OrchestratorConfig().MAX_MESSAGE_PAIRS_PER_AGENT
+
+
+@contextmanager
+def run_fake_redis(port: int) -> Iterator[str]:
+    server = fakeredis.TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"redis://127.0.0.1:{port}/0"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def message(role: ConversationRole, text: str) -> ConversationMessage:
+    return ConversationMessage(role=role.value, original_user_input="original", short_output=f"short {text}",
+                               tokens=len(text.split()), content=[{'text': text}])
+
+
+def message_pair(index: int) -> List[ConversationMessage]:
+    return [message(ConversationRole.USER, f"question {index}"), message(ConversationRole.ASSISTANT, f"answer {index}")]
+
+
+def as_tuples(messages) -> List[tuple]:
+    return [(m.role, m.agent_id, m.original_user_input, m.short_output, m.tokens, m.content[0]['text'])
+            for m in messages]
+
+
+async def check_against_memory(redis_storage: RedisStorage) -> None:
+    memory_storage = MemoryStorage()
+    for storage in (redis_storage, memory_storage):
+        await storage.delete_session("check-user", "check-session")
+        for index in range(6):
+            await storage.save_messages("check-user", "check-session", f"agent-{index % 2}", message_pair(index), 4)
+            # Distinct timestamps: storages may break ties between agents differently
+            await asyncio.sleep(0.002)
+        assert await storage.save_message("check-user", "check-session", "agent-2", message(ConversationRole.USER, "q"))
+        assert not await storage.save_message("check-user", "check-session", "agent-2", message(ConversationRole.USER, "q"))
+
+    for fetch in (lambda s: s.fetch_chat("check-user", "check-session", "agent-0"),
+                  lambda s: s.fetch_chat("check-user", "check-session", "agent-1", 2),
+                  lambda s: s.fetch_all_chats("check-user", "check-session")):
+        redis_messages, memory_messages = as_tuples(await fetch(redis_storage)), as_tuples(await fetch(memory_storage))
+        assert redis_messages == memory_messages, (redis_messages, memory_messages)
+
+    assert await redis_storage.delete_session("check-user", "check-session")
+    assert not await redis_storage.fetch_all_chats("check-user", "check-session")
+    print("RedisStorage matches MemoryStorage")
+
+
+async def measure(storage: RedisStorage, sessions: int, hops: int, concurrency: int) -> None:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    commands: Dict[str, int] = defaultdict(int)
+    current_call = {}
+    execute_command = storage.client.execute_command
+
+    async def counting_execute_command(*args, **kwargs):
+        commands[current_call.get(asyncio.current_task(), 'other')] += 1
+        return await execute_command(*args, **kwargs)
+    storage.client.execute_command = counting_execute_command
+
+    async def timed(name, call):
+        current_call[asyncio.current_task()] = name
+        start = time.perf_counter()
+        await call
+        latencies[name].append(time.perf_counter() - start)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def session(index: int) -> None:
+        user_id, session_id = f"user-{index}", f"session-{index}"
+        async with semaphore:
+            await run_hops(user_id, session_id)
+
+    async def run_hops(user_id: str, session_id: str) -> None:
+        for hop in range(hops):
+            agent_id = f"agent-{hop % 3}"
+            await timed('fetch_all_chats', storage.fetch_all_chats(user_id, session_id))
+            await timed('fetch_chat', storage.fetch_chat(user_id, session_id, agent_id))
+            await timed('save_messages', storage.save_messages(user_id, session_id, agent_id,
+                                                               message_pair(hop), MAX_HISTORY_SIZE))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(index) for index in range(sessions)))
+    elapsed = time.perf_counter() - start
+    storage.client.execute_command = execute_command
+
+    print(f"{sessions} sessions x {hops} hops, {concurrency} at a time, in {elapsed:.2f} s")
+    print(f"{'':<18}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'commands/call':>15}")
+    for name, values in latencies.items():
+        quantiles = statistics.quantiles(values, n=100)
+        print(f"{name:<18}{quantiles[49] * 1000:>9.2f}{quantiles[94] * 1000:>9.2f}{quantiles[98] * 1000:>9.2f}"
+              f"{commands[name] / len(values):>15.2f}")
+
+
+async def run(url: str, sessions: int, hops: int, concurrency: int, max_connections: int) -> None:
+    storage = RedisStorage(url=url, max_connections=max_connections, key_prefix="bench", pool_timeout=None)
+    try:
+        await storage.load_scripts()
+        await check_against_memory(storage)
+        await measure(storage, sessions, hops, concurrency)
+    finally:
+        await storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default=None, help="Redis URL; a fake in-process server is started when omitted")
+    parser.add_argument('--port', type=int, default=6399)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--hops', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=None, help="Sessions in flight at once, all by default")
+    parser.add_argument('--max-connections', type=int, default=64)
+    args = parser.parse_args()
+
+    logger.remove()
+    concurrency = args.concurrency or args.sessions
+    if args.url:
+        asyncio.run(run(args.url, args.sessions, args.hops, concurrency, args.max_connections))
+    else:
+        with run_fake_redis(args.port) as url:
+            asyncio.run(run(url, args.sessions, args.hops, concurrency, args.max_connections))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Hit rate of the agent response cache in the orchestrator's flow.
+
+Users open sessions and ask questions drawn, with a skew towards popular ones, from a
+pool of word problems, some of them rephrased. Every turn goes through
+Agent.process_request with the agent's stored history, as the orchestrator sends
+it, and is saved afterwards, so the first turn of a session comes without history
+and later turns with it. A scripted agent stands in for the model and counts the
+calls the cache did not save.
+
+The workload runs with the default cache, which shares the answers of requests
+without history between users and bypasses the others, and with cache_with_history.
+Exits with 1 if the default cache never hits.
+
+    python -m benchmarks.bench_response_cache --users 200 --sessions 3 --turns 4
+"""
+import argparse
+import asyncio
+import random
+import sys
+from typing import Dict, List, Tuple
+from loguru import logger
+from agents import Agent, AgentOptions, ResponseCache
+from chat_storage import MemoryStorage
+from orchestrator_types import ConversationMessage, ConversationRole, RequestContext
+
+QUESTIONS = [
+    ("A train travels {a} km in {b} hours. What is its average speed?",
+     "What is the average speed of a train that travels {a} km in {b} hours?"),
+    ("If a shirt costs {a} dollars and is discounted by {b} percent, what is the new price?",
+     "What is the new price of a {a} dollar shirt discounted by {b} percent?"),
+    ("A tank holds {a} litres and leaks {b} litres per hour. How long until it is empty?",
+     "How many hours until a {a} litre tank that leaks {b} litres per hour is empty?"),
+    ("Sam has {a} apples and gives away {b}. How many apples are left?",
+     "How many apples are left if Sam has {a} apples and gives away {b}?"),
+]
+FOLLOW_UPS = ["Can you explain the second step?", "Why does that work?", "Show it another way."]
+
+
+class ScriptedAgent(Agent):
+    def __init__(self, options: AgentOptions):
+        super().__init__(options)
+        self.calls = 0
+
+    async def handle_request(self, context, input_text, chat_history):
+        self.calls += 1
+        return ConversationMessage(role=ConversationRole.ASSISTANT.value,
+                                   original_user_input=context.original_user_input,
+                                   short_output="42", tokens=12, content=[{'text': f"Answer to: {input_text}"}])
+
+
+def question_pool(size: int, seed: int) -> List[Tuple[str, str]]:
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(size):
+        question, rephrased = rng.choice(QUESTIONS)
+        values = {'a': rng.randint(10, 500), 'b': rng.randint(2, 20)}
+        pool.append((question.format(**values), rephrased.format(**values)))
+    return pool
+
+
+def workload(users: int, sessions: int, turns: int, pool_size: int, seed: int) -> List[Tuple[str, str, List[str]]]:
+    """(user, session, texts of its turns), with questions picked by a Zipf-like skew."""
+    rng = random.Random(seed)
+    pool = question_pool(pool_size, seed)
+    weights = [1 / (rank + 1) for rank in range(pool_size)]
+    sessions_turns = []
+    for user in range(users):
+        for session in range(sessions):
+            texts = []
+            for turn in range(turns):
+                if turn and rng.random() < 0.5:
+                    texts.append(rng.choice(FOLLOW_UPS))
+                else:
+                    question, rephrased = rng.choices(pool, weights)[0]
+                    texts.append(rephrased if rng.random() < 0.2 else question)
+            sessions_turns.append((f"user-{user}", f"session-{session}", texts))
+    return sessions_turns
+
+
+async def run(sessions_turns: List[Tuple[str, str, List[str]]], cache: ResponseCache) -> Dict[str, float]:
+    agent = ScriptedAgent(AgentOptions(name="Reasoning Agent", description="Solves word problems",
+                                       response_cache=cache))
+    storage = MemoryStorage()
+    turns = 0
+    for user_id, session_id, texts in sessions_turns:
+        for index, text in enumerate(texts):
+            context = RequestContext(user_id=user_id, session_id=session_id, request_id=f"{session_id}-{index}",
+                                     original_user_input=text, subtask_input=text)
+            history = await storage.fetch_chat(user_id, session_id, agent.id)
+            response = await agent.process_request(context, text, history)
+            user_message = ConversationMessage(role=ConversationRole.USER.value, original_user_input=text,
+                                               short_output="", tokens=len(text.split()), content=[{'text': text}])
+            await storage.save_messages(user_id, session_id, agent.id, [user_message, response])
+            turns += 1
+    return {**cache.metrics(), 'turns': turns, 'model_calls': agent.calls}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=3)
+    parser.add_argument('--turns', type=int, default=4)
+    parser.add_argument('--pool', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    logger.remove()
+
+    sessions_turns = workload(args.users, args.sessions, args.turns, args.pool, args.seed)
+    results = {
+        'default': asyncio.run(run(sessions_turns, ResponseCache())),
+        'cache_with_history': asyncio.run(run(sessions_turns, ResponseCache(cache_with_history=True)))
+    }
+
+    print(f"{'':<20}{'turns':>7}{'calls':>7}{'exact':>7}{'similar':>9}{'misses':>8}{'bypassed':>10}{'hit rate':>10}")
+    for name, metrics in results.items():
+        print(f"{name:<20}{metrics['turns']:>7}{metrics['model_calls']:>7}{metrics['exact_hits']:>7}"
+              f"{metrics['similar_hits']:>9}{metrics['misses']:>8}{metrics['bypassed']:>10}"
+              f"{metrics['hit_rate'] * 100:>9.1f}%")
+
+    if not results['default']['exact_hits'] + results['default']['similar_hits']:
+        print("\nThe response cache never hit")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Overhead of the stage latency metrics and the breakdown they report.
+
+Routes --requests requests of --hops hops each through a scripted classifier and
+scripted agents, on a MemoryStorage, with metrics disabled and enabled in --rounds
+alternating rounds, and reports the best microseconds per request of both and
+their difference per timed stage. Then routes a few requests with --latency seconds of simulated model latency
+and prints the mean time per stage and hop as read back from the Prometheus histogram
+served at /metrics.
+
+No model is called.
+
+    python -m benchmarks.bench_stage_metrics --requests 2000 --hops 3
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from loguru import logger
+from agents import Agent, AgentOptions
+from chat_storage import MemoryStorage
+from classifiers import Classifier, ClassifierResult
+from metrics import LatencyMetrics
+from orchestrator import Orchestrator
+from orchestrator_types import ConversationMessage, ConversationRole, OrchestratorConfig
+
+
+class ScriptedAgent(Agent):
+    def __init__(self, options: AgentOptions, latency: float):
+        super().__init__(options)
+        self.latency = latency
+
+    async def handle_request(self, context, input_text, chat_history):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ConversationMessage(role=ConversationRole.ASSISTANT.value, original_user_input=context.original_user_input,
+                                   short_output="done", tokens=1, content=[{'text': f"answer to {input_text}"}])
+
+
+class ScriptedClassifier(Classifier):
+    """Sends every request through --hops agents, one per hop, round robin."""
+    def __init__(self, hops: int, latency: float):
+        super().__init__()
+        self.hops = hops
+        self.latency = latency
+
+    async def classify(self, input_text, chat_history, context, fused=False):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        agents = list(self.agents.values())
+        last = context.hop + 1 >= self.hops
+        return ClassifierResult(input=input_text, agent_selected=agents[context.hop % len(agents)], accuracy=1.0,
+                                action="route", next_action="respond_to_user" if last else "next_agent",
+                                next_action_input="unknown" if last else f"step {context.hop + 1}")
+
+    async def make_request(self, input_text, system_prompt, context=None):
+        raise NotImplementedError
+
+
+def build_orchestrator(metrics: LatencyMetrics, hops: int, latency: float) -> Orchestrator:
+    orchestrator = Orchestrator(options=OrchestratorConfig(), storage=MemoryStorage(),
+                                classifier=ScriptedClassifier(hops, latency), metrics=metrics)
+    for name in ("Text Classification Agent", "Reasoning Agent", "Data Retrieval Agent"):
+        orchestrator.add_agent(ScriptedAgent(AgentOptions(name=name, description=name), latency))
+    return orchestrator
+
+
+async def per_request_microseconds(orchestrator: Orchestrator, requests: int) -> float:
+    start = time.perf_counter()
+    for index in range(requests):
+        await orchestrator.route_request(f"request {index}", "bench", f"session-{index % 100}", str(index))
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def stage_means(metrics: LatencyMetrics):
+    """Mean seconds per (stage, agent, hop), read back from the rendered histogram."""
+    sums, counts = {}, defaultdict(int)
+    for line in metrics.render().splitlines():
+        if line.startswith('#') or '_bucket' in line:
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, labels = series.split('{', 1)
+        key = tuple(part.split('=', 1)[1].strip('"') for part in labels.rstrip('}').split(','))
+        if name.endswith('_sum'):
+            sums[key] = float(value)
+        else:
+            counts[key] = int(value)
+    return {key: sums[key] / counts[key] for key in sums if counts[key]}
+
+
+async def run(requests: int, hops: int, latency: float, rounds: int) -> None:
+    disabled = build_orchestrator(LatencyMetrics(enabled=False), hops, 0)
+    enabled_metrics = LatencyMetrics()
+    enabled = build_orchestrator(enabled_metrics, hops, 0)
+    # Alternating rounds, best of each, so drift of the machine does not land on one side
+    disabled_us = enabled_us = float('inf')
+    for _ in range(rounds):
+        disabled_us = min(disabled_us, await per_request_microseconds(disabled, requests))
+        enabled_us = min(enabled_us, await per_request_microseconds(enabled, requests))
+    # History read, classification, agent history read, agent call and history write
+    spans = 5 * hops
+    print(f"{requests} requests of {hops} hops without model latency, {spans} timed stages per request")
+    print(f"{'metrics disabled':<18}{disabled_us:>10.1f} us/request")
+    print(f"{'metrics enabled':<18}{enabled_us:>10.1f} us/request")
+    print(f"{'overhead':<18}{enabled_us - disabled_us:>10.1f} us/request, "
+          f"{(enabled_us - disabled_us) / spans:.2f} us/stage")
+
+    metrics = LatencyMetrics()
+    orchestrator = build_orchestrator(metrics, hops, latency)
+    for index in range(5):
+        await orchestrator.route_request(f"request {index}", "bench", "breakdown", str(index))
+    print(f"\nMean time per stage with {latency * 1000:.0f} ms model latency, from /metrics:")
+    print(f"  {'stage':<18}{'agent':<28}{'hop':>4}{'mean ms':>10}")
+    for (stage, agent, hop), seconds in sorted(stage_means(metrics).items(), key=lambda item: (item[0][2], item[0][0])):
+        print(f"  {stage:<18}{agent:<28}{hop:>4}{seconds * 1000:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--hops', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    logger.remove()
+    asyncio.run(run(args.requests, args.hops, args.latency, args.rounds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Behaviour checks of RedisStorage against an in-process fake Redis (fakeredis, with Lua).
+
+Covers the order of saved and fetched messages, the consecutive-role check for single
+and batched saves, history trimming, token windows, delete_session and the expiry of
+every key of a session. Each check runs on a fresh fake server. Prints one line per
+check and exits with 1 if any of them fails.
+
+    pip install -r requirements-dev.txt
+    python -m benchmarks.check_redis_storage
+"""
+import asyncio
+import sys
+import traceback
+from typing import Awaitable, Callable, List, Sequence
+import fakeredis
+from loguru import logger
+from chat_storage import MemoryStorage, RedisStorage
+from orchestrator_types import ConversationMessage, ConversationRole
+from token_counting import WhitespaceTokenizer
+
+USER, SESSION = "check-user", "check-session"
+# Token windows are checked with exact counts, whatever tokenizer is installed
+TOKENIZER = WhitespaceTokenizer()
+
+
+def message(role: ConversationRole, text: str, tokens: int = 0) -> ConversationMessage:
+    """Message whose content counts at least tokens tokens; its short output is the text alone."""
+    content = text + " pad" * max(0, tokens - TOKENIZER.count(text))
+    return ConversationMessage(role=role.value, original_user_input="original", short_output=text,
+                               tokens=TOKENIZER.count(content), content=[{'text': content}])
+
+
+def message_pair(index: int, tokens: int = 0) -> List[ConversationMessage]:
+    return [message(ConversationRole.USER, f"question {index}", tokens),
+            message(ConversationRole.ASSISTANT, f"answer {index}", tokens)]
+
+
+def texts(messages: Sequence[ConversationMessage]) -> List[str]:
+    return [m.short_output for m in messages]
+
+
+def expect(condition: bool, description: str) -> None:
+    if not condition:
+        raise AssertionError(description)
+
+
+async def session_keys(storage: RedisStorage) -> List[bytes]:
+    return await storage.client.keys(f"{storage.key_prefix}:*")
+
+
+async def check_save_and_fetch_order(storage: RedisStorage) -> None:
+    for index in range(3):
+        await storage.save_messages(USER, SESSION, "agent-a", message_pair(index))
+        await storage.save_messages(USER, SESSION, "agent-b", message_pair(index + 10))
+
+    expect(texts(await storage.fetch_chat(USER, SESSION, "agent-a")) ==
+           ["question 0", "answer 0", "question 1", "answer 1", "question 2", "answer 2"],
+           "fetch_chat returns the agent's messages oldest first")
+    all_chats = await storage.fetch_all_chats(USER, SESSION)
+    expect(texts(all_chats) == [text for index in range(3)
+                                for text in (f"question {index}", f"answer {index}",
+                                             f"question {index + 10}", f"answer {index + 10}")],
+           "fetch_all_chats returns every agent's messages in the order they were saved")
+    expect([m.agent_id for m in all_chats[:4]] == ["agent-a", "agent-a", "agent-b", "agent-b"],
+           "fetch_all_chats tags every message with its agent")
+
+
+async def check_history_trimming(storage: RedisStorage) -> None:
+    for index in range(5):
+        await storage.save_messages(USER, SESSION, "agent-a", message_pair(index), 4)
+    expect(texts(await storage.fetch_chat(USER, SESSION, "agent-a")) ==
+           ["question 3", "answer 3", "question 4", "answer 4"],
+           "saves keep only the newest max_history_size messages")
+    expect(texts(await storage.fetch_chat(USER, SESSION, "agent-a", 2)) == ["question 4", "answer 4"],
+           "fetch_chat returns only the newest max_history_size messages")
+
+
+async def check_consecutive_roles(storage: RedisStorage) -> None:
+    expect(await storage.save_message(USER, SESSION, "agent-a", message(ConversationRole.USER, "first")),
+           "a first message is saved")
+    expect(not await storage.save_message(USER, SESSION, "agent-a", message(ConversationRole.USER, "again")),
+           "a message with the role of the agent's last message is rejected")
+    expect(await storage.save_message(USER, SESSION, "agent-b", message(ConversationRole.USER, "other agent")),
+           "the role check is per agent")
+
+    saved = await storage.save_messages(USER, SESSION, "agent-a", [message(ConversationRole.USER, "stored role"),
+                                                                   message(ConversationRole.ASSISTANT, "reply"),
+                                                                   message(ConversationRole.ASSISTANT, "reply again"),
+                                                                   message(ConversationRole.USER, "next")])
+    expect(saved, "a batch with some valid messages is saved")
+    expect(texts(await storage.fetch_chat(USER, SESSION, "agent-a")) == ["first", "reply", "next"],
+           "batched saves drop messages repeating the stored or the previous role")
+    expect(not await storage.save_messages(USER, SESSION, "agent-a", [message(ConversationRole.USER, "again")]),
+           "a batch with no valid message is not saved")
+
+
+async def check_token_windows(storage: RedisStorage) -> None:
+    memory_storage = MemoryStorage(tokenizer=TOKENIZER)
+    for target in (storage, memory_storage):
+        for index in range(4):
+            await target.save_messages(USER, SESSION, "agent-a", message_pair(index, tokens=10))
+            await target.save_messages(USER, SESSION, "agent-b", message_pair(index + 10, tokens=10))
+            # Distinct timestamps: storages may break ties between agents differently
+            await asyncio.sleep(0.002)
+
+    window = await storage.fetch_chat(USER, SESSION, "agent-a", max_tokens=45)
+    expect(texts(window) == ["question 2", "answer 2", "question 3", "answer 3"],
+           "fetch_chat with max_tokens keeps the newest messages that fit, starting on a user message")
+    expect(texts(await storage.fetch_chat(USER, SESSION, "agent-a", 2, max_tokens=45)) == ["question 3", "answer 3"],
+           "a token window is also limited by max_history_size")
+    expect(texts(await storage.fetch_all_chats(USER, SESSION, max_tokens=35)) == ["question 13", "answer 13"],
+           "fetch_all_chats with max_tokens keeps the newest messages of all agents that fit")
+    expect(not await storage.fetch_all_chats(USER, SESSION, max_tokens=5), "a window smaller than a message is empty")
+    for max_tokens in (0, 15, 20, 45, 100, 1000):
+        expect(texts(await storage.fetch_chat(USER, SESSION, "agent-b", max_tokens=max_tokens)) ==
+               texts(await memory_storage.fetch_chat(USER, SESSION, "agent-b", max_tokens=max_tokens)) and
+               texts(await storage.fetch_all_chats(USER, SESSION, max_tokens=max_tokens)) ==
+               texts(await memory_storage.fetch_all_chats(USER, SESSION, max_tokens=max_tokens)),
+               f"token windows of {max_tokens} tokens match MemoryStorage")
+
+
+async def check_delete_session(storage: RedisStorage) -> None:
+    await storage.save_messages(USER, SESSION, "agent-a", message_pair(0))
+    await storage.save_messages(USER, SESSION, "agent-b", message_pair(1))
+    await storage.save_messages(USER, "other-session", "agent-a", message_pair(2))
+    other_keys = set(await session_keys(storage))
+
+    expect(await storage.delete_session(USER, SESSION), "delete_session reports the deleted session")
+    expect(not await storage.fetch_all_chats(USER, SESSION) and not await storage.fetch_chat(USER, SESSION, "agent-a"),
+           "a deleted session has no messages")
+    remaining = set(await session_keys(storage))
+    expect(remaining and remaining < other_keys, "delete_session removes every key of the session")
+    expect(texts(await storage.fetch_all_chats(USER, "other-session")) == ["question 2", "answer 2"],
+           "delete_session leaves other sessions alone")
+    expect(not await storage.delete_session(USER, SESSION), "deleting a missing session reports nothing deleted")
+
+
+async def check_key_expiry(storage: RedisStorage) -> None:
+    storage.ttl_seconds = 2
+    await storage.save_messages(USER, SESSION, "agent-a", message_pair(0))
+    await asyncio.sleep(1.2)
+    await storage.save_messages(USER, SESSION, "agent-b", message_pair(1))
+    keys = await session_keys(storage)
+    ttls = [await storage.client.pttl(key) for key in keys]
+    expect(len(keys) == 5 and all(1200 < ttl <= 2000 for ttl in ttls),
+           "a save refreshes the expiry of every key of the session, not only the saving agent's")
+    await asyncio.sleep(2.1)
+    expect(not await session_keys(storage), "every key of an idle session expires")
+    expect(not await storage.fetch_all_chats(USER, SESSION), "an expired session has no messages")
+
+
+CHECKS: List[Callable[[RedisStorage], Awaitable[None]]] = [
+    check_save_and_fetch_order,
+    check_history_trimming,
+    check_consecutive_roles,
+    check_token_windows,
+    check_delete_session,
+    check_key_expiry,
+]
+
+
+async def run_checks() -> int:
+    failures = 0
+    for check in CHECKS:
+        storage = RedisStorage(client=fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer()), tokenizer=TOKENIZER)
+        try:
+            await check(storage)
+            print(f"ok      {check.__name__}")
+        except Exception:
+            failures += 1
+            print(f"FAILED  {check.__name__}")
+            traceback.print_exc()
+        finally:
+            await storage.client.aclose()
+    return failures
+
+
+def main():
+    logger.remove()
+    failures = asyncio.run(run_checks())
+    print(f"\n{len(CHECKS) - failures} of {len(CHECKS)} checks passed")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
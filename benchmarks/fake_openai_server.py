@@ -0,0 +1,351 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint.
+
+Speaks the chat completions protocol closely enough for the classifier, the agents and
+phi: forced tool calls are answered with arguments generated from the tool's JSON
+schema, json_schema response formats with matching JSON content, and anything else
+with plain text. Streaming requests are answered with server-sent events that split the
+tool arguments or the text into small fragments, followed by a usage chunk when
+stream_options.include_usage is set. Token usage is counted locally over the messages
+and the generated answer; answers longer than the request's max_tokens are cut off
+there with finish_reason "length", as the API does.
+
+The classifier is routed by a script: the first rule whose regular expression matches
+the request picks the agents of its hops, in order (see RoutingScript). Latency,
+jitter, a delay between streamed chunks and a rate of failed calls (answered with 429
+or 500, which the OpenAI client retries) are configurable and seeded.
+
+    python -m benchmarks.fake_openai_server --port 8900 --latency 0.5 --jitter 0.2 --error-rate 0.01 \
+        --routing benchmarks/routing_example.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from token_counting import default_tokenizer
+
+STREAM_FRAGMENT_SIZE = 8
+# Idle connections outlive the client's keep-alive expiry, as with the real endpoint,
+# so the client decides when they are closed (uvicorn's default closes them after 5 s)
+KEEP_ALIVE_SECONDS = 75
+HOP_MARKER = re.compile(r'^\[hop (\d+)\] ')
+WORDS = ("the answer follows from the given facts so the label is positive because every step checks out "
+         "and the retrieved source confirms it").split()
+
+
+class RoutingScript:
+    """
+    Routing decisions of the fake classifier. Every rule maps a regular expression,
+    searched case-insensitively in the classifier's input, to the agent ids of the
+    request's hops; the first matching rule wins, else the default route is taken.
+
+    The hop of a classifier call is carried in the next_action_input the previous hop
+    returned, as a "[hop N] " prefix, so the script needs no state between calls. Plan
+    requests get the same agents as a chain of sub-tasks, each depending on the one
+    before it.
+    """
+    def __init__(self,
+                 rules: Sequence[Tuple[str, Sequence[str]]] = (),
+                 default: Sequence[str] = ("reasoning-agent",)):
+        if not default:
+            raise ValueError("The default route needs at least one agent")
+        self.rules = [(re.compile(pattern, re.IGNORECASE), list(agents)) for pattern, agents in rules]
+        self.default = list(default)
+
+    @classmethod
+    def from_file(cls, path: str) -> "RoutingScript":
+        """Script from a JSON file: {"rules": [["pattern", ["agent-id", ...]], ...], "default": ["agent-id"]}."""
+        with open(path) as file:
+            script = json.load(file)
+        return cls([(pattern, agents) for pattern, agents in script.get('rules', [])],
+                   script.get('default') or ("reasoning-agent",))
+
+    def route(self, text: str) -> List[str]:
+        for pattern, agents in self.rules:
+            if pattern.search(text):
+                return agents
+        return self.default
+
+    def classify(self, text: str) -> Dict[str, Any]:
+        marker = HOP_MARKER.match(text)
+        hop = int(marker.group(1)) if marker else 0
+        request = text[marker.end():] if marker else text
+        agents = self.route(request)
+        last_hop = hop >= len(agents) - 1
+        return {
+            'input': request,
+            'agent_selected': agents[min(hop, len(agents) - 1)],
+            'accuracy': 0.95,
+            'action': "route",
+            'next_action': "respond_to_user" if last_hop else agents[hop + 1],
+            'next_action_input': "unknown" if last_hop else f"[hop {hop + 1}] {request}"
+        }
+
+    def plan(self, text: str) -> Dict[str, Any]:
+        agents = self.route(text)
+        return {'subtasks': [{'id': str(index), 'agent_selected': agent, 'input': text,
+                              'depends_on': [str(index - 1)] if index else []}
+                             for index, agent in enumerate(agents)]}
+
+
+class FakeOpenAIState:
+    def __init__(self,
+                 latency: float = 0.5,
+                 jitter: float = 0.0,
+                 chunk_delay: float = 0.0,
+                 error_rate: float = 0.0,
+                 answer_words: int = 40,
+                 routing: Optional[RoutingScript] = None,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.answer_words = answer_words
+        self.routing = routing or RoutingScript()
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.client_ports = set()
+
+    def delay(self) -> float:
+        """Latency of one call: the base latency plus or minus up to the jitter."""
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def answer(self) -> str:
+        return ' '.join(self.random.choice(WORDS) for _ in range(self.answer_words)) + '.'
+
+
+def last_user_message(body: Dict[str, Any]) -> str:
+    for message in reversed(body.get('messages', [])):
+        if message.get('role') == 'user' and isinstance(message.get('content'), str):
+            return message['content']
+    return ""
+
+
+def value_for_schema(name: str, schema: Dict[str, Any], state: FakeOpenAIState) -> Any:
+    kind = schema.get('type')
+    if kind == 'number':
+        return 0.95
+    if kind == 'integer':
+        return 1
+    if kind == 'boolean':
+        return True
+    if kind == 'array':
+        return []
+    if kind == 'object':
+        return {key: value_for_schema(key, value, state) for key, value in schema.get('properties', {}).items()}
+    if name == 'next_action':
+        return 'respond_to_user'
+    if name == 'output':
+        return state.answer()
+    return f"fake {name}"
+
+
+def build_tool_arguments(tool: Dict[str, Any], state: Optional[FakeOpenAIState] = None) -> Dict[str, Any]:
+    state = state or FakeOpenAIState()
+    parameters = tool.get('function', {}).get('parameters', {})
+    return value_for_schema('', {**parameters, 'type': 'object'}, state)
+
+
+def forced_tool(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The tool the request forces a call to, if any."""
+    tools = body.get('tools') or []
+    choice = body.get('tool_choice')
+    if isinstance(choice, dict):
+        name = choice.get('function', {}).get('name')
+        return next((tool for tool in tools if tool.get('function', {}).get('name') == name), None)
+    if choice == 'required' and tools:
+        return tools[0]
+    return None
+
+
+def build_answer(body: Dict[str, Any], state: FakeOpenAIState) -> Tuple[Optional[str], str]:
+    """(name of the called tool or None for a text answer, arguments or text)."""
+    tool = forced_tool(body)
+    if tool is not None:
+        name = tool['function']['name']
+        properties = tool['function'].get('parameters', {}).get('properties', {})
+        if name == 'processPrompt' and 'agent_selected' in properties:
+            return name, json.dumps(state.routing.classify(last_user_message(body)))
+        if name == 'planSubtasks':
+            return name, json.dumps(state.routing.plan(last_user_message(body)))
+        return name, json.dumps(build_tool_arguments(tool, state))
+    response_format = body.get('response_format') or {}
+    if response_format.get('type') == 'json_schema':
+        schema = response_format.get('json_schema', {}).get('schema', {})
+        return None, json.dumps(value_for_schema('', {**schema, 'type': 'object'}, state))
+    return None, state.answer()
+
+
+def request_usage(body: Dict[str, Any], answer: str) -> Dict[str, int]:
+    tokenizer = default_tokenizer()
+    prompt_tokens = sum(tokenizer.count(message.get('content') or '') for message in body.get('messages', [])
+                        if isinstance(message.get('content'), str))
+    prompt_tokens += tokenizer.count(json.dumps(body.get('tools') or []))
+    completion_tokens = tokenizer.count(answer)
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens}
+
+
+def cut_to_max_tokens(answer: str, max_tokens: Optional[int]) -> Tuple[str, bool]:
+    """(the answer cut to the longest prefix within max_tokens, whether it was cut)."""
+    tokenizer = default_tokenizer()
+    if max_tokens is None or tokenizer.count(answer) <= max_tokens:
+        return answer, False
+    low, high = 0, len(answer)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if tokenizer.count(answer[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return answer[:low], True
+
+
+def finish_reason(tool_name: Optional[str], cut: bool) -> str:
+    if cut:
+        return 'length'
+    return 'stop' if tool_name is None else 'tool_calls'
+
+
+def completion_body(model: str, tool_name: Optional[str], answer: str, usage: Dict[str, int],
+                    cut: bool = False) -> Dict[str, Any]:
+    if tool_name is None:
+        message = {'role': 'assistant', 'content': answer}
+    else:
+        message = {'role': 'assistant', 'content': None, 'tool_calls': [{
+            'id': f"call_{uuid.uuid4().hex[:12]}",
+            'type': 'function',
+            'function': {'name': tool_name, 'arguments': answer}
+        }]}
+    return {
+        'id': f"chatcmpl-{uuid.uuid4().hex}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'finish_reason': finish_reason(tool_name, cut),
+            'message': message
+        }],
+        'usage': usage
+    }
+
+
+def stream_chunks(model: str, tool_name: Optional[str], answer: str,
+                  usage: Optional[Dict[str, int]], cut: bool = False) -> List[Dict[str, Any]]:
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    base = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model}
+    if tool_name is None:
+        first = {'role': 'assistant', 'content': ''}
+    else:
+        first = {'role': 'assistant', 'tool_calls': [{'index': 0, 'id': f"call_{uuid.uuid4().hex[:12]}", 'type': 'function',
+                                                      'function': {'name': tool_name, 'arguments': ''}}]}
+    chunks = [{**base, 'choices': [{'index': 0, 'finish_reason': None, 'delta': first}]}]
+    for start in range(0, len(answer), STREAM_FRAGMENT_SIZE):
+        fragment = answer[start:start + STREAM_FRAGMENT_SIZE]
+        if tool_name is None:
+            delta = {'content': fragment}
+        else:
+            delta = {'tool_calls': [{'index': 0, 'function': {'arguments': fragment}}]}
+        chunks.append({**base, 'choices': [{'index': 0, 'finish_reason': None, 'delta': delta}]})
+    chunks.append({**base, 'choices': [{'index': 0, 'finish_reason': finish_reason(tool_name, cut), 'delta': {}}]})
+    if usage is not None:
+        chunks.append({**base, 'choices': [], 'usage': usage})
+    return chunks
+
+
+def error_response(state: FakeOpenAIState) -> JSONResponse:
+    state.errors += 1
+    if state.random.random() < 0.5:
+        return JSONResponse({'error': {'message': "Rate limit reached (fake)", 'type': 'requests',
+                                       'code': 'rate_limit_exceeded'}}, status_code=429)
+    return JSONResponse({'error': {'message': "The server had an error (fake)", 'type': 'server_error',
+                                   'code': None}}, status_code=500)
+
+
+def create_app(state: FakeOpenAIState) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        state.requests += 1
+        state.in_flight += 1
+        state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        if request.client:
+            state.client_ports.add(request.client.port)
+        try:
+            await asyncio.sleep(state.delay())
+        finally:
+            state.in_flight -= 1
+
+        if state.error_rate and state.random.random() < state.error_rate:
+            return error_response(state)
+
+        tool_name, answer = build_answer(body, state)
+        answer, cut = cut_to_max_tokens(answer, body.get('max_tokens'))
+        model = body.get('model', 'fake-model')
+        usage = request_usage(body, answer)
+
+        if not body.get('stream'):
+            return JSONResponse(completion_body(model, tool_name, answer, usage, cut))
+
+        include_usage = (body.get('stream_options') or {}).get('include_usage')
+
+        async def event_stream():
+            for chunk in stream_chunks(model, tool_name, answer, usage if include_usage else None, cut):
+                if state.chunk_delay:
+                    await asyncio.sleep(state.chunk_delay)
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return app
+
+
+@contextmanager
+def run_fake_server(state: FakeOpenAIState, port: int):
+    """Serve the fake endpoint from a background thread for the duration of the block."""
+    server = uvicorn.Server(uvicorn.Config(create_app(state), port=port, log_level="warning",
+                                           timeout_keep_alive=KEEP_ALIVE_SECONDS))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--chunk-delay', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--answer-words', type=int, default=40)
+    parser.add_argument('--routing', help="JSON routing script, see RoutingScript.from_file")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    uvicorn.run(create_app(FakeOpenAIState(latency=args.latency, jitter=args.jitter, chunk_delay=args.chunk_delay,
+                                           error_rate=args.error_rate, answer_words=args.answer_words,
+                                           routing=RoutingScript.from_file(args.routing) if args.routing else None,
+                                           seed=args.seed)),
+                port=args.port, log_level="warning", timeout_keep_alive=KEEP_ALIVE_SECONDS)
@@ -1,7 +1,16 @@
 from .chat_storage import ChatStorage
 from .memory_storage import MemoryStorage
+from .sqlite_storage import SqliteStorage
+from .redis_storage import RedisStorage
+from .summarizer import ConversationSummarizer, OpenAISummarizer
+from .compacting_storage import CompactingStorage
 
 __all__ = [
     'ChatStorage',
-    'MemoryStorage'
-]
\ No newline at end of file
+    'MemoryStorage',
+    'SqliteStorage',
+    'RedisStorage',
+    'ConversationSummarizer',
+    'OpenAISummarizer',
+    'CompactingStorage'
+]
@@ -1,9 +1,72 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Union
-from orchestrator_types import ConversationMessage, TimestampedMessage
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from orchestrator_types import ConversationMessage, ConversationRole, TimestampedMessage
+from token_counting import Tokenizer, default_tokenizer
+from loguru import logger
 
 class ChatStorage(ABC):
-    """Abstract base class representing the interface for chat storage."""
+    """
+    Abstract base class representing the interface for chat storage.
+
+    Storages count the tokens of every message once, when it is saved, with the
+    tokenizer given here, so reads can return the newest history that fits a token
+    budget without tokenizing anything. They also keep the size of every session's
+    history as saved by this process, so it can be bounded without reading it back.
+    """
+    def __init__(self, tokenizer: Optional[Tokenizer] = None):
+        self.tokenizer = tokenizer or default_tokenizer()
+        # (user_id, session_id) -> agent_id -> sizes of the agent's stored messages, oldest first
+        self._message_sizes: Dict[Tuple[str, str], Dict[str, Deque[int]]] = {}
+        self._session_sizes: Dict[Tuple[str, str], int] = {}
+
+    def count_tokens(self, message: ConversationMessage) -> int:
+        return self.tokenizer.count_content(message.content)
+
+    @staticmethod
+    def message_size(message: ConversationMessage) -> int:
+        """Approximate size of a stored message: the characters of its text, input and short output."""
+        if not message.content:
+            return 0
+        return (len(message.content[0].get('text', '')) + len(message.original_user_input or '')
+                + len(message.short_output or ''))
+
+    def track_saved(self,
+                    user_id: str,
+                    session_id: str,
+                    agent_id: str,
+                    saved_messages: Sequence[ConversationMessage],
+                    max_history_size: Optional[int] = None) -> None:
+        """
+        Add saved messages to the size of their session, less the messages the save
+        trimmed from the agent's history (same rule as trim_conversation).
+        Storages call this after every successful save.
+        """
+        key = (user_id, session_id)
+        sizes = self._message_sizes.setdefault(key, {}).setdefault(agent_id, deque())
+        total = self._session_sizes.get(key, 0)
+        for message in saved_messages:
+            size = self.message_size(message)
+            sizes.append(size)
+            total += size
+        if max_history_size:
+            limit = max_history_size if max_history_size % 2 == 0 else max_history_size - 1
+            while limit and len(sizes) > limit:
+                total -= sizes.popleft()
+        self._session_sizes[key] = total
+
+    def session_size(self, user_id: str, session_id: str) -> int:
+        """
+        Approximate size of a session's history from the saves this process made,
+        without reading the history back.
+        """
+        return self._session_sizes.get((user_id, session_id), 0)
+
+    def forget_session(self, user_id: str, session_id: str) -> None:
+        """Drop the tracked size of a deleted session."""
+        self._message_sizes.pop((user_id, session_id), None)
+        self._session_sizes.pop((user_id, session_id), None)
+
     def is_same_role_as_last_message(self,
                                conversation: list[ConversationMessage],
                                new_message: ConversationMessage) -> bool:
@@ -16,6 +79,26 @@ class ChatStorage(ABC):
             return False
         return conversation[-1].role == new_message.role
 
+    @staticmethod
+    def drop_consecutive_roles(agent_id: str,
+                               new_messages: Sequence[ConversationMessage],
+                               last_role: Optional[str]) -> List[ConversationMessage]:
+        """
+        Apply the save_message check to a batch: every message with the same role as the
+        one before it (the agent's last stored message, for the first) is dropped.
+        Returns:
+            list[ConversationMessage]: The messages to save, in order.
+        """
+        kept = []
+        for message in new_messages:
+            if message.role == last_role:
+                logger.debug(f"> Consecutive {message.role} \
+                       message detected for agent {agent_id}. Not saving.")
+                continue
+            kept.append(message)
+            last_role = message.role
+        return kept
+
     def trim_conversation(self,
                           conversation: list[ConversationMessage],
                           max_history_size: Optional[int] = None) -> list[ConversationMessage]:
@@ -33,6 +116,37 @@ class ChatStorage(ABC):
             adjusted_max_history_size = max_history_size - 1
         return conversation[-adjusted_max_history_size:]
 
+    @staticmethod
+    def window_by_tokens(newest_first: Iterable[TimestampedMessage],
+                         max_tokens: int) -> List[TimestampedMessage]:
+        """
+        Take messages, newest first, while their stored token counts fit in max_tokens.
+        Only the messages kept are visited.
+        Returns:
+            list[TimestampedMessage]: The window, oldest first.
+        """
+        window = []
+        used = 0
+        for message in newest_first:
+            used += message.content_tokens
+            if used > max_tokens:
+                break
+            window.append(message)
+        window.reverse()
+        return ChatStorage.start_on_request(window)
+
+    @staticmethod
+    def start_on_request(window: Sequence[ConversationMessage]) -> Sequence[ConversationMessage]:
+        """
+        Drop the answers at the start of a history window whose request was cut off by it.
+        Returns:
+            Sequence[ConversationMessage]: The window starting with a user message.
+        """
+        start = 0
+        while start < len(window) and window[start].role != ConversationRole.USER.value:
+            start += 1
+        return window[start:]
+
     @abstractmethod
     async def save_message(self,
                                 user_id: str,
@@ -54,9 +168,10 @@ class ChatStorage(ABC):
                                 new_messages: Union[list[ConversationMessage], list[TimestampedMessage]],
                                 max_history_size: Optional[int] = None) -> bool:
         """
-        Save multiple messages at once.
+        Save multiple messages at once. Like save_message, a message with the same role
+        as the one before it is not saved (see drop_consecutive_roles).
         Returns:
-            bool: True if the messages were saved successfully, False otherwise.
+            bool: True if any of the messages was saved, False otherwise.
         """
 
     @abstractmethod
@@ -64,19 +179,47 @@ class ChatStorage(ABC):
                          user_id: str,
                          session_id: str,
                          agent_id: str,
-                         max_history_size: Optional[int] = None) -> list[ConversationMessage]:
+                         max_history_size: Optional[int] = None,
+                         max_tokens: Optional[int] = None) -> Sequence[ConversationMessage]:
         """
-        Fetch chat messages.
+        Fetch chat messages, oldest first. With max_tokens, only the newest messages whose
+        content fits in that many tokens are returned.
         Returns:
-            list[ConversationMessage]: The fetched chat messages.
+            Sequence[ConversationMessage]: The fetched chat messages, read-only.
         """
 
     @abstractmethod
     async def fetch_all_chats(self,
                               user_id: str,
-                              session_id: str) -> list[ConversationMessage]:
+                              session_id: str,
+                              max_tokens: Optional[int] = None) -> Sequence[ConversationMessage]:
+        """
+        Fetch all chat messages for a user and session, oldest first. With max_tokens,
+        only the newest messages whose content fits in that many tokens are returned.
+        Returns:
+            Sequence[ConversationMessage]: All chat messages for the user and session, read-only.
+            Each one is a TimestampedMessage carrying the agent_id it was saved for.
         """
-        Fetch all chat messages for a user and session.
+
+    @abstractmethod
+    async def delete_session(self,
+                             user_id: str,
+                             session_id: str) -> bool:
+        """
+        Delete all chat messages of every agent for a user and session.
+        Returns:
+            bool: True if the session was deleted, False otherwise.
+        """
+
+    async def evict_session(self,
+                            user_id: str,
+                            session_id: str) -> bool:
+        """
+        Drop what this process keeps of a session to free its memory. Durable storages
+        keep the history, which other workers and later runs may still serve, and
+        expire it on their own; storages that hold it in process memory delete it.
         Returns:
-            list[ConversationMessage]: All chat messages for the user and session.
-        """
\ No newline at end of file
+            bool: True if the history was deleted, False otherwise.
+        """
+        self.forget_session(user_id, session_id)
+        return False
@@ -0,0 +1,246 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple, Union
+from chat_storage import ChatStorage
+from chat_storage.summarizer import ConversationSummarizer
+from metrics import UsageLedger
+from orchestrator_types import ConversationMessage, ConversationRole, TimestampedMessage
+from token_counting import RequestUsage, Tokenizer
+from loguru import logger
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+@dataclass(frozen=True)
+class RollingSummary:
+    """Summary of the messages saved before covered_until, ready to be sent as a message."""
+    message: TimestampedMessage
+    text: str
+    covered_until: int
+    content_tokens: int
+
+class CompactingStorage(ChatStorage):
+    """
+    Wraps a chat storage and folds the older turns of long histories into a rolling summary.
+
+    Once the history of an agent, or of the whole session, that is not covered by its
+    summary holds more than threshold_tokens, a background task folds everything but the
+    newest keep_recent_tokens into the summary with one summarizer call. Later
+    compactions only send the summary and the newly folded messages. Reads never wait
+    for the summarizer: fetch_chat and fetch_all_chats return the current summary as
+    the first message, followed by the messages it does not cover.
+
+    The summary is a system message, so models do not take it for something the user
+    said. The tokens of every summarizer call are added to the usage ledger, when one
+    is given, for the session's user.
+
+    The wrapped storage keeps every message, so summaries can be rebuilt. Summaries
+    are cached in this process; with a shared storage every worker builds its own.
+    """
+    def __init__(self,
+                 storage: ChatStorage,
+                 summarizer: ConversationSummarizer,
+                 threshold_tokens: int = 4000,
+                 keep_recent_tokens: int = 1000,
+                 tokenizer: Optional[Tokenizer] = None,
+                 usage_ledger: Optional[UsageLedger] = None):
+        if keep_recent_tokens >= threshold_tokens:
+            raise ValueError("keep_recent_tokens must be lower than threshold_tokens")
+        super().__init__(tokenizer or storage.tokenizer)
+        self.storage = storage
+        self.summarizer = summarizer
+        self.threshold_tokens = threshold_tokens
+        self.keep_recent_tokens = keep_recent_tokens
+        self.usage_ledger = usage_ledger
+        # (user_id, session_id) -> agent_id (None for the whole session) -> summary
+        self.summaries: Dict[Tuple[str, str], Dict[Optional[str], RollingSummary]] = {}
+        self._tasks: Dict[Tuple[str, str, Optional[str]], asyncio.Task] = {}
+        self._pending = set()
+        self.counters: Dict[str, int] = {
+            'compactions': 0,
+            'failures': 0,
+            'folded_messages': 0,
+            'folded_tokens': 0
+        }
+
+    async def save_message(
+        self,
+        user_id: str,
+        session_id: str,
+        agent_id: str,
+        new_message: Union[ConversationMessage, TimestampedMessage],
+        max_history_size: Optional[int] = None
+    ) -> bool:
+        saved = await self.storage.save_message(user_id, session_id, agent_id, new_message, max_history_size)
+        if saved:
+            self.schedule_compaction(user_id, session_id, agent_id)
+        return saved
+
+    async def save_messages(self,
+                            user_id: str,
+                            session_id: str,
+                            agent_id: str,
+                            new_messages: Union[list[ConversationMessage], list[TimestampedMessage]],
+                            max_history_size: Optional[int] = None
+    ) -> bool:
+        saved = await self.storage.save_messages(user_id, session_id, agent_id, new_messages, max_history_size)
+        if saved:
+            self.schedule_compaction(user_id, session_id, agent_id)
+        return saved
+
+    async def fetch_chat(
+        self,
+        user_id: str,
+        session_id: str,
+        agent_id: str,
+        max_history_size: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ) -> Sequence[ConversationMessage]:
+        summary = self.summaries.get((user_id, session_id), {}).get(agent_id)
+        messages = await self.storage.fetch_chat(user_id, session_id, agent_id, max_history_size,
+                                                 self._recent_budget(summary, max_tokens))
+        return self._with_summary(summary, messages)
+
+    async def fetch_all_chats(
+        self,
+        user_id: str,
+        session_id: str,
+        max_tokens: Optional[int] = None
+    ) -> Sequence[ConversationMessage]:
+        summary = self.summaries.get((user_id, session_id), {}).get(None)
+        messages = await self.storage.fetch_all_chats(user_id, session_id, self._recent_budget(summary, max_tokens))
+        return self._with_summary(summary, messages)
+
+    async def delete_session(
+        self,
+        user_id: str,
+        session_id: str
+    ) -> bool:
+        self._drop_summary(user_id, session_id)
+        return await self.storage.delete_session(user_id, session_id)
+
+    async def evict_session(
+        self,
+        user_id: str,
+        session_id: str
+    ) -> bool:
+        # Summaries are kept in process memory; the wrapped storage decides about the history
+        self._drop_summary(user_id, session_id)
+        return await self.storage.evict_session(user_id, session_id)
+
+    def _drop_summary(self, user_id: str, session_id: str) -> None:
+        for key in [key for key in self._tasks if key[:2] == (user_id, session_id)]:
+            self._tasks.pop(key).cancel()
+            self._pending.discard(key)
+        self.summaries.pop((user_id, session_id), None)
+
+    def session_size(self, user_id: str, session_id: str) -> int:
+        # Summaries only shorten what is sent; the wrapped storage still holds every message
+        return self.storage.session_size(user_id, session_id)
+
+    @staticmethod
+    def _recent_budget(summary: Optional[RollingSummary], max_tokens: Optional[int]) -> Optional[int]:
+        if max_tokens is None or summary is None:
+            return max_tokens
+        return max(0, max_tokens - summary.content_tokens)
+
+    @staticmethod
+    def _with_summary(summary: Optional[RollingSummary],
+                      messages: Sequence[ConversationMessage]) -> Sequence[ConversationMessage]:
+        if summary is None:
+            return messages
+        recent = tuple(message for message in messages if message.timestamp >= summary.covered_until)
+        return (summary.message,) + recent
+
+    def schedule_compaction(self, user_id: str, session_id: str, agent_id: str) -> None:
+        """Compact the agent's and the session's history in the background, one task per history."""
+        for scope in (agent_id, None):
+            key = (user_id, session_id, scope)
+            task = self._tasks.get(key)
+            if task is not None and not task.done():
+                # The running task compacts once more when it is done
+                self._pending.add(key)
+                continue
+            self._tasks[key] = asyncio.create_task(self._compact(key))
+
+    async def _compact(self, key: Tuple[str, str, Optional[str]]) -> None:
+        try:
+            while True:
+                self._pending.discard(key)
+                await self.compact(*key)
+                if key not in self._pending:
+                    break
+        except Exception as error:
+            # History stays uncompacted until the next save tries again
+            self.counters['failures'] += 1
+            logger.error(f"Error compacting chat history: {str(error)}")
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    async def compact(self, user_id: str, session_id: str, agent_id: Optional[str]) -> bool:
+        """
+        Fold the history of an agent (of the session when agent_id is None) into its summary
+        if the part the summary does not cover is over the threshold.
+        Returns:
+            bool: True if the summary was updated, False otherwise.
+        """
+        summary = self.summaries.get((user_id, session_id), {}).get(agent_id)
+        if agent_id is None:
+            messages = await self.storage.fetch_all_chats(user_id, session_id)
+        else:
+            messages = await self.storage.fetch_chat(user_id, session_id, agent_id)
+        if summary is not None:
+            messages = [message for message in messages if message.timestamp >= summary.covered_until]
+        if sum(message.content_tokens for message in messages) <= self.threshold_tokens:
+            return False
+
+        # Everything older than the newest window is folded; messages saved in the same
+        # millisecond as the first one kept stay unfolded with it
+        kept = self.window_by_tokens(reversed(messages), self.keep_recent_tokens)
+        if kept:
+            covered_until = kept[0].timestamp
+        else:
+            covered_until = next((message.timestamp for message in reversed(messages)
+                                  if message.role == ConversationRole.USER.value), messages[-1].timestamp + 1)
+        folded = [message for message in messages if message.timestamp < covered_until]
+        if not folded:
+            return False
+
+        usage = RequestUsage()
+        try:
+            text = await self.summarizer.summarize(summary.text if summary else "", folded, usage)
+        finally:
+            if self.usage_ledger:
+                self.usage_ledger.record_calls(user_id, usage)
+        content = [{'text': SUMMARY_PREFIX + text}]
+        content_tokens = self.tokenizer.count_content(content)
+        self.summaries.setdefault((user_id, session_id), {})[agent_id] = RollingSummary(
+            message=TimestampedMessage(
+                role=ConversationRole.SYSTEM.value,
+                original_user_input="",
+                short_output="",
+                content=content,
+                timestamp=covered_until - 1,
+                agent_id=agent_id,
+                content_tokens=content_tokens
+            ),
+            text=text,
+            covered_until=covered_until,
+            content_tokens=content_tokens
+        )
+        self.counters['compactions'] += 1
+        self.counters['folded_messages'] += len(folded)
+        self.counters['folded_tokens'] += sum(message.content_tokens for message in folded)
+        return True
+
+    async def wait_for_compactions(self) -> None:
+        """Wait until no compaction is running; for shutdown and tests."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            **self.counters,
+            'summaries': sum(len(summaries) for summaries in self.summaries.values()),
+            'running': len(self._tasks)
+        }
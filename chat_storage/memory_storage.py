@@ -1,13 +1,16 @@
-from typing import Optional, Union
-from collections import defaultdict
+import heapq
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 from chat_storage import ChatStorage
 from orchestrator_types import ConversationMessage, TimestampedMessage
+from token_counting import Tokenizer
 from loguru import logger
 
 class MemoryStorage(ChatStorage):
-    def __init__(self):
-        super().__init__()
-        self.conversations = defaultdict(list)
+    def __init__(self, tokenizer: Optional[Tokenizer] = None):
+        super().__init__(tokenizer)
+        # (user_id, session_id) -> agent_id -> messages in the order they were saved,
+        # so reads only ever touch the session being served
+        self.conversations: Dict[Tuple[str, str], Dict[str, List[TimestampedMessage]]] = {}
 
     async def save_message(
         self,
@@ -16,27 +19,19 @@ class MemoryStorage(ChatStorage):
         agent_id: str,
         new_message: Union[ConversationMessage, TimestampedMessage],
         max_history_size: Optional[int] = None
-    ) -> list[dict]:
-        key = self._generate_key(user_id, session_id, agent_id)
-        conversation = self.conversations[key]
+    ) -> bool:
+        agent_conversations = self.conversations.setdefault((user_id, session_id), {})
+        conversation = agent_conversations.setdefault(agent_id, [])
 
         if self.is_same_role_as_last_message(conversation, new_message):
             logger.debug(f"> Consecutive {new_message.role} \
                        message detected for agent {agent_id}. Not saving.")
-            return self._remove_timestamps(conversation)
-
-        if isinstance(new_message, ConversationMessage):
-            timestamped_message = TimestampedMessage(
-                role=new_message.role,
-                original_user_input=new_message.original_user_input,
-                short_output=new_message.short_output,
-                tokens=new_message.tokens,
-                content=new_message.content)
-        conversation.append(timestamped_message)
+            return False
 
-        conversation = self.trim_conversation(conversation, max_history_size)
-        self.conversations[key] = conversation
-        return self._remove_timestamps(conversation)
+        conversation.append(self._timestamp_message(new_message, agent_id))
+        agent_conversations[agent_id] = self.trim_conversation(conversation, max_history_size)
+        self.track_saved(user_id, session_id, agent_id, [new_message], max_history_size)
+        return True
 
 
     async def save_messages(self,
@@ -46,74 +41,75 @@ class MemoryStorage(ChatStorage):
                                 new_messages: Union[list[ConversationMessage], list[TimestampedMessage]],
                                 max_history_size: Optional[int] = None
     ) -> bool:
-        key = self._generate_key(user_id, session_id, agent_id)
-        conversation = self.conversations[key]
+        agent_conversations = self.conversations.setdefault((user_id, session_id), {})
+        conversation = agent_conversations.setdefault(agent_id, [])
+        saved_messages = self.drop_consecutive_roles(agent_id, new_messages,
+                                                     conversation[-1].role if conversation else None)
+        if not saved_messages:
+            return False
 
-        if isinstance(new_messages[0], ConversationMessage):  # Check only first message
-            new_messages = [TimestampedMessage(
-                    role=new_message.role,
-                    original_user_input=new_message.original_user_input,
-                    short_output=new_message.short_output,
-                    tokens=new_message.tokens,
-                    content=new_message.content
-                    )
-                for new_message in new_messages]
-
-        conversation.extend(new_messages)
-        conversation = self.trim_conversation(conversation, max_history_size)
-        self.conversations[key] = conversation
-        return self._remove_timestamps(conversation)
+        conversation.extend(self._timestamp_message(new_message, agent_id) for new_message in saved_messages)
+        agent_conversations[agent_id] = self.trim_conversation(conversation, max_history_size)
+        self.track_saved(user_id, session_id, agent_id, saved_messages, max_history_size)
+        return True
 
     async def fetch_chat(
         self,
         user_id: str,
         session_id: str,
         agent_id: str,
-        max_history_size: Optional[int] = None
-    ) -> list[dict]:
-        key = self._generate_key(user_id, session_id, agent_id)
-        conversation = self.conversations[key]
+        max_history_size: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ) -> Sequence[ConversationMessage]:
+        conversation = self.conversations.get((user_id, session_id), {}).get(agent_id, [])
         if max_history_size is not None:
             conversation = self.trim_conversation(conversation, max_history_size)
-        return self._remove_timestamps(conversation)
+        if max_tokens is not None:
+            conversation = self.window_by_tokens(reversed(conversation), max_tokens)
+        # Messages are immutable, so readers get the stored instances in a read-only sequence
+        return tuple(conversation)
 
     async def fetch_all_chats(
         self,
         user_id: str,
-        session_id: str
-    ) -> list[ConversationMessage]:
-        all_messages = []
-        for key, messages in self.conversations.items():
-            stored_user_id, stored_session_id, agent_id = key.split('#')
-            if stored_user_id == user_id and stored_session_id == session_id:
-                for message in messages:
-                    new_content = message.content if message.content else []
+        session_id: str,
+        max_tokens: Optional[int] = None
+    ) -> Sequence[ConversationMessage]:
+        agent_conversations = self.conversations.get((user_id, session_id))
+        if not agent_conversations:
+            return ()
 
-                    if len(new_content) > 0 and message.role == "assistant":
-                        new_content = [{'text':f"[{agent_id}] {new_content[0]['text']}"}]
-                    all_messages.append(TimestampedMessage(
-                        role=message.role,
-                        original_user_input=message.original_user_input,
-                        short_output=message.short_output,
-                        tokens=message.tokens,
-                        content=new_content,
-                        timestamp=message.timestamp
-                    ))
+        # Every agent's list is already in timestamp order, so a k-way merge replaces a full sort
+        if max_tokens is None:
+            return tuple(heapq.merge(*agent_conversations.values(), key=lambda message: message.timestamp))
+        # Newest first, breaking ties between agents in the reverse of the oldest first order
+        newest_first = heapq.merge(*(reversed(conversation) for conversation in reversed(agent_conversations.values())),
+                                   key=lambda message: message.timestamp, reverse=True)
+        return tuple(self.window_by_tokens(newest_first, max_tokens))
 
-        # Sort messages by timestamp
-        all_messages.sort(key=lambda x: x.timestamp)
-        return self._remove_timestamps(all_messages)
+    async def delete_session(
+        self,
+        user_id: str,
+        session_id: str
+    ) -> bool:
+        self.forget_session(user_id, session_id)
+        return self.conversations.pop((user_id, session_id), None) is not None
 
-    @staticmethod
-    def _generate_key(user_id: str, session_id: str, agent_id: str) -> str:
-        return f"{user_id}#{session_id}#{agent_id}"
+    async def evict_session(
+        self,
+        user_id: str,
+        session_id: str
+    ) -> bool:
+        # The history lives in process memory only
+        return await self.delete_session(user_id, session_id)
 
-    @staticmethod
-    def _remove_timestamps(messages: list[dict]) -> list[ConversationMessage]:
-        return [ConversationMessage(
+    def _timestamp_message(self, message: ConversationMessage, agent_id: str) -> TimestampedMessage:
+        return TimestampedMessage(
             role=message.role,
             original_user_input=message.original_user_input,
             short_output=message.short_output,
             tokens=message.tokens,
-            content=message.content
-            ) for message in messages]
\ No newline at end of file
+            content=message.content,
+            agent_id=agent_id,
+            content_tokens=self.count_tokens(message)
+        )
@@ -0,0 +1,347 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+from redis.asyncio import BlockingConnectionPool, Redis
+from chat_storage import ChatStorage
+from orchestrator_types import ConversationMessage, TimestampedMessage
+from token_counting import Tokenizer
+from loguru import logger
+
+# Keys of one session share a hash tag made from a digest of its user and session ids,
+# so they live in one cluster slot whatever characters the ids contain:
+#   <prefix>:{digest}:messages      hash   message id -> message JSON
+#   <prefix>:{digest}:tokens        hash   message id -> tokens of its content
+#   <prefix>:{digest}:timeline      zset   message id scored by timestamp
+#   <prefix>:{digest}:agent_index   zset   <agent id>\0<message id>, all scored 0
+#   <prefix>:{digest}:seq           string last message id
+# Message ids are zero padded, so messages saved in the same millisecond keep their order
+# in the timeline, and the agent index sorts each agent's messages together, oldest
+# first, for lexicographic range queries. Every key a script touches is passed in KEYS,
+# and every operation is one script call: one round trip to the server.
+
+# Lexicographic range of one agent's entries in the agent index; ARGV holds the agent id
+AGENT_RANGE = """
+local agent_id = {agent_id}
+local first_entry, last_entry = '[' .. agent_id .. '\\0', '(' .. agent_id .. '\\1'
+local function entry_id(entry)
+    return string.sub(entry, #agent_id + 2)
+end
+"""
+
+SAVE_SCRIPT = AGENT_RANGE.format(agent_id="ARGV[1]") + """
+local messages, timeline, agent_index, seq, tokens = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local limit, timestamp, ttl = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+
+-- The first message is not saved if the agent's last stored message has its role
+local first = 5
+local last_entry_found = redis.call('ZREVRANGEBYLEX', agent_index, last_entry, first_entry, 'LIMIT', 0, 1)[1]
+if last_entry_found then
+    local last = redis.call('HGET', messages, entry_id(last_entry_found))
+    if last and cjson.decode(last)['role'] == ARGV[6] then
+        first = 8
+    end
+end
+if first > #ARGV then
+    return 0
+end
+
+for i = first, #ARGV, 3 do
+    local id = string.format('%015d', redis.call('INCR', seq))
+    redis.call('HSET', messages, id, ARGV[i])
+    redis.call('HSET', tokens, id, ARGV[i + 2])
+    redis.call('ZADD', timeline, timestamp, id)
+    redis.call('ZADD', agent_index, 0, agent_id .. '\\0' .. id)
+end
+
+if limit > 0 then
+    local overflow = redis.call('ZLEXCOUNT', agent_index, first_entry, last_entry) - limit
+    if overflow > 0 then
+        local entries = redis.call('ZRANGEBYLEX', agent_index, first_entry, last_entry, 'LIMIT', 0, overflow)
+        for _, entry in ipairs(entries) do
+            local id = entry_id(entry)
+            redis.call('ZREM', agent_index, entry)
+            redis.call('HDEL', messages, id)
+            redis.call('HDEL', tokens, id)
+            redis.call('ZREM', timeline, id)
+        end
+    end
+end
+
+-- Every key of the session expires together
+if ttl > 0 then
+    for _, key in ipairs(KEYS) do
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+return math.floor((#ARGV - first + 1) / 3)
+"""
+
+# Message ids of the timeline, or of one agent in the agent index; ARGV[2] > 0 keeps only
+# that many of the agent's newest
+FETCH_IDS_SCRIPT = AGENT_RANGE.format(agent_id="ARGV[3]") + """
+local ids = {}
+if ARGV[1] == 'timeline' then
+    ids = redis.call('ZRANGE', KEYS[2], 0, -1)
+else
+    local limit = tonumber(ARGV[2])
+    local entries
+    if limit > 0 then
+        entries = redis.call('ZREVRANGEBYLEX', KEYS[2], last_entry, first_entry, 'LIMIT', 0, limit)
+        for i = #entries, 1, -1 do
+            ids[#ids + 1] = entry_id(entries[i])
+        end
+    else
+        entries = redis.call('ZRANGEBYLEX', KEYS[2], first_entry, last_entry)
+        for _, entry in ipairs(entries) do
+            ids[#ids + 1] = entry_id(entry)
+        end
+    end
+end
+local result = {}
+for start = 1, #ids, 1000 do
+    local chunk = redis.call('HMGET', KEYS[1], unpack(ids, start, math.min(start + 999, #ids)))
+    for _, message in ipairs(chunk) do
+        if message then
+            result[#result + 1] = message
+        end
+    end
+end
+return result
+"""
+
+# Newest messages whose token counts fit ARGV[2], walking the timeline or the agent's
+# entries in the agent index from the end in chunks, so only the messages kept (and one
+# chunk more) are read. ARGV[3] caps the number of messages looked at, 0 looks at all.
+# Returns them newest first.
+FETCH_WINDOW_SCRIPT = AGENT_RANGE.format(agent_id="ARGV[4]") + """
+local source, budget, limit = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local total
+if source == 'timeline' then
+    total = redis.call('ZCARD', KEYS[3])
+else
+    total = redis.call('ZLEXCOUNT', KEYS[3], first_entry, last_entry)
+end
+if limit > 0 and limit < total then
+    total = limit
+end
+
+local ids, used, offset, full = {}, 0, 0, false
+while offset < total and not full do
+    local stop = math.min(offset + 99, total - 1)
+    local chunk = {}
+    if source == 'timeline' then
+        chunk = redis.call('ZREVRANGE', KEYS[3], offset, stop)
+    else
+        local entries = redis.call('ZREVRANGEBYLEX', KEYS[3], last_entry, first_entry, 'LIMIT', offset, stop - offset + 1)
+        for _, entry in ipairs(entries) do
+            chunk[#chunk + 1] = entry_id(entry)
+        end
+    end
+    local counts = redis.call('HMGET', KEYS[2], unpack(chunk))
+    for i, id in ipairs(chunk) do
+        used = used + (tonumber(counts[i]) or 0)
+        if used > budget then
+            full = true
+            break
+        end
+        ids[#ids + 1] = id
+    end
+    offset = stop + 1
+end
+
+local result = {}
+for start = 1, #ids, 1000 do
+    local chunk = redis.call('HMGET', KEYS[1], unpack(ids, start, math.min(start + 999, #ids)))
+    for _, message in ipairs(chunk) do
+        if message then
+            result[#result + 1] = message
+        end
+    end
+end
+return result
+"""
+
+DELETE_SCRIPT = """
+return redis.call('DEL', unpack(KEYS))
+"""
+
+
+class RedisStorage(ChatStorage):
+    """
+    Chat storage in Redis (or any server speaking its protocol), shared by every node.
+
+    Each agent's history is a range of the session's agent index, trimmed on the server,
+    and a sorted set per session orders all of the session's messages by time for
+    fetch_all_chats. Every save and
+    fetch is a single script call on a pooled connection, so it costs one round trip
+    however many agents or messages are involved.
+    """
+    def __init__(self,
+                 url: str = "redis://localhost:6379/0",
+                 max_connections: int = 64,
+                 key_prefix: str = "chat",
+                 ttl_seconds: Optional[int] = None,
+                 pool_timeout: Optional[float] = 5.0,
+                 client: Optional[Redis] = None,
+                 tokenizer: Optional[Tokenizer] = None):
+        super().__init__(tokenizer)
+        self.key_prefix = key_prefix
+        self.ttl_seconds = ttl_seconds
+        # Callers wait for a free connection instead of failing when all of them are busy
+        self.client = client or Redis(connection_pool=BlockingConnectionPool.from_url(
+            url, max_connections=max_connections, timeout=pool_timeout))
+        self.save_script = self.client.register_script(SAVE_SCRIPT)
+        self.fetch_ids_script = self.client.register_script(FETCH_IDS_SCRIPT)
+        self.fetch_window_script = self.client.register_script(FETCH_WINDOW_SCRIPT)
+        self.delete_script = self.client.register_script(DELETE_SCRIPT)
+
+    async def load_scripts(self) -> None:
+        """Load the scripts on the server up front, so no call pays for a NOSCRIPT retry."""
+        for script in (self.save_script, self.fetch_ids_script, self.fetch_window_script, self.delete_script):
+            await self.client.script_load(script.script)
+
+    def _session_keys(self, user_id: str, session_id: str) -> Dict[str, str]:
+        # The ids may contain braces or the separator, so the hash tag is a digest of both
+        digest = hashlib.sha256(json.dumps([user_id, session_id]).encode()).hexdigest()[:32]
+        base = f"{self.key_prefix}:{{{digest}}}"
+        return {
+            'messages': f"{base}:messages",
+            'tokens': f"{base}:tokens",
+            'timeline': f"{base}:timeline",
+            'agent_index': f"{base}:agent_index",
+            'seq': f"{base}:seq"
+        }
+
+    async def save_message(
+        self,
+        user_id: str,
+        session_id: str,
+        agent_id: str,
+        new_message: Union[ConversationMessage, TimestampedMessage],
+        max_history_size: Optional[int] = None
+    ) -> bool:
+        return await self._save(user_id, session_id, agent_id, [new_message], max_history_size)
+
+    async def save_messages(self,
+                            user_id: str,
+                            session_id: str,
+                            agent_id: str,
+                            new_messages: Union[list[ConversationMessage], list[TimestampedMessage]],
+                            max_history_size: Optional[int] = None
+    ) -> bool:
+        if not new_messages:
+            return False
+        return await self._save(user_id, session_id, agent_id, new_messages, max_history_size)
+
+    async def _save(self,
+                    user_id: str,
+                    session_id: str,
+                    agent_id: str,
+                    new_messages: Sequence[ConversationMessage],
+                    max_history_size: Optional[int]) -> bool:
+        # Roles within the batch are checked here, the first one against the stored history by the script
+        new_messages = self.drop_consecutive_roles(agent_id, new_messages, None)
+        keys = self._session_keys(user_id, session_id)
+        timestamp = int(time.time() * 1000)
+        args: List[Any] = [agent_id, self._history_limit(max_history_size), timestamp, self.ttl_seconds or 0]
+        for message in new_messages:
+            content_tokens = self.count_tokens(message)
+            args.extend([self._serialize(message, agent_id, timestamp, content_tokens), message.role, content_tokens])
+
+        try:
+            saved = await self.save_script(
+                keys=[keys['messages'], keys['timeline'], keys['agent_index'], keys['seq'], keys['tokens']],
+                args=args)
+        except Exception as error:
+            logger.error(f"Error saving messages to Redis: {str(error)}")
+            raise error
+
+        if saved < len(new_messages):
+            logger.debug(f"> Consecutive {new_messages[0].role} \
+                       message detected for agent {agent_id}. Not saving.")
+        if not saved:
+            return False
+        self.track_saved(user_id, session_id, agent_id, new_messages[len(new_messages) - saved:], max_history_size)
+        return True
+
+    async def fetch_chat(
+        self,
+        user_id: str,
+        session_id: str,
+        agent_id: str,
+        max_history_size: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ) -> Sequence[ConversationMessage]:
+        keys = self._session_keys(user_id, session_id)
+        limit = self._history_limit(max_history_size)
+        if max_tokens is not None:
+            return await self._fetch_window(keys, keys['agent_index'], 'agent', max_tokens, limit, agent_id)
+        messages = await self.fetch_ids_script(keys=[keys['messages'], keys['agent_index']],
+                                               args=['agent', limit, agent_id])
+        return tuple(self._deserialize(message) for message in messages)
+
+    async def fetch_all_chats(
+        self,
+        user_id: str,
+        session_id: str,
+        max_tokens: Optional[int] = None
+    ) -> Sequence[ConversationMessage]:
+        keys = self._session_keys(user_id, session_id)
+        if max_tokens is not None:
+            return await self._fetch_window(keys, keys['timeline'], 'timeline', max_tokens, 0, "")
+        messages = await self.fetch_ids_script(keys=[keys['messages'], keys['timeline']], args=['timeline', 0, ""])
+        return tuple(self._deserialize(message) for message in messages)
+
+    async def _fetch_window(self, keys: Dict[str, str], source_key: str, source: str,
+                            max_tokens: int, limit: int, agent_id: str) -> Sequence[ConversationMessage]:
+        newest_first = await self.fetch_window_script(keys=[keys['messages'], keys['tokens'], source_key],
+                                                      args=[source, max_tokens, limit, agent_id])
+        return tuple(self.start_on_request([self._deserialize(message) for message in reversed(newest_first)]))
+
+    async def delete_session(
+        self,
+        user_id: str,
+        session_id: str
+    ) -> bool:
+        self.forget_session(user_id, session_id)
+        keys = self._session_keys(user_id, session_id)
+        deleted = await self.delete_script(keys=list(keys.values()))
+        return deleted > 0
+
+    @staticmethod
+    def _serialize(message: ConversationMessage, agent_id: str, timestamp: int, content_tokens: int) -> str:
+        return json.dumps({
+            'role': message.role,
+            'original_user_input': message.original_user_input,
+            'short_output': message.short_output,
+            'tokens': message.tokens,
+            'content': list(message.content) if message.content is not None else None,
+            'timestamp': timestamp,
+            'agent_id': agent_id,
+            'content_tokens': content_tokens
+        })
+
+    @staticmethod
+    def _deserialize(raw: Union[bytes, str]) -> TimestampedMessage:
+        message = json.loads(raw)
+        return TimestampedMessage(
+            role=message['role'],
+            original_user_input=message['original_user_input'],
+            short_output=message['short_output'],
+            content=message['content'],
+            tokens=message['tokens'],
+            timestamp=message['timestamp'],
+            agent_id=message['agent_id'],
+            content_tokens=message.get('content_tokens', 0)
+        )
+
+    @staticmethod
+    def _history_limit(max_history_size: Optional[int]) -> int:
+        """Same rule as trim_conversation: keep an even number of messages, 0 keeps all."""
+        if max_history_size is None:
+            return 0
+        return max_history_size if max_history_size % 2 == 0 else max_history_size - 1
+
+    async def close(self) -> None:
+        await self.client.aclose()
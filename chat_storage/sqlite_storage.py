@@ -0,0 +1,300 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, Union
+from chat_storage import ChatStorage
+from orchestrator_types import ConversationMessage, TimestampedMessage
+from token_counting import Tokenizer
+from loguru import logger
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        agent_id TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        original_user_input TEXT,
+        short_output TEXT,
+        tokens INTEGER,
+        content TEXT,
+        content_tokens INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # Covers the per-agent lookups, the ordering and the trimming (the rowid is part of every index)
+    """
+    CREATE INDEX IF NOT EXISTS idx_messages_session_agent_time
+    ON messages (user_id, session_id, agent_id, timestamp)
+    """
+]
+
+# Databases created before messages had token counts get the column, with 0 for the old rows
+ADD_CONTENT_TOKENS = "ALTER TABLE messages ADD COLUMN content_tokens INTEGER NOT NULL DEFAULT 0"
+
+INSERT_MESSAGE = """
+    INSERT INTO messages (user_id, session_id, agent_id, timestamp, role, original_user_input, short_output, tokens,
+                          content, content_tokens)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SELECT_LAST_ROLE = """
+    SELECT role FROM messages
+    WHERE user_id = ? AND session_id = ? AND agent_id = ?
+    ORDER BY timestamp DESC, id DESC LIMIT 1
+"""
+
+TRIM_CONVERSATION = """
+    DELETE FROM messages
+    WHERE user_id = ? AND session_id = ? AND agent_id = ?
+    AND id NOT IN (
+        SELECT id FROM messages
+        WHERE user_id = ? AND session_id = ? AND agent_id = ?
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    )
+"""
+
+MESSAGE_COLUMNS = "agent_id, timestamp, role, original_user_input, short_output, tokens, content, content_tokens"
+
+SELECT_CHAT = f"""
+    SELECT {MESSAGE_COLUMNS} FROM messages
+    WHERE user_id = ? AND session_id = ? AND agent_id = ?
+    ORDER BY timestamp, id
+"""
+
+SELECT_CHAT_TAIL = f"""
+    SELECT {MESSAGE_COLUMNS} FROM (
+        SELECT id, {MESSAGE_COLUMNS} FROM messages
+        WHERE user_id = ? AND session_id = ? AND agent_id = ?
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ) ORDER BY timestamp, id
+"""
+
+SELECT_ALL_CHATS = f"""
+    SELECT {MESSAGE_COLUMNS} FROM messages
+    WHERE user_id = ? AND session_id = ?
+    ORDER BY timestamp, id
+"""
+
+# Token windows: the running total of content_tokens from the newest message back, so the
+# messages kept are the newest ones whose total fits the budget. LIMIT -1 keeps every row.
+SELECT_CHAT_WINDOW = f"""
+    SELECT {MESSAGE_COLUMNS} FROM (
+        SELECT id, {MESSAGE_COLUMNS},
+               SUM(content_tokens) OVER (ORDER BY timestamp DESC, id DESC) AS newer_tokens
+        FROM messages
+        WHERE user_id = ? AND session_id = ? AND agent_id = ?
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ) WHERE newer_tokens <= ? ORDER BY timestamp, id
+"""
+
+SELECT_ALL_CHATS_WINDOW = f"""
+    SELECT {MESSAGE_COLUMNS} FROM (
+        SELECT id, {MESSAGE_COLUMNS},
+               SUM(content_tokens) OVER (ORDER BY timestamp DESC, id DESC) AS newer_tokens
+        FROM messages
+        WHERE user_id = ? AND session_id = ?
+    ) WHERE newer_tokens <= ? ORDER BY timestamp, id
+"""
+
+DELETE_SESSION = "DELETE FROM messages WHERE user_id = ? AND session_id = ?"
+
+
+class SqliteStorage(ChatStorage):
+    """
+    Chat storage in a SQLite database file, shared by every process that opens it.
+
+    The database runs in WAL mode, so readers do not block the writer. Queries run on
+    a bounded pool of worker threads, each owning one connection with its own cache
+    of prepared statements, so the event loop never waits on disk.
+    """
+    def __init__(self,
+                 db_path: str = "chat_history.db",
+                 pool_size: int = 4,
+                 busy_timeout_ms: int = 5000,
+                 tokenizer: Optional[Tokenizer] = None):
+        super().__init__(tokenizer)
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="sqlite-storage")
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        connection = self._connect()
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(messages)")}
+            if 'content_tokens' not in columns:
+                connection.execute(ADD_CONTENT_TOKENS)
+        connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        connection = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                                     cached_statements=64)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return connection
+
+    def _get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    async def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._in_connection, function, args)
+
+    def _in_connection(self, function: Callable[..., Any], args: tuple) -> Any:
+        return function(self._get_connection(), *args)
+
+    async def save_message(
+        self,
+        user_id: str,
+        session_id: str,
+        agent_id: str,
+        new_message: Union[ConversationMessage, TimestampedMessage],
+        max_history_size: Optional[int] = None
+    ) -> bool:
+        try:
+            saved_messages = await self._run(self._save, user_id, session_id, agent_id, [new_message], max_history_size)
+        except Exception as error:
+            logger.error(f"Error saving message to SQLite: {str(error)}")
+            raise error
+        if saved_messages:
+            self.track_saved(user_id, session_id, agent_id, saved_messages, max_history_size)
+        return bool(saved_messages)
+
+    async def save_messages(self,
+                            user_id: str,
+                            session_id: str,
+                            agent_id: str,
+                            new_messages: Union[list[ConversationMessage], list[TimestampedMessage]],
+                            max_history_size: Optional[int] = None
+    ) -> bool:
+        if not new_messages:
+            return False
+        try:
+            saved_messages = await self._run(self._save, user_id, session_id, agent_id, new_messages, max_history_size)
+        except Exception as error:
+            logger.error(f"Error saving messages to SQLite: {str(error)}")
+            raise error
+        if saved_messages:
+            self.track_saved(user_id, session_id, agent_id, saved_messages, max_history_size)
+        return bool(saved_messages)
+
+    def _save(self,
+              connection: sqlite3.Connection,
+              user_id: str,
+              session_id: str,
+              agent_id: str,
+              new_messages: Sequence[ConversationMessage],
+              max_history_size: Optional[int]) -> List[ConversationMessage]:
+        """Save the messages that pass the role check; returns them."""
+        # One write transaction: role check, batch insert and trimming are atomic across processes
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            last_role = connection.execute(SELECT_LAST_ROLE, (user_id, session_id, agent_id)).fetchone()
+            saved_messages = self.drop_consecutive_roles(agent_id, new_messages, last_role[0] if last_role else None)
+            if not saved_messages:
+                connection.execute("ROLLBACK")
+                return saved_messages
+
+            timestamp = int(time.time() * 1000)
+            connection.executemany(INSERT_MESSAGE, [
+                (user_id, session_id, agent_id, timestamp, message.role, message.original_user_input,
+                 message.short_output, message.tokens, json.dumps(list(message.content)) if message.content is not None else None,
+                 self.count_tokens(message))
+                for message in saved_messages
+            ])
+
+            limit = self._history_limit(max_history_size)
+            if limit is not None:
+                connection.execute(TRIM_CONVERSATION, (user_id, session_id, agent_id,
+                                                       user_id, session_id, agent_id, limit))
+            connection.execute("COMMIT")
+            return saved_messages
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    async def fetch_chat(
+        self,
+        user_id: str,
+        session_id: str,
+        agent_id: str,
+        max_history_size: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ) -> Sequence[ConversationMessage]:
+        limit = self._history_limit(max_history_size)
+        if max_tokens is not None:
+            return self.start_on_request(await self._run(
+                self._fetch, SELECT_CHAT_WINDOW, (user_id, session_id, agent_id, limit or -1, max_tokens)))
+        if limit is None:
+            return await self._run(self._fetch, SELECT_CHAT, (user_id, session_id, agent_id))
+        return await self._run(self._fetch, SELECT_CHAT_TAIL, (user_id, session_id, agent_id, limit))
+
+    async def fetch_all_chats(
+        self,
+        user_id: str,
+        session_id: str,
+        max_tokens: Optional[int] = None
+    ) -> Sequence[ConversationMessage]:
+        if max_tokens is not None:
+            return self.start_on_request(await self._run(
+                self._fetch, SELECT_ALL_CHATS_WINDOW, (user_id, session_id, max_tokens)))
+        return await self._run(self._fetch, SELECT_ALL_CHATS, (user_id, session_id))
+
+    @staticmethod
+    def _fetch(connection: sqlite3.Connection, query: str, parameters: tuple) -> Sequence[ConversationMessage]:
+        return tuple(TimestampedMessage(
+            role=role,
+            original_user_input=original_user_input,
+            short_output=short_output,
+            content=json.loads(content) if content is not None else None,
+            tokens=tokens,
+            timestamp=timestamp,
+            agent_id=agent_id,
+            content_tokens=content_tokens
+        ) for agent_id, timestamp, role, original_user_input, short_output, tokens, content, content_tokens
+          in connection.execute(query, parameters))
+
+    async def delete_session(
+        self,
+        user_id: str,
+        session_id: str
+    ) -> bool:
+        self.forget_session(user_id, session_id)
+        return await self._run(self._delete_session, user_id, session_id)
+
+    @staticmethod
+    def _delete_session(connection: sqlite3.Connection, user_id: str, session_id: str) -> bool:
+        return connection.execute(DELETE_SESSION, (user_id, session_id)).rowcount > 0
+
+    @staticmethod
+    def _history_limit(max_history_size: Optional[int]) -> Optional[int]:
+        """Same rule as trim_conversation: keep an even number of messages."""
+        if max_history_size is None:
+            return None
+        limit = max_history_size if max_history_size % 2 == 0 else max_history_size - 1
+        return limit or None
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
@@ -0,0 +1,79 @@
+from abc import ABC, abstractmethod
+from typing import Optional, Sequence
+from openai import AsyncOpenAI
+from loguru import logger
+from orchestrator_types import ConversationMessage
+from clients import get_openai_client
+from token_counting import RequestUsage, TokenUsage
+
+SUMMARY_PROMPT = """You keep a running summary of a conversation between a user and several assistant agents.
+Update the current summary with the new messages. Keep the facts, names, numbers, labels, decisions and
+open questions that later requests may refer to, and which agent produced each result. Drop greetings and
+repetitions. Reply with the updated summary only, in at most {max_words} words."""
+
+class ConversationSummarizer(ABC):
+    """Folds chat messages into a running summary of the conversation."""
+
+    SOURCE = "summarizer"
+
+    @abstractmethod
+    async def summarize(self,
+                        summary: str,
+                        messages: Sequence[ConversationMessage],
+                        usage: Optional[RequestUsage] = None) -> str:
+        """
+        Fold messages, oldest first, into the current summary ("" the first time).
+        Model calls made to do so are recorded in usage, under the SOURCE source.
+        Returns:
+            str: The updated summary.
+        """
+
+    @staticmethod
+    def format_messages(messages: Sequence[ConversationMessage]) -> str:
+        lines = []
+        for message in messages:
+            agent_id = getattr(message, 'agent_id', None)
+            label = f"[{agent_id}] " if agent_id and message.role == "assistant" else ""
+            text = ' '.join(part.get('text', '') for part in message.content or () if isinstance(part, dict))
+            lines.append(f"{message.role}: {label}{text}")
+        return "\n".join(lines)
+
+class OpenAISummarizer(ConversationSummarizer):
+    def __init__(self,
+                 api_key: str,
+                 model: Optional[str] = None,
+                 max_words: int = 300,
+                 client: Optional[AsyncOpenAI] = None):
+        if not api_key and client is None:
+            raise ValueError("OpenAI API key is required")
+        self.api_key = api_key
+        self.model = model or "gpt-4o-mini"
+        self.max_words = max_words
+        self.client = client
+
+    def get_client(self) -> AsyncOpenAI:
+        return self.client or get_openai_client(self.api_key)
+
+    async def summarize(self,
+                        summary: str,
+                        messages: Sequence[ConversationMessage],
+                        usage: Optional[RequestUsage] = None) -> str:
+        try:
+            response = await self.get_client().chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT.format(max_words=self.max_words)},
+                    {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\n"
+                                                f"New messages:\n{self.format_messages(messages)}"}
+                ],
+                # About four tokens per three words, with some room
+                max_tokens=self.max_words * 2,
+                temperature=0.0
+            )
+            token_usage = TokenUsage.from_response(response.usage, self.model)
+            if usage is not None and token_usage is not None:
+                usage.record(self.SOURCE, 0, token_usage, self.api_key)
+            return (response.choices[0].message.content or "").strip()
+        except Exception as error:
+            logger.error(f"Error summarizing conversation: {str(error)}")
+            raise error
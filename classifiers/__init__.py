@@ -1,9 +1,17 @@
-from .base_classifier import Classifier, ClassifierResult
+from .base_classifier import Classifier, ClassifierResult, PlanStep
+from .routing_cache import RoutingCache, RoutingCacheBackend, InMemoryRoutingCacheBackend
 from .open_ai_classifier import OpenAIClassifier, OpenAIClassifierOptions
+from .fast_path_classifier import FastPathClassifier, FastPathClassifierOptions
 
 __all__=[
     'Classifier',
     'ClassifierResult',
+    'PlanStep',
+    'RoutingCache',
+    'RoutingCacheBackend',
+    'InMemoryRoutingCacheBackend',
     'OpenAIClassifier',
-    'OpenAIClassifierOptions'
+    'OpenAIClassifierOptions',
+    'FastPathClassifier',
+    'FastPathClassifierOptions'
 ]
\ No newline at end of file
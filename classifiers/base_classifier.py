@@ -1,10 +1,18 @@
 from abc import ABC, abstractmethod
 import re
-from typing import Dict, List, Optional, Union
-from dataclasses import dataclass
-from orchestrator_types import ConversationMessage
+from typing import Any, Dict, List, Optional, Union
+from dataclasses import dataclass, field
+from orchestrator_types import ConversationMessage, RequestContext
 from agents import Agent
+from prompts import compile_template
+from token_counting import TokenUsage
+from .routing_cache import RoutingCache
 
+# Words that chain a second task onto the first, used to guess that a request needs several agents
+MULTI_TASK_PATTERN = re.compile(
+    r'\b(and then|after that|afterwards|then|also|finally|last task|next task)\b|;'
+    r'|\band\s+(find|evaluate|classify|search|calculate|compute|explain|summari[sz]e|translate|tell|give|list|write)\b',
+    re.IGNORECASE)
 
 @dataclass
 class ClassifierResult:
@@ -14,14 +22,23 @@ class ClassifierResult:
     action: str 
     next_action: str
     next_action_input: str
+    # Token usage reported by the model, None when no model was called
+    usage: Optional[TokenUsage] = None
+    # The selected agent's answer, when the classifier answered in its persona in fused mode
+    output: Optional[str] = None
+    short_output: Optional[str] = None
+
+@dataclass
+class PlanStep:
+    id: str
+    input: str
+    agent_selected: Optional[Agent]
+    depends_on: List[str] = field(default_factory=list)
 
 class Classifier(ABC):
     def __init__(self):
         self.agent_descriptions = ""
-        self.original_user_input = ""
-        self.subtask_input = ""
-        self.chat_history = ""
-        self.prompt_template = """
+        self.routing_prompt_template = """
                                     You are AgentMatcher, an intelligent assistant designed to analyze user queries and match them with
                                     the most suitable agent or department. Your task is to understand the user's request,
                                     identify key entities and intents, and determine which agent or department would be best equipped
@@ -32,16 +49,6 @@ class Classifier(ABC):
                                     If the user's input appears to be a continuation of the previous conversation
                                     (e.g., "yes", "ok", "I want to know more", "1"), select the same agent as before.
                                     
-                                    Below is original user input
-                                    <original_user_input>
-                                    {{ORIGINAL_USER_INPUT}}
-                                    </orignal_user_input>
-
-                                    Below is current sub-task input
-                                    <subtask_input>
-                                    {{SUBTASK_INPUT}}
-                                    </subtask_input>
-
                                     Analyze the user's input then divide the input query into sub-tasks if needed and pick apporpriate agent for the sub-task from the following agent types:
                                     <agents>
                                     {{AGENT_DESCRIPTIONS}}
@@ -70,11 +77,6 @@ class Classifier(ABC):
                                     For short responses like "yes", "ok", "I want to know more", or numerical answers,
                                     treat them as follow-ups and maintain the previous agent selection.
 
-                                    Here is the conversation history that you need to take into account before answering:
-                                    <history>
-                                    {{HISTORY}}
-                                    </history>
-
                                     Examples:
 
                                     1. Initial query with no context:
@@ -150,57 +152,254 @@ class Classifier(ABC):
                                     - You will have original user input and the current sub-task input, Check if all the goals of the original user input is met, if not make sure to analyse current sub-task input, provide answer for it then determine remaining task that needs to be done and feed it as "next-agent-input" and select "next_action" to achieve complete goal of the user input.
                                     If you are unable to select an agent put "unknown"
                                     """
-        self.system_prompt = ""
-        self.agents: Dict[str, Agent] = {}
+        # Per-request blocks go last, so everything before them is a prefix shared by every request
+        self.request_prompt_template = """
+
+                                    Below is original user input
+                                    <original_user_input>
+                                    {{ORIGINAL_USER_INPUT}}
+                                    </orignal_user_input>
+
+                                    Below is current sub-task input
+                                    <subtask_input>
+                                    {{SUBTASK_INPUT}}
+                                    </subtask_input>
+
+                                    Here is the conversation history that you need to take into account before answering:
+                                    <history>
+                                    {{HISTORY}}
+                                    </history>
+                                    """
+        self.prompt_template = self.routing_prompt_template + self.request_prompt_template
+        self.plan_prompt_template = """
+                                    You are AgentPlanner, an intelligent assistant that splits a user request into sub-tasks
+                                    and assigns every sub-task to the most suitable agent, all in one go.
+
+                                    Analyze the user's input and pick the apporpriate agent for every sub-task from the following agent types:
+                                    <agents>
+                                    {{AGENT_DESCRIPTIONS}}
+                                    </agents>
+
+                                    ###Guidelines###
+                                    - Create one sub-task per independent piece of work. A request with a single task has a single sub-task.
+                                    - Give every sub-task a short unique "id" such as "t1", "t2".
+                                    - The "input" of a sub-task must contain the complete query for that sub-task, copied from the user input.
+                                    - If a sub-task needs the result of other sub-tasks, list their ids in "depends_on". Their results will be
+                                      appended to its input before it runs. Otherwise leave "depends_on" empty so it can run in parallel.
+                                    - Never create circular dependencies.
+                                    - If no agent fits a sub-task put "unknown" in "agent_selected".
 
-    def set_original_user_input(self, user_input: str):
-        self.original_user_input = user_input
+                                    Skip any preamble and provide only the response in the specified format.
+
+                                    Here is the conversation history that you need to take into account before answering:
+                                    <history>
+                                    {{HISTORY}}
+                                    </history>
+
+                                    Below is original user input
+                                    <original_user_input>
+                                    {{ORIGINAL_USER_INPUT}}
+                                    </orignal_user_input>
+                                    """
+        self.fused_prompt_template = """
+                                    ###Answering directly###
+                                    - If the whole user input is one task for one of the agents below and "next_action" is "respond_to_user",
+                                      also answer it yourself as the selected agent would: put the detailed answer in "output" and only the
+                                      specific answer the task demands, without details and other contexts, in "short_output".
+                                    - Answer in the selected agent's persona and within what it specializes in:
+                                        <answering_agents>
+                                        {{FUSED_AGENT_DESCRIPTIONS}}
+                                        </answering_agents>
+                                    - Leave "output" and "short_output" empty if the input has more than one task, needs any other agent,
+                                      needs live or external information, or you are not sure of the answer. The agent will answer it then.
+                                    """
+        # Joined once, so the compile_template cache is looked up with the same string every request
+        self.fused_template = self.routing_prompt_template + self.fused_prompt_template + self.request_prompt_template
+        self.agents: Dict[str, Agent] = {}
+        self.fused_agent_descriptions = ""
+        self.routing_cache: Optional[RoutingCache] = None
 
-    def set_sutask_input(self, subtask_input: str):
-        self.subtask_input = subtask_input
+    def set_routing_cache(self, routing_cache: Optional[RoutingCache]) -> None:
+        self.routing_cache = routing_cache
 
     def set_agents(self, agents: Dict[str, Agent]) -> None:
         self.agent_descriptions = "\n\n".join(f"{agent.id}:{agent.description}"
                                               for agent in agents.values())
+        self.fused_agent_descriptions = "\n\n".join(f"{agent.id}:{agent.description}"
+                                                    for agent in agents.values() if agent.supports_fused_answer())
         self.agents = agents
 
-    def set_history(self, messages: List[ConversationMessage]) -> None:
-        self.chat_history = self.format_messages(messages)
-
     @staticmethod
     def format_messages(messages: List[ConversationMessage]) -> str:
         return "\n".join([
             f"Original User Input: {message.original_user_input}\n" +
-            f"{message.role}: {' '.join([message.content[0]['text']])}" for message in messages
+            f"{message.role}: {Classifier.agent_label(message)}{' '.join([message.content[0]['text']])}" for message in messages
         ])
 
+    @staticmethod
+    def agent_label(message: ConversationMessage) -> str:
+        """Assistant messages are prefixed with the agent that answered them."""
+        agent_id = getattr(message, 'agent_id', None)
+        return f"[{agent_id}] " if agent_id and message.role == "assistant" else ""
+
+    def predict_single_hop(self, input_text: str) -> bool:
+        """
+        Cheap guess, without a model call, of whether a request needs exactly one agent:
+        a single question with no sequencing words and no second task joined by "and".
+        """
+        return not MULTI_TASK_PATTERN.search(input_text) and input_text.count("?") <= 1
+
     async def classify(self,
                        input_text: str,
-                       chat_history: List[ConversationMessage]) -> ClassifierResult:
-        self.set_history(chat_history)
-        self.update_system_prompt()
-        return await self.make_request(input_text)
+                       chat_history: List[ConversationMessage],
+                       context: RequestContext,
+                       fused: bool = False) -> ClassifierResult:
+        """
+        Pick the agent for the input. With fused, the classifier may also answer the
+        input in the selected agent's persona, in the output and short_output of the
+        result; classifiers without fused support just route.
+        """
+        cache_key = None
+        if self.routing_cache:
+            cache_key = self.routing_cache.build_key(input_text, self.agent_descriptions, chat_history, context)
+            cached_result = self.result_from_cache(await self.routing_cache.get(cache_key))
+            if cached_result:
+                return cached_result
+
+        result = None
+        if fused and self.fused_agent_descriptions:
+            try:
+                result = await self.make_fused_request(input_text,
+                                                       self.build_fused_prompt(context, chat_history),
+                                                       context)
+            except NotImplementedError:
+                result = None
+        if result is None:
+            result = await self.make_request(input_text, self.build_system_prompt(context, chat_history), context)
+        self.record_usage(context, result.usage)
+
+        if cache_key and result.agent_selected:
+            await self.routing_cache.set(cache_key, self.result_to_cache(result))
+        return result
+
+    @staticmethod
+    def result_to_cache(result: ClassifierResult) -> Dict[str, Any]:
+        return {
+            'input': result.input,
+            'agent_id': result.agent_selected.id if result.agent_selected else None,
+            'accuracy': result.accuracy,
+            'action': result.action,
+            'next_action': result.next_action,
+            'next_action_input': result.next_action_input
+        }
+
+    def result_from_cache(self, entry: Optional[Dict[str, Any]]) -> Optional[ClassifierResult]:
+        if not entry:
+            return None
+        # Agents are looked up again so a cached decision never holds a stale instance
+        agent = self.get_agent_by_id(entry['agent_id'])
+        if agent is None:
+            return None
+        return ClassifierResult(
+            input=entry['input'],
+            agent_selected=agent,
+            accuracy=entry['accuracy'],
+            action=entry['action'],
+            next_action=entry['next_action'],
+            next_action_input=entry['next_action_input']
+        )
 
     @abstractmethod
-    async def make_request(self,input_text: str) -> ClassifierResult:
+    async def make_request(self,
+                           input_text: str,
+                           system_prompt: str,
+                           context: Optional[RequestContext] = None) -> ClassifierResult:
         pass
 
-    def update_system_prompt(self) -> None:
+    async def make_fused_request(self,
+                                 input_text: str,
+                                 system_prompt: str,
+                                 context: Optional[RequestContext] = None) -> ClassifierResult:
+        """
+        Classifiers whose routing call can also carry the selected agent's answer
+        override this; the answer goes in the output and short_output of the result.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support fused answers")
+
+    async def plan(self,
+                   input_text: str,
+                   chat_history: List[ConversationMessage],
+                   context: RequestContext) -> List[PlanStep]:
+        system_prompt = self.build_plan_prompt(context, chat_history)
+        return await self.make_plan_request(input_text, system_prompt, context)
+
+    async def make_plan_request(self,
+                                input_text: str,
+                                system_prompt: str,
+                                context: Optional[RequestContext] = None) -> List[PlanStep]:
+        """
+        Classifiers that can plan a whole request in one call override this, and report
+        the usage of the call with record_usage when a context is given.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support planning")
+
+    @staticmethod
+    def budgeted_max_tokens(context: Optional[RequestContext], configured: Optional[int]) -> Optional[int]:
+        """max_tokens for a classifier call, lowered to the tokens the request's budget has left."""
+        return context.budget.max_output_tokens(configured) if context and context.budget else configured
+
+    @staticmethod
+    def check_budget_cutoff(context: Optional[RequestContext],
+                            finish_reason: Optional[str],
+                            configured: Optional[int],
+                            max_tokens: Optional[int]) -> None:
+        """Stop the request on its token budget if the call was cut off at the max_tokens the budget lowered."""
+        if context and context.budget:
+            context.budget.check_output(finish_reason, configured, max_tokens)
+
+    def record_usage(self, context: Optional[RequestContext], usage: Any) -> None:
+        """Charge the usage of a classifier call to the request's budget and usage."""
+        usage = TokenUsage.from_response(usage, getattr(self, 'model', None))
+        if context is None or usage is None:
+            return
+        if context.budget:
+            context.budget.record_usage(usage)
+        if context.usage:
+            context.usage.record("classifier", context.hop, usage, getattr(self, 'api_key', None))
+
+    def build_system_prompt(self,
+                            context: RequestContext,
+                            chat_history: List[ConversationMessage]) -> str:
         all_variables: Dict[str, Union[str, List[str]]] = {
-            "ORIGINAL_USER_INPUT": self.original_user_input,
-            "SUBTASK_INPUT": self.subtask_input,
-            "AGENT_DESCRIPTIONS": self.agent_descriptions,
-            "HISTORY": self.chat_history,
+            "ORIGINAL_USER_INPUT": context.original_user_input,
+            "SUBTASK_INPUT": context.subtask_input,
+            "HISTORY": self.format_messages(chat_history),
         }
-        self.system_prompt = self.replace_placeholders(self.prompt_template, all_variables)
+        # The agent descriptions only change with the agents, so they are bound once, not rendered per request
+        return compile_template(self.prompt_template).bind(
+            AGENT_DESCRIPTIONS=self.agent_descriptions).render(all_variables)
 
-    @staticmethod
-    def replace_placeholders(template: str, variables: Dict[str, Union[str, List[str]]]) -> str:
+    def build_fused_prompt(self,
+                           context: RequestContext,
+                           chat_history: List[ConversationMessage]) -> str:
+        all_variables: Dict[str, Union[str, List[str]]] = {
+            "ORIGINAL_USER_INPUT": context.original_user_input,
+            "SUBTASK_INPUT": context.subtask_input,
+            "HISTORY": self.format_messages(chat_history),
+        }
+        return compile_template(self.fused_template).bind(
+            AGENT_DESCRIPTIONS=self.agent_descriptions,
+            FUSED_AGENT_DESCRIPTIONS=self.fused_agent_descriptions).render(all_variables)
 
-        return re.sub(r'{{(\w+)}}',
-                      lambda m: '\n'.join(variables.get(m.group(1), [m.group(0)]))
-                      if isinstance(variables.get(m.group(1)), list)
-                      else variables.get(m.group(1), m.group(0)), template)
+    def build_plan_prompt(self,
+                          context: RequestContext,
+                          chat_history: List[ConversationMessage]) -> str:
+        all_variables: Dict[str, Union[str, List[str]]] = {
+            "ORIGINAL_USER_INPUT": context.original_user_input,
+            "HISTORY": self.format_messages(chat_history),
+        }
+        return compile_template(self.plan_prompt_template).bind(
+            AGENT_DESCRIPTIONS=self.agent_descriptions).render(all_variables)
 
     def get_agent_by_id(self, agent_id: str) -> Optional[Agent]:
         if not agent_id:
@@ -0,0 +1,196 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from agents import Agent
+from orchestrator_types import ConversationMessage, RequestContext
+from text_similarity import CharNgramIndex
+from classifiers import Classifier, ClassifierResult, PlanStep, RoutingCache
+
+SINGLE_HOP_ACTIONS = ("respond_to_user", "unknown")
+
+class FastPathClassifierOptions:
+    def __init__(self,
+                 classifier: Classifier,
+                 confidence_threshold: float = 0.8,
+                 min_margin: float = 0.1,
+                 max_examples: int = 5000,
+                 examples: Optional[List[Dict[str, str]]] = None,
+                 single_hop_threshold: float = 0.5,
+                 min_standalone_words: int = 8):
+        """
+        Args:
+            classifier: The LLM classifier used whenever the fast path is not confident.
+            confidence_threshold: Minimum similarity of the best match to route locally.
+            min_margin: Minimum lead of the best match over the best match with another label.
+            max_examples: Number of learned routings kept, oldest dropped first.
+            examples: Hand labelled routings as {'input': ..., 'agent_id': ...} dicts.
+            single_hop_threshold: Minimum similarity of the best match to predict, from its
+                label, whether a request needs one agent (used by the fused mode).
+            min_standalone_words: Minimum number of words of an input, in a session with
+                history, to route it locally; shorter follow-ups ("yes", "why?") need the
+                history to be routed and always go to the wrapped classifier.
+        """
+        self.classifier = classifier
+        self.confidence_threshold = confidence_threshold
+        self.min_margin = min_margin
+        self.max_examples = max_examples
+        self.examples = examples or []
+        self.single_hop_threshold = single_hop_threshold
+        self.min_standalone_words = min_standalone_words
+
+class FastPathClassifier(Classifier):
+    """
+    Classifier that routes trivially routable requests locally and defers everything
+    else to a wrapped LLM classifier.
+
+    The input is scored with a character n-gram TF-IDF index built from the agent
+    descriptions, the hand labelled examples and the routings the wrapped classifier
+    returned before. Only the first hop of a request is routed locally, and only to a
+    label that answered a similar request in one hop: requests the LLM split into
+    several sub-tasks are learned as well, so that similar ones keep going to the LLM.
+
+    The index knows nothing of the conversation: in a session with history, only inputs
+    long enough to stand on their own are routed locally, and routings are only learned
+    from requests that had no history.
+    """
+    def __init__(self, options: FastPathClassifierOptions):
+        super().__init__()
+        self.classifier = options.classifier
+        self.confidence_threshold = options.confidence_threshold
+        self.min_margin = options.min_margin
+        self.max_examples = options.max_examples
+        self.single_hop_threshold = options.single_hop_threshold
+        self.min_standalone_words = options.min_standalone_words
+        self.index = CharNgramIndex()
+        self.learned_keys: "OrderedDict[str, None]" = OrderedDict()
+
+        for example in options.examples:
+            self.index.add(f"example:{self.index.normalize(example['input'])}",
+                           example['input'],
+                           {'agent_id': example['agent_id']})
+
+        self.fast_path_hits = 0
+        self.fast_path_misses = 0
+        self.fast_path_seconds = 0.0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+    def set_agents(self, agents: Dict[str, Agent]) -> None:
+        super().set_agents(agents)
+        self.classifier.set_agents(agents)
+        for key in [key for key in self.index.entries if key.startswith("description:")]:
+            self.index.remove(key)
+        for agent in agents.values():
+            self.index.add(f"description:{agent.id}", agent.description, {'agent_id': agent.id})
+
+    def set_routing_cache(self, routing_cache: Optional[RoutingCache]) -> None:
+        # Cached decisions sit in front of the LLM call, behind the fast path
+        self.classifier.set_routing_cache(routing_cache)
+
+    async def classify(self,
+                       input_text: str,
+                       chat_history: List[ConversationMessage],
+                       context: RequestContext,
+                       fused: bool = False) -> ClassifierResult:
+        first_hop = not context.subtask_input
+        if first_hop and self.stands_alone(input_text, chat_history):
+            start = time.perf_counter()
+            fast_result = self.fast_path(input_text)
+            self.fast_path_seconds += time.perf_counter() - start
+            if fast_result:
+                self.fast_path_hits += 1
+                logger.info(f"Fast path routed to {fast_result.agent_selected.id} with score {fast_result.accuracy:.2f}")
+                return fast_result
+            self.fast_path_misses += 1
+
+        start = time.perf_counter()
+        result = await self.classifier.classify(input_text, chat_history, context, fused=fused)
+        self.llm_calls += 1
+        self.llm_seconds += time.perf_counter() - start
+
+        if first_hop and not chat_history:
+            self.learn(input_text, result)
+        return result
+
+    def stands_alone(self, input_text: str, chat_history: List[ConversationMessage]) -> bool:
+        """Whether the input can be routed without the conversation it continues."""
+        return not chat_history or len(input_text.split()) >= self.min_standalone_words
+
+    async def make_request(self,
+                           input_text: str,
+                           system_prompt: str,
+                           context: Optional[RequestContext] = None) -> ClassifierResult:
+        return await self.classifier.make_request(input_text, system_prompt, context)
+
+    async def make_fused_request(self,
+                                 input_text: str,
+                                 system_prompt: str,
+                                 context: Optional[RequestContext] = None) -> ClassifierResult:
+        return await self.classifier.make_fused_request(input_text, system_prompt, context)
+
+    def predict_single_hop(self, input_text: str) -> bool:
+        """
+        A close match among the routings seen before tells whether the request needs one
+        agent (single-hop routings keep their agent as label, multi-hop ones have none);
+        without one, the wrapped classifier guesses.
+        """
+        matches = self.index.query(input_text, limit=1)
+        if matches and matches[0][0] >= self.single_hop_threshold:
+            return matches[0][2]['agent_id'] is not None
+        return self.classifier.predict_single_hop(input_text)
+
+    async def plan(self,
+                   input_text: str,
+                   chat_history: List[ConversationMessage],
+                   context: RequestContext) -> List[PlanStep]:
+        return await self.classifier.plan(input_text, chat_history, context)
+
+    def fast_path(self, input_text: str) -> Optional[ClassifierResult]:
+        matches = self.index.query(input_text, limit=10)
+        if not matches:
+            return None
+        best_score, _, best_payload = matches[0]
+        runner_up = next((score for score, _, payload in matches[1:]
+                          if payload['agent_id'] != best_payload['agent_id']), 0.0)
+        if best_score < self.confidence_threshold or best_score - runner_up < self.min_margin:
+            return None
+
+        agent = self.get_agent_by_id(best_payload['agent_id'])
+        if agent is None:
+            return None
+        return ClassifierResult(
+            input=input_text,
+            agent_selected=agent,
+            accuracy=best_score,
+            action="route",
+            next_action="respond_to_user",
+            next_action_input="unknown"
+        )
+
+    def learn(self, input_text: str, result: ClassifierResult) -> None:
+        """Add a routing of the wrapped classifier as a labelled example."""
+        if result.agent_selected is None:
+            return
+        single_hop = result.next_action in SINGLE_HOP_ACTIONS
+        key = f"learned:{self.index.normalize(input_text)}"
+        self.index.add(key, input_text, {'agent_id': result.agent_selected.id if single_hop else None})
+        self.learned_keys[key] = None
+        self.learned_keys.move_to_end(key)
+        while len(self.learned_keys) > self.max_examples:
+            oldest, _ = self.learned_keys.popitem(last=False)
+            self.index.remove(oldest)
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.fast_path_hits + self.fast_path_misses
+        average_llm_seconds = self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+        average_fast_path_seconds = self.fast_path_seconds / lookups if lookups else 0.0
+        return {
+            'fast_path_hits': self.fast_path_hits,
+            'fast_path_misses': self.fast_path_misses,
+            'fast_path_hit_rate': self.fast_path_hits / lookups if lookups else 0.0,
+            'examples': len(self.index),
+            'average_llm_ms': average_llm_seconds * 1000,
+            'average_fast_path_ms': average_fast_path_seconds * 1000,
+            'latency_saved_seconds': self.fast_path_hits * max(average_llm_seconds - average_fast_path_seconds, 0.0)
+        }
@@ -1,8 +1,12 @@
+import copy
 import json
-from typing import Optional, Dict, Any
-from openai import OpenAI
+from typing import Optional, Dict, Any, List
+from openai import AsyncOpenAI
 from loguru import logger
-from classifiers import Classifier, ClassifierResult
+from classifiers import Classifier, ClassifierResult, PlanStep
+from clients import get_openai_client
+from orchestrator_types import BudgetExceededError, RequestContext
+from token_counting import TokenUsage
 
 OPENAI_MODEL_ID_GPT_O_MINI = "gpt-4o-mini"
 
@@ -10,10 +14,12 @@ class OpenAIClassifierOptions:
     def __init__(self,
                  api_key: str,
                  model: Optional[str] = None,
-                 classifier_config: Optional[Dict[str, Any]] = None):
+                 classifier_config: Optional[Dict[str, Any]] = None,
+                 client: Optional[AsyncOpenAI] = None):
         self.api_key = api_key
         self.model = model
         self.classifier_config = classifier_config or {}
+        self.client = client
 
 class OpenAIClassifier(Classifier):
     def __init__(self, options: OpenAIClassifierOptions):
@@ -22,7 +28,8 @@ class OpenAIClassifier(Classifier):
         if not options.api_key:
             raise ValueError("OpenAI API key is required")
 
-        self.client = OpenAI(api_key=options.api_key)
+        self.api_key = options.api_key
+        self.client = options.client
         self.model = options.model or OPENAI_MODEL_ID_GPT_O_MINI
 
         default_max_tokens = 1000
@@ -73,23 +80,106 @@ class OpenAIClassifier(Classifier):
             }
         ]
 
-    async def make_request(self,input_text: str) -> ClassifierResult:
+        # processPrompt that can also carry the selected agent's answer, in the agents' own output fields
+        fused_function = copy.deepcopy(self.tools[0]['function'])
+        fused_function['parameters']['properties'].update({
+            'output': {
+                'type': 'string',
+                'description': 'The detailed answer of the selected agent, only when you answer the input directly, else empty'
+            },
+            'short_output': {
+                'type': 'string',
+                'description': 'The specific answer the input demands without details and other contexts, only when you answer the input directly, else empty'
+            }
+        })
+        self.fused_tools = [{'type': 'function', 'function': fused_function}]
+
+        self.plan_tools = [
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'planSubtasks',
+                    'description': 'Divide the user input into sub-tasks, pick the apporpriate agent for every sub-task and declare which sub-tasks depend on the results of others',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'subtasks': {
+                                'type': 'array',
+                                'items': {
+                                    'type': 'object',
+                                    'properties': {
+                                        'id': {
+                                            'type': 'string',
+                                            'description': 'Short unique id of the sub-task'
+                                        },
+                                        'agent_selected': {
+                                            'type': 'string',
+                                            'description': 'The name of the agent selected to perform the sub-task'
+                                        },
+                                        'input': {
+                                            'type': 'string',
+                                            'description': 'The complete query of the sub-task from original_user_input'
+                                        },
+                                        'depends_on': {
+                                            'type': 'array',
+                                            'items': {'type': 'string'},
+                                            'description': 'Ids of the sub-tasks whose results this sub-task needs'
+                                        }
+                                    },
+                                    'required': ['id', 'agent_selected', 'input', 'depends_on']
+                                }
+                            }
+                        },
+                        'required': ['subtasks'],
+                    },
+                },
+            }
+        ]
+
+    def get_client(self) -> AsyncOpenAI:
+        return self.client or get_openai_client(self.api_key)
+
+    async def make_request(self,
+                           input_text: str,
+                           system_prompt: str,
+                           context: Optional[RequestContext] = None) -> ClassifierResult:
+        return await self.request_routing(input_text, system_prompt, self.tools, context)
+
+    async def make_fused_request(self,
+                                 input_text: str,
+                                 system_prompt: str,
+                                 context: Optional[RequestContext] = None) -> ClassifierResult:
+        return await self.request_routing(input_text, system_prompt, self.fused_tools, context)
+
+    async def request_routing(self,
+                              input_text: str,
+                              system_prompt: str,
+                              tools: List[Dict[str, Any]],
+                              context: Optional[RequestContext] = None) -> ClassifierResult:
         messages = [
-            {"role": "system", "content": self.system_prompt},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": input_text}
         ]
 
         try:
-            response = self.client.chat.completions.create(
+            max_tokens = self.budgeted_max_tokens(context, self.classifier_config['max_tokens'])
+            response = await self.get_client().chat.completions.create(
                 model=self.model,
                 messages=messages,
-                max_tokens=self.classifier_config['max_tokens'],
+                max_tokens=max_tokens,
                 temperature=self.classifier_config['temperature'],
                 top_p=self.classifier_config['top_p'],
-                tools=self.tools,
+                tools=tools,
                 tool_choice={"type": "function", "function": {"name": "processPrompt"}}
             )
 
+            try:
+                self.check_budget_cutoff(context, response.choices[0].finish_reason,
+                                         self.classifier_config['max_tokens'], max_tokens)
+            except BudgetExceededError:
+                # classify records the usage of the result, which a call cut off does not return
+                self.record_usage(context, TokenUsage.from_response(response.usage, response.model))
+                raise
             tool_response = response.choices[0].message.tool_calls[0]
 
             if not tool_response or tool_response.function.name != "processPrompt":
@@ -107,11 +197,57 @@ class OpenAIClassifier(Classifier):
                 accuracy=float(tool_input['accuracy']),
                 action=tool_input['action'],
                 next_action=tool_input['next_action'],
-                next_action_input=tool_input['next_action_input']
+                next_action_input=tool_input['next_action_input'],
+                usage=TokenUsage.from_response(response.usage, response.model),
+                output=(tool_input.get('output') or '').strip() or None,
+                short_output=(tool_input.get('short_output') or '').strip() or None
             )
 
             return intent_classifier_result
 
         except Exception as error:
             logger.error(f"Request processing error: {str(error)}")
-            raise error
\ No newline at end of file
+            raise error
+
+    async def make_plan_request(self,
+                                input_text: str,
+                                system_prompt: str,
+                                context: Optional[RequestContext] = None) -> List[PlanStep]:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": input_text}
+        ]
+
+        try:
+            max_tokens = self.budgeted_max_tokens(context, self.classifier_config['max_tokens'])
+            response = await self.get_client().chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=self.classifier_config['temperature'],
+                top_p=self.classifier_config['top_p'],
+                tools=self.plan_tools,
+                tool_choice={"type": "function", "function": {"name": "planSubtasks"}}
+            )
+
+            self.record_usage(context, TokenUsage.from_response(response.usage, response.model))
+            self.check_budget_cutoff(context, response.choices[0].finish_reason,
+                                     self.classifier_config['max_tokens'], max_tokens)
+            tool_response = response.choices[0].message.tool_calls[0]
+
+            if not tool_response or tool_response.function.name != "planSubtasks":
+                raise ValueError("Call to tool function planSubtasks is missing")
+
+            tool_input = json.loads(tool_response.function.arguments)
+            logger.info(tool_input)
+
+            return [PlanStep(
+                        id=str(subtask['id']),
+                        input=subtask['input'],
+                        agent_selected=self.get_agent_by_id(subtask['agent_selected']),
+                        depends_on=[str(step_id) for step_id in subtask.get('depends_on') or []]
+                    ) for subtask in tool_input['subtasks']]
+
+        except Exception as error:
+            logger.error(f"Plan request processing error: {str(error)}")
+            raise error
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from orchestrator_types import ConversationMessage, RequestContext
+
+
+class RoutingCacheBackend(ABC):
+    """Abstract base class for the storage behind a RoutingCache."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch a cached routing decision.
+        Returns:
+            Optional[Dict[str, Any]]: The entry, or None if it is missing or expired.
+        """
+
+    @abstractmethod
+    async def set(self, key: str, value: Dict[str, Any], ttl_seconds: Optional[float]) -> None:
+        """Store a routing decision for at most ttl_seconds."""
+
+    @abstractmethod
+    def size(self) -> int:
+        """Number of entries currently held."""
+
+
+class InMemoryRoutingCacheBackend(RoutingCacheBackend):
+    """Bounded LRU map whose entries also expire after their TTL."""
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, Tuple[Optional[float], Dict[str, Any]]]" = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self.entries.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_seconds: Optional[float]) -> None:
+        expires_at = time.monotonic() + ttl_seconds if ttl_seconds is not None else None
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def size(self) -> int:
+        return len(self.entries)
+
+
+class RoutingCache:
+    """
+    Cache of classifier routing decisions.
+
+    Entries are keyed on the normalized input, the original and sub-task inputs of the
+    request, a hash of the registered agent descriptions and a fingerprint of the most
+    recent history messages, so a decision is only reused when the classifier would
+    have seen the same prompt apart from older history.
+    """
+    def __init__(self,
+                 backend: Optional[RoutingCacheBackend] = None,
+                 max_size: int = 1024,
+                 ttl_seconds: Optional[float] = 600,
+                 history_window: int = 4):
+        self.backend = backend or InMemoryRoutingCacheBackend(max_size)
+        self.ttl_seconds = ttl_seconds
+        self.history_window = history_window
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", text or "").strip().lower()
+
+    def build_key(self,
+                  input_text: str,
+                  agent_descriptions: str,
+                  chat_history: List[ConversationMessage],
+                  context: RequestContext) -> str:
+        recent_history = chat_history[-self.history_window:] if self.history_window else []
+        history_fingerprint = [
+            (message.role,
+             getattr(message, 'agent_id', None),
+             self.normalize(message.content[0].get('text', '') if message.content else ''))
+            for message in recent_history
+        ]
+        key_material = json.dumps([
+            self.normalize(input_text),
+            self.normalize(context.original_user_input),
+            self.normalize(context.subtask_input),
+            hashlib.sha256(agent_descriptions.encode()).hexdigest(),
+            history_fingerprint
+        ])
+        return hashlib.sha256(key_material.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        await self.backend.set(key, value, self.ttl_seconds)
+
+    def metrics(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': self.backend.size()
+        }
@@ -0,0 +1,12 @@
+from .openai_client import get_shared_http_client, get_openai_client, close_shared_clients
+from .cassette import Cassette, CassetteTransport, get_cassette, request_key
+
+__all__ = [
+    'get_shared_http_client',
+    'get_openai_client',
+    'close_shared_clients',
+    'Cassette',
+    'CassetteTransport',
+    'get_cassette',
+    'request_key'
+]
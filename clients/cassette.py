@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from loguru import logger
+
+CASSETTE_MODES = ('record', 'replay')
+
+# Headers that describe the bytes on the wire rather than the (already decoded) content
+_TRANSFER_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+_cassettes: Dict[Tuple[str, str], "Cassette"] = {}
+_cassettes_lock = Lock()
+
+
+def request_key(request: httpx.Request) -> str:
+    """
+    Canonical hash of an LLM request: its method, path and JSON body with sorted keys.
+    Host, headers and API key are left out, so a cassette recorded with one key or
+    endpoint replays with any other.
+    """
+    body = request.content
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode('utf-8')
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f"{request.method} {request.url.path}\n".encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class Cassette:
+    """
+    LLM responses recorded to a JSON lines file, one response per line next to the key
+    of the request it answered.
+
+    In record mode the file is started afresh and every response is appended as soon as
+    it is read, so an interrupted run keeps what it recorded. In replay mode identical
+    requests get their recorded responses in the order they were recorded, the last one
+    repeating once they run out.
+    """
+    def __init__(self, path: str, mode: str = 'replay'):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Cassette mode must be one of {', '.join(CASSETTE_MODES)}, got {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.responses: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        self._lock = Lock()
+
+        if mode == 'record':
+            open(path, 'w', encoding='utf-8').close()
+        else:
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses.setdefault(entry['key'], []).append(entry)
+            logger.info(f"Replaying {sum(map(len, self.responses.values()))} LLM responses from {path}")
+
+    def record(self, key: str, request: httpx.Request, response: httpx.Response) -> None:
+        try:
+            model = json.loads(request.content).get('model')
+        except (ValueError, AttributeError):
+            model = None
+        entry = {
+            'key': key,
+            'path': request.url.path,
+            'model': model,
+            'status': response.status_code,
+            'content_type': response.headers.get('content-type'),
+            'body': response.text
+        }
+        with self._lock:
+            self.responses.setdefault(key, []).append(entry)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+
+    def replay(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entries = self.responses.get(key)
+            if not entries:
+                return None
+            index = self._served.get(key, 0)
+            self._served[key] = index + 1
+            return entries[min(index, len(entries) - 1)]
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that records the LLM responses passing through it to a cassette,
+    or serves them from one without touching the network.
+
+    A request missing from a replayed cassette gets a 404 error response, which the
+    OpenAI client raises without retrying. Responses are read whole before they are
+    recorded, so streamed answers arrive in one piece while recording.
+    """
+    def __init__(self, cassette: Cassette, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.cassette = cassette
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request)
+        if self.cassette.mode == 'replay':
+            entry = self.cassette.replay(key)
+            if entry is None:
+                logger.error(f"No recorded response for LLM request {key[:12]} in {self.cassette.path}")
+                return httpx.Response(404, request=request, json={
+                    'error': {'message': f"No recorded response for request {key} in {self.cassette.path}",
+                              'type': 'cassette_miss'}
+                })
+            headers = {'content-type': entry['content_type']} if entry.get('content_type') else None
+            return httpx.Response(entry['status'], headers=headers, content=entry['body'].encode('utf-8'), request=request)
+
+        response = await self.transport.handle_async_request(request)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        headers = [(name, value) for name, value in response.headers.multi_items() if name.lower() not in _TRANSFER_HEADERS]
+        recorded = httpx.Response(response.status_code, headers=headers, content=content, request=request)
+        self.cassette.record(key, request, recorded)
+        return recorded
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """
+    The cassette configured by LLM_CASSETTE (its path) and LLM_CASSETTE_MODE (record or
+    replay, replay by default), or None when LLM_CASSETTE is not set. One cassette is
+    kept per path and mode for the whole process, whichever event loop asks for it.
+    """
+    path = os.getenv('LLM_CASSETTE')
+    if not path:
+        return None
+    mode = os.getenv('LLM_CASSETTE_MODE', 'replay').lower()
+    key = (os.path.abspath(path), mode)
+    with _cassettes_lock:
+        cassette = _cassettes.get(key)
+        if cassette is None:
+            cassette = Cassette(path, mode)
+            _cassettes[key] = cassette
+        return cassette
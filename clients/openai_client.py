@@ -0,0 +1,70 @@
+import asyncio
+import os
+import weakref
+from typing import Dict, Optional, Tuple
+import httpx
+from openai import AsyncOpenAI
+from .cassette import CassetteTransport, get_cassette
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_TIMEOUT = 60.0
+
+# httpx connection pools are bound to the event loop that opened them, so one pool
+# (and one set of OpenAI clients on top of it) is kept per running loop.
+_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_openai_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, Optional[str]], AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+
+
+def get_shared_http_client() -> httpx.AsyncClient:
+    """
+    Return the pooled keep-alive HTTP client shared by the classifier and all agents.
+    Must be called from inside a running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    http_client = _http_clients.get(loop)
+    if http_client is None or http_client.is_closed:
+        max_connections = int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS))
+        # Every connection is kept alive by default: with fewer, a burst of concurrent calls
+        # closes most of its connections after one use and the next burst opens them again
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=int(os.getenv('LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS', max_connections)),
+            keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY
+        )
+        # With a cassette configured, LLM calls are recorded to it or replayed from it
+        cassette = get_cassette()
+        transport = CassetteTransport(cassette, httpx.AsyncHTTPTransport(limits=limits)) if cassette else None
+        http_client = httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(float(os.getenv('LLM_HTTP_TIMEOUT', DEFAULT_TIMEOUT))),
+            transport=transport
+        )
+        _http_clients[loop] = http_client
+        _openai_clients.pop(loop, None)
+    return http_client
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """
+    Return an AsyncOpenAI client for the given API key that sends its requests
+    through the shared HTTP connection pool. Clients are cached per key.
+    """
+    http_client = get_shared_http_client()
+    loop = asyncio.get_running_loop()
+    clients = _openai_clients.setdefault(loop, {})
+    key = (api_key, base_url)
+    client = clients.get(key)
+    if client is None:
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+        clients[key] = client
+    return client
+
+
+async def close_shared_clients() -> None:
+    """Close the shared HTTP client of the running event loop, if any."""
+    loop = asyncio.get_running_loop()
+    _openai_clients.pop(loop, None)
+    http_client = _http_clients.pop(loop, None)
+    if http_client is not None:
+        await http_client.aclose()
@@ -0,0 +1,88 @@
+"""
+Evaluation of the orchestrator on GSM8K and HotPotQA.
+
+Runs the first --gsm8k GSM8K and --hotpotqa HotPotQA dev questions, and --combined
+requests that ask one of each, through the orchestrator --concurrency at a time. Writes
+one JSON line per item to --results and prints a summary of accuracy, tokens, cost and
+latency. Running it again with the same --results resumes an interrupted run.
+
+    python evaluate.py --gsm8k 200 --hotpotqa 100 --combined 50 --concurrency 8 --results eval_results.jsonl
+"""
+import argparse
+import json
+import os
+from typing import List
+from loguru import logger
+from dotenv import load_dotenv
+from evaluation import EvalItem, EvaluationRunner, summarize, format_summary
+from metrics import LatencyMetrics
+from orchestrator_types import ExpectedResult
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+def build_items(gsm8k: int, hotpotqa: int, combined: int) -> List[EvalItem]:
+    # Imported here so --summary does not need the datasets
+    from dspy.datasets import HotPotQA
+    from dspy.datasets.gsm8k import GSM8K
+
+    gsm_set = GSM8K().dev if gsm8k or combined else []
+    hotpot_set = HotPotQA(dev_size=max(hotpotqa, combined), test_size=0).dev if hotpotqa or combined else []
+
+    items = []
+    for index, example in enumerate(gsm_set[:gsm8k]):
+        items.append(EvalItem(
+            item_id=f"gsm8k-{index}",
+            dataset="gsm8k",
+            user_input="Evaluate " + example['question'],
+            expected=ExpectedResult(NUMBER_OF_AGENT_CALL=1, AGENTS=['Reasoning Agent'], RESULTS=[example['answer']])
+        ))
+    for index, example in enumerate(hotpot_set[:hotpotqa]):
+        items.append(EvalItem(
+            item_id=f"hotpotqa-{index}",
+            dataset="hotpotqa",
+            user_input=example['question'],
+            expected=ExpectedResult(NUMBER_OF_AGENT_CALL=1, AGENTS=['Data Retrieval Agent'], RESULTS=[example['answer']])
+        ))
+    for index, (qa_example, gsm_example) in enumerate(zip(hotpot_set[:combined], gsm_set[:combined])):
+        items.append(EvalItem(
+            item_id=f"combined-{index}",
+            dataset="combined",
+            user_input="Find " + qa_example['question'] + " And The last task is to Evaluate " + gsm_example['question'],
+            expected=ExpectedResult(NUMBER_OF_AGENT_CALL=2,
+                                    AGENTS=['Data Retrieval Agent', 'Reasoning Agent'],
+                                    RESULTS=[qa_example['answer'], gsm_example['answer']])
+        ))
+    return items
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--gsm8k', type=int, default=50, help="GSM8K dev questions to run")
+    parser.add_argument('--hotpotqa', type=int, default=50, help="HotPotQA dev questions to run")
+    parser.add_argument('--combined', type=int, default=0, help="Requests that ask a HotPotQA and a GSM8K question")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--results', default="eval_results.jsonl")
+    parser.add_argument('--summary', action='store_true', help="Only summarize the results file")
+    args = parser.parse_args()
+
+    if args.summary:
+        runner = EvaluationRunner(None, args.results)
+        results = list(runner.load_results().values())
+    else:
+        from main import MainClass
+
+        mainClass = MainClass(metrics=LatencyMetrics())
+        runner = EvaluationRunner(mainClass.agent_orchestrator, args.results, concurrency=args.concurrency)
+        items = build_items(args.gsm8k, args.hotpotqa, args.combined)
+        try:
+            results = mainClass.loop.run_until_complete(runner.run(items))
+        except KeyboardInterrupt:
+            logger.info(f"Interrupted, run again with --results {args.results} to resume")
+            raise
+
+    summary = summarize(results)
+    print(format_summary(summary))
+    with open(os.path.splitext(args.results)[0] + ".summary.json", 'w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=2)
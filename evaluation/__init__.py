@@ -0,0 +1,12 @@
+from .runner import EvalItem, EvalResult, EvaluationRunner, score
+from .report import summarize, format_summary, percentiles
+
+__all__ = [
+    'EvalItem',
+    'EvalResult',
+    'EvaluationRunner',
+    'score',
+    'summarize',
+    'format_summary',
+    'percentiles'
+]
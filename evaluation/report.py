@@ -0,0 +1,75 @@
+import statistics
+from typing import Any, Dict, List, Optional
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    """p50, p95 and p99 of the values, None if there are none."""
+    if not values:
+        return None
+    if len(values) == 1:
+        return {'p50': values[0], 'p95': values[0], 'p99': values[0]}
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': round(cuts[49], 6), 'p95': round(cuts[94], 6), 'p99': round(cuts[98], 6)}
+
+def stage_name(key: str) -> str:
+    """Stage of an execution_times key, without its agent and hop: handle_request:reasoning-agent#1 -> handle_request."""
+    return key.split('#', 1)[0].split(':', 1)[0]
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Accuracy, token, cost and latency totals of evaluation results, overall and by dataset."""
+    answered = [result for result in results if not result.get('error')]
+    costs = [result['cost_usd'] for result in answered if result.get('cost_usd') is not None]
+
+    stage_totals: Dict[str, List[float]] = {}
+    for result in answered:
+        per_item: Dict[str, float] = {}
+        for key, seconds in result.get('stage_seconds', {}).items():
+            per_item[stage_name(key)] = per_item.get(stage_name(key), 0.0) + seconds
+        for stage, seconds in per_item.items():
+            stage_totals.setdefault(stage, []).append(seconds)
+
+    by_dataset: Dict[str, Dict[str, Any]] = {}
+    for dataset in sorted({result.get('dataset', '') for result in results}):
+        items = [result for result in answered if result.get('dataset', '') == dataset]
+        by_dataset[dataset] = {
+            'items': sum(1 for result in results if result.get('dataset', '') == dataset),
+            'accuracy': round(sum(result['correct'] for result in items) / len(items), 4) if items else None
+        }
+
+    return {
+        'items': len(results),
+        'errors': len(results) - len(answered),
+        'accuracy': round(sum(result['correct'] for result in answered) / len(answered), 4) if answered else None,
+        'agent_accuracy': round(sum(result['agents_correct'] for result in answered) / len(answered), 4) if answered else None,
+        'answer_accuracy': round(sum(result['answers_correct'] for result in answered) / len(answered), 4) if answered else None,
+        'budget_exceeded': sum(1 for result in answered if result.get('budget_exceeded')),
+        'mean_hops': round(statistics.fmean(result['hops'] for result in answered), 3) if answered else None,
+        'prompt_tokens': sum(result['prompt_tokens'] for result in answered),
+        'completion_tokens': sum(result['completion_tokens'] for result in answered),
+        'cost_usd': round(sum(costs), 6) if costs else None,
+        'cost_usd_per_item': round(sum(costs) / len(costs), 8) if costs else None,
+        'latency_seconds': percentiles([result['latency_seconds'] for result in answered]),
+        'stage_seconds': {stage: percentiles(values) for stage, values in sorted(stage_totals.items())},
+        'by_dataset': by_dataset
+    }
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    def rate(value: Optional[float]) -> str:
+        return "n/a" if value is None else f"{value:.1%}"
+
+    def spread(values: Optional[Dict[str, float]]) -> str:
+        return "n/a" if values is None else f"{values['p50']:.3f} / {values['p95']:.3f} / {values['p99']:.3f} s"
+
+    lines = [
+        f"Items: {summary['items']} ({summary['errors']} failed, {summary['budget_exceeded']} over budget)",
+        f"Accuracy: {rate(summary['accuracy'])} (agents {rate(summary['agent_accuracy'])}, answers {rate(summary['answer_accuracy'])})",
+        f"Mean hops: {summary['mean_hops']}",
+        f"Tokens: {summary['prompt_tokens']} prompt, {summary['completion_tokens']} completion",
+        "Estimated cost: " + ("n/a" if summary['cost_usd'] is None else
+                               f"${summary['cost_usd']:.6f} (${summary['cost_usd_per_item']:.6f} per item)"),
+        f"Latency p50/p95/p99: {spread(summary['latency_seconds'])}"
+    ]
+    for stage, values in summary['stage_seconds'].items():
+        lines.append(f"  {stage} p50/p95/p99: {spread(values)}")
+    for dataset, totals in summary['by_dataset'].items():
+        lines.append(f"{dataset or 'unnamed'}: {totals['items']} items, accuracy {rate(totals['accuracy'])}")
+    return "\n".join(lines)
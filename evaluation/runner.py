@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional, Set
+from loguru import logger
+from orchestrator_types import ExpectedResult, FinalResponse
+
+@dataclass
+class EvalItem:
+    """One dataset question, with the agents and answers it should get."""
+    item_id: str
+    user_input: str
+    expected: ExpectedResult
+    dataset: str = ""
+
+@dataclass
+class EvalResult:
+    """How one item was answered: one line of the results file."""
+    item_id: str
+    dataset: str
+    session_id: str
+    user_input: str
+    expected_agents: List[str]
+    expected_results: List[str]
+    agents_called: List[str] = field(default_factory=list)
+    hops: int = 0
+    outputs: List[str] = field(default_factory=list)
+    agents_correct: bool = False
+    answers_correct: bool = False
+    correct: bool = False
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: Optional[float] = None
+    budget_exceeded: Optional[str] = None
+    latency_seconds: float = 0.0
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+def score(result: EvalResult, responses: List[FinalResponse]) -> None:
+    """
+    Fill a result in from the orchestrator's responses. Agents are correct when the
+    expected ones were called in order, answers when every expected answer appears in
+    some output, the same keyword match MainClass.evaluationMetric reports.
+    """
+    answered = [response for response in responses if response.BUDGET_EXCEEDED is None]
+    result.agents_called = [response.AGENT_SELECTED for response in answered]
+    result.hops = len(answered)
+    result.outputs = [response.AGENT_OUTPUT for response in answered]
+    result.budget_exceeded = next((response.BUDGET_EXCEEDED for response in responses if response.BUDGET_EXCEEDED), None)
+    result.prompt_tokens = sum(response.PROMPT_TOKENS for response in responses)
+    result.completion_tokens = sum(response.COMPLETION_TOKENS for response in responses)
+    costs = [response.COST_USD for response in responses if response.COST_USD is not None]
+    result.cost_usd = round(sum(costs), 8) if costs else None
+
+    result.agents_correct = result.agents_called == result.expected_agents
+    outputs = [output.lower() for output in result.outputs]
+    result.answers_correct = all(any(expected.lower() in output for output in outputs) for expected in result.expected_results)
+    result.correct = result.agents_correct and result.answers_correct
+
+class EvaluationRunner:
+    """
+    Runs dataset items through the orchestrator, at most `concurrency` at a time, each
+    in a session of its own, and appends one JSON line per item to results_path as
+    soon as it is answered.
+
+    The results file doubles as the checkpoint: items already in it are skipped, so an
+    interrupted run picks up where it stopped. Items that failed with an error are run
+    again, and the last line of an item wins.
+    """
+    def __init__(self,
+                 orchestrator: Any,
+                 results_path: str,
+                 concurrency: int = 8,
+                 user_id: str = "eval-user"):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.orchestrator = orchestrator
+        self.results_path = results_path
+        self.concurrency = concurrency
+        self.user_id = user_id
+
+    def load_results(self) -> Dict[str, Dict[str, Any]]:
+        """Results already in the results file, by item id."""
+        results: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(self.results_path):
+            return results
+        with open(self.results_path, encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # A line cut short when a run was killed mid-write
+                    logger.warning(f"Skipping unreadable line in {self.results_path}")
+                    continue
+                results[result['item_id']] = result
+        return results
+
+    def completed(self) -> Set[str]:
+        return {item_id for item_id, result in self.load_results().items() if not result.get('error')}
+
+    async def run(self, items: List[EvalItem]) -> List[Dict[str, Any]]:
+        """Run the items not answered yet, then return the results of all items."""
+        done = self.completed()
+        pending = [item for item in items if item.item_id not in done]
+        logger.info(f"Evaluating {len(pending)} items, {len(items) - len(pending)} already in {self.results_path}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with open(self.results_path, 'a', encoding='utf-8') as file:
+            async def run_item(item: EvalItem) -> None:
+                async with semaphore:
+                    result = await self.evaluate(item)
+                file.write(json.dumps(asdict(result), ensure_ascii=False) + "\n")
+                file.flush()
+
+            await asyncio.gather(*[run_item(item) for item in pending])
+
+        results = self.load_results()
+        return [results[item.item_id] for item in items if item.item_id in results]
+
+    async def evaluate(self, item: EvalItem) -> EvalResult:
+        session_id = f"eval-{item.item_id}"
+        result = EvalResult(item_id=item.item_id,
+                            dataset=item.dataset,
+                            session_id=session_id,
+                            user_input=item.user_input,
+                            expected_agents=list(item.expected.AGENTS),
+                            expected_results=[str(answer) for answer in item.expected.RESULTS])
+        execution_times: Dict[str, float] = {}
+        start = time.perf_counter()
+        try:
+            responses = await self.orchestrator.route_request(item.user_input,
+                                                              self.user_id,
+                                                              session_id,
+                                                              item.item_id,
+                                                              execution_times=execution_times)
+            if isinstance(responses, list):
+                score(result, responses)
+            else:
+                # The orchestrator answers with a single AgentResponse when it could not route the request
+                result.error = str(responses.output if isinstance(responses.output, str) else responses.output.content[0]['text'])
+        except Exception as error:
+            logger.error(f"Error evaluating {item.item_id}: {str(error)}")
+            result.error = str(error) or type(error).__name__
+        result.latency_seconds = round(time.perf_counter() - start, 6)
+        result.stage_seconds = {stage: round(seconds, 6) for stage, seconds in execution_times.items()}
+        return result
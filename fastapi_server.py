@@ -1,36 +1,44 @@
-from agents import TextClassifierAgent, TextClassifierAgentOptions, ReasoningAgent, ReasoningAgentOptions, DataRetrievalAgent, DataRetrievalAgentOptions, AgentCallbacks, AgentResponse
+from agents import TextClassifierAgent, TextClassifierAgentOptions, ReasoningAgent, ReasoningAgentOptions, DataRetrievalAgent, DataRetrievalAgentOptions, AgentCallbacks, AgentResponse, ResponseCache
 from orchestrator import Orchestrator
-from orchestrator_types import ConversationMessage
-from chat_storage import MemoryStorage
-from classifiers import OpenAIClassifier, OpenAIClassifierOptions
+from orchestrator_types import ConversationMessage, OrchestratorConfig
+from chat_storage import MemoryStorage, SqliteStorage, RedisStorage, CompactingStorage, OpenAISummarizer
+from classifiers import OpenAIClassifier, OpenAIClassifierOptions, FastPathClassifier, FastPathClassifierOptions, RoutingCache
+from sessions import SessionRegistry
+from metrics import LatencyMetrics, UsageLedger, PROMETHEUS_CONTENT_TYPE
 import asyncio
 from typing import Dict, List, Any
 from pydantic import BaseModel
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from guardrails.hub import DetectPII, DetectJailbreak, ProfanityFree
-from guardrails import Guard
-
-from threading import Thread
+from fastapi.responses import StreamingResponse, Response
+from guards import GuardPool, GuardViolationError, StreamingGuard
+from guards.factories import build_input_guard, build_output_guard
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 import os
+import json
 import random
+import time
 
 # Load environment variables from .env file
 load_dotenv()
 
-input_guard = Guard().use_many(
-    DetectJailbreak(on_fail="exception"),
-    DetectPII(["EMAIL_ADDRESS", "PHONE_NUMBER"], on_fail="exception")
+# Guards run in their own worker processes (GUARD_WORKER_TYPE=thread for threads), each loading the models once
+guard_pool = GuardPool(
+    {'input': build_input_guard, 'output': build_output_guard},
+    workers=int(os.getenv('GUARD_WORKERS', 2)),
+    use_processes=os.getenv('GUARD_WORKER_TYPE', 'process').lower() != 'thread'
 )
 
-output_guard = Guard().use_many(
-    ProfanityFree(on_fail="exception"),
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the guard models in every worker before the first request arrives
+    await asyncio.to_thread(guard_pool.start)
+    yield
+    guard_pool.shutdown()
 
-app = FastAPI(swagger_ui_parameters={"syntaxHighlight": False})
+app = FastAPI(swagger_ui_parameters={"syntaxHighlight": False}, lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -44,8 +52,18 @@ class RequestBody(BaseModel):
     user_id: str
     session_id: str
 
+STREAM_QUEUE_MAX_SIZE = int(os.getenv('STREAM_QUEUE_MAX_SIZE', 256))
+# Shortest window of streamed text the output guard validates at once; windows end at a sentence end
+OUTPUT_GUARD_MIN_WINDOW_CHARS = int(os.getenv('OUTPUT_GUARD_MIN_WINDOW_CHARS', 40))
+
+# Stage latencies served at /metrics; with METRICS_ENABLED=false the spans do nothing
+latency_metrics = LatencyMetrics(enabled=os.getenv('METRICS_ENABLED', 'true').lower() != 'false')
+# USD per million prompt and completion tokens by model, e.g. {"gpt-4o-mini": [0.15, 0.6]}; unset uses the built-in list
+model_prices = {model: tuple(price) for model, price in json.loads(os.getenv('MODEL_PRICES') or '{}').items()} or None
+usage_ledger = UsageLedger(prices=model_prices)
+
 class StreamHandler(AgentCallbacks):
-    def __init__(self, queue) -> None:
+    def __init__(self, queue: asyncio.Queue) -> None:
         super().__init__()
         self._queue = queue
         self._stop_signal = None
@@ -53,6 +71,10 @@ class StreamHandler(AgentCallbacks):
     def on_llm_new_token(self, token: str, **kwargs) -> None:
         self._queue.put_nowait(token)
 
+    async def on_llm_new_token_async(self, token: str, **kwargs) -> None:
+        # Waits while the queue is full, so a slow client slows generation down
+        await self._queue.put(token)
+
     def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
         print("generation started")
 
@@ -64,9 +86,37 @@ class StreamHandler(AgentCallbacks):
 
 class OrchestratorManager():
 
+    @staticmethod
+    def create_storage():
+        # SQLite keeps history across restarts and shares it between uvicorn workers,
+        # Redis shares it between nodes
+        chat_storage = os.getenv('CHAT_STORAGE', 'memory')
+        if chat_storage == 'sqlite':
+            storage = SqliteStorage(db_path=os.getenv('SQLITE_PATH', 'chat_history.db'),
+                                    pool_size=int(os.getenv('SQLITE_POOL_SIZE', 4)))
+        elif chat_storage == 'redis':
+            redis_ttl_seconds = os.getenv('REDIS_TTL_SECONDS')
+            storage = RedisStorage(url=os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+                                   max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 64)),
+                                   ttl_seconds=int(redis_ttl_seconds) if redis_ttl_seconds else None)
+        else:
+            storage = MemoryStorage()
+
+        # Older turns of long histories are folded into a rolling summary in the background
+        compaction_threshold_tokens = os.getenv('CHAT_COMPACTION_THRESHOLD_TOKENS')
+        if compaction_threshold_tokens:
+            storage = CompactingStorage(
+                storage,
+                OpenAISummarizer(api_key=os.getenv('SUMMARIZER_API_KEY'), model=os.getenv('SUMMARIZER_MODEL')),
+                threshold_tokens=int(compaction_threshold_tokens),
+                keep_recent_tokens=int(os.getenv('CHAT_COMPACTION_KEEP_RECENT_TOKENS', 1000)),
+                usage_ledger=usage_ledger
+            )
+        return storage
+
     def __init__(self) -> None:
-        self.stream_queue = asyncio.Queue()
         self.agent_orchestrator: Orchestrator = None
+        self.classifier: FastPathClassifier = None
         self.setup_orchestrator()
 
     def setup_orchestrator(self):
@@ -77,8 +127,20 @@ class OrchestratorManager():
                 api_key=os.getenv('CLASSIFIER_API_KEY')
             )
         )
+        open_ai_classifier.set_routing_cache(RoutingCache(
+            max_size=int(os.getenv('ROUTING_CACHE_MAX_SIZE', 1024)),
+            ttl_seconds=float(os.getenv('ROUTING_CACHE_TTL_SECONDS', 600))
+        ))
 
-        my_handler = StreamHandler(self.stream_queue)
+        # Route trivially routable requests locally and fall back to the LLM classifier
+        self.classifier = FastPathClassifier(FastPathClassifierOptions(
+            classifier=open_ai_classifier,
+            confidence_threshold=float(os.getenv('FAST_PATH_CONFIDENCE_THRESHOLD', 0.8)),
+            examples=[
+                {'input': "Classify below sentence into one of the labels", 'agent_id': "text-classification-agent"},
+                {'input': "Evaluate the reasoning of the following answer", 'agent_id': "reasoning-agent"}
+            ]
+        ))
 
         # Create Text Classification Agent
         text_classification_agent = TextClassifierAgent(TextClassifierAgentOptions(
@@ -93,8 +155,7 @@ class OrchestratorManager():
                 },
                 model=os.getenv('TEXT_CLASSIFIER_MODEL'),
                 api_key=os.getenv('TEXT_CLASSIFIER_API_KEY'),
-                streaming=True,
-                callbacks=my_handler
+                streaming=True
             )
         )
 
@@ -112,7 +173,11 @@ class OrchestratorManager():
                 model=os.getenv('REASONING_MODEL'),
                 api_key=os.getenv('REASONING_API_KEY'),
                 streaming=True,
-                callbacks=my_handler
+                response_cache=ResponseCache(
+                    max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1000)),
+                    ttl_seconds=float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 3600)),
+                    similarity_threshold=float(os.getenv('RESPONSE_CACHE_SIMILARITY_THRESHOLD', 0.95))
+                ) if os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true' else None
             )
         )
 
@@ -130,76 +195,155 @@ class OrchestratorManager():
                 model=os.getenv('DATA_RETRIEVER_MODEL'),
                 api_key=os.getenv('DATA_RETRIEVER_API_KEY'),
                 streaming=True,
-                use_google_tool=True,
-                callbacks=my_handler
+                use_google_tool=True
             )
         )
 
         # Create AgentOrchestrator
-        self.agent_orchestrator = Orchestrator(storage=MemoryStorage(),classifier=open_ai_classifier)
+        # Unset budgets send the whole stored history with every request
+        agent_history_token_budget = os.getenv('AGENT_HISTORY_TOKEN_BUDGET')
+        classifier_history_token_budget = os.getenv('CLASSIFIER_HISTORY_TOKEN_BUDGET')
+        # Per-request limits; an empty value disables the limit
+        max_hops_per_request = os.getenv('MAX_HOPS_PER_REQUEST', '10')
+        max_tokens_per_request = os.getenv('MAX_TOKENS_PER_REQUEST')
+        request_timeout_seconds = os.getenv('REQUEST_TIMEOUT_SECONDS')
+        self.agent_orchestrator = Orchestrator(
+            options=OrchestratorConfig(
+                AGENT_HISTORY_TOKEN_BUDGET=int(agent_history_token_budget) if agent_history_token_budget else None,
+                CLASSIFIER_HISTORY_TOKEN_BUDGET=int(classifier_history_token_budget) if classifier_history_token_budget else None,
+                MAX_HOPS_PER_REQUEST=int(max_hops_per_request) if max_hops_per_request else None,
+                MAX_TOKENS_PER_REQUEST=int(max_tokens_per_request) if max_tokens_per_request else None,
+                REQUEST_TIMEOUT_SECONDS=float(request_timeout_seconds) if request_timeout_seconds else None,
+                MODEL_PRICES=model_prices,
+                FUSED_SINGLE_HOP=os.getenv('FUSED_SINGLE_HOP', 'false').lower() == 'true'
+            ),
+            storage=self.create_storage(),classifier=self.classifier,metrics=latency_metrics,usage_ledger=usage_ledger)
         self.agent_orchestrator.add_agent(text_classification_agent)
         self.agent_orchestrator.add_agent(reasoning_agent)
         self.agent_orchestrator.add_agent(data_retrieval_agent)
 
 
-active_connections: Dict[str, OrchestratorManager] = {}
+# One orchestrator (classifier, agents, API clients and storage) serves every user;
+# the registry bounds how many sessions this process keeps in memory. Durable storages
+# (SQLite, Redis) are shared with other workers, so their history is not deleted on eviction.
+orchestrator_manager = OrchestratorManager()
+session_registry = SessionRegistry(
+    max_sessions=int(os.getenv('SESSION_MAX_COUNT', 10000)),
+    ttl_seconds=float(os.getenv('SESSION_TTL_SECONDS', 3600)),
+    max_memory_bytes=int(float(os.getenv('SESSION_MAX_MEMORY_MB', 256)) * 1024 * 1024)
+)
+
+async def evict_sessions(sessions, storage):
+    for user_id, session_id in sessions:
+        await storage.evict_session(user_id, session_id)
+
+async def update_session_size(user_id, session_id, storage):
+    # The storage tracks the size as messages are saved, so the history is not read back
+    size_bytes = storage.session_size(user_id, session_id)
+    await evict_sessions(session_registry.update_size(user_id, session_id, size_bytes), storage)
 
-async def begin_generation(query, user_id, session_id, stream_queue, request_id, agent_orchestrator):
+def guard_error_message(error: Exception) -> str:
+    message = str(error).lower()
+    if 'jailbreak' in message:
+        return "Unable to process request: Jailbreak Detected"
+    if 'pii' in message or 'profanity' in message:
+        return "Unable to process request: Personally Identifiable Information Detected"
+    return "Something went wrong"
+
+async def check_input(query):
+    with latency_metrics.span("input_guard"):
+        await guard_pool.validate('input', query)
+
+async def check_output(text):
+    with latency_metrics.span("output_guard"):
+        await guard_pool.validate('output', text)
+
+async def begin_generation(query, user_id, session_id, stream_queue, request_id):
     try:
-        orchestrator = agent_orchestrator.agent_orchestrator
-        response = await orchestrator.route_request(query, user_id, session_id, request_id)
+        orchestrator = orchestrator_manager.agent_orchestrator
+        await evict_sessions(session_registry.touch(user_id, session_id), orchestrator.storage)
+        # The input guard runs alongside the first classifier call; no agent is called before it passes
+        response = await orchestrator.route_request(query, user_id, session_id, request_id,
+                                                    callbacks=StreamHandler(stream_queue),
+                                                    admission=check_input(query))
+        # Everything put on the queue is validated by the output guard in chat_generator
         if isinstance(response, AgentResponse) and response.streaming is False:
             if isinstance(response.output, str):
-                output_guard.validate(response.output)
-                stream_queue.put_nowait(response.output)
+                await stream_queue.put(response.output)
             elif isinstance(response.output, ConversationMessage):
-                output_guard.validate(response.output.content[0].get('text'))
-                stream_queue.put_nowait(response.output.content[0].get('text'))
+                await stream_queue.put(response.output.content[0].get('text'))
+        await update_session_size(user_id, session_id, orchestrator.storage)
+    except asyncio.CancelledError:
+        # chat_generator stopped reading, so no end marker: on a full queue it would wait forever
+        raise
     except Exception as e:
         print(f"Error in begin_generation: {e}")
-        response = "Something went wrong"
-        error = str(e).lower()
-        if 'profanity' in error:
-            response = "Unable to process request: Personally Identifiable Information Detected"
-        stream_queue.put_nowait(str(response))
+        await stream_queue.put(guard_error_message(e))
+    await stream_queue.put(None)
+
+async def chat_generator(query, user_id, session_id, request_id, started):
+    # Every request gets its own bounded queue and its generation runs as a task on the server's loop
+    stream_queue = asyncio.Queue(maxsize=STREAM_QUEUE_MAX_SIZE)
+    generation = asyncio.create_task(begin_generation(query, user_id, session_id, stream_queue, request_id))
+    # Streamed text is sent on sentence by sentence, once the output guard has passed it
+    output_guard = StreamingGuard(check_output, min_window_chars=OUTPUT_GUARD_MIN_WINDOW_CHARS)
+    first_token = True
+    try:
+        while True:
+            value = await stream_queue.get()
+            windows = await (output_guard.flush() if value is None else output_guard.push(value))
+            for window in windows:
+                if first_token:
+                    # From the request's arrival, input guard included, to its first validated chunk
+                    latency_metrics.observe("time_to_first_token", time.perf_counter() - started)
+                    first_token = False
+                yield window
+            if value is None:
+                break
+    except GuardViolationError as e:
+        # Abort the stream: the unvalidated rest is never sent and generation is cancelled below
+        print(f"Output guard failed in chat_generator: {str(e)}")
+        yield guard_error_message(e)
+    except Exception as e:
+        print(f"Error in chat_generator: {str(e)}")
     finally:
-        stream_queue.put_nowait(None)
-
-def chat_generator(query, user_id, session_id, request_id, agent_orchestrator):
-    stream_queue = agent_orchestrator.stream_queue
-    Thread(target=lambda: asyncio.run(begin_generation(query, user_id, session_id, stream_queue, request_id, agent_orchestrator))).start()
-    while True:
-        try:
-            try:
-                value = stream_queue.get_nowait()
-                if value is None:
-                    break
-                yield value
-                stream_queue.task_done()
-            except asyncio.QueueEmpty:
-                pass
-        except Exception as e:
-            print(f"Error in chat_generator: {str(e)}")
-            break
+        # The client went away or the stream ended: stop generating for nobody
+        if not generation.done():
+            generation.cancel()
 
 @app.post("/orchestrated_chat")
-def orchestrated_chat(body: RequestBody):
-    try:
-        input_guard.validate(body.user_input)
-        request_prefix = body.user_id + "-" + body.session_id
-        request_id = request_prefix + str(random.randint(1, 10))
-        agent_orchestrator = None
-        if body.user_id in active_connections.keys():
-            agent_orchestrator = active_connections[body.user_id]
-        else:
-            agent_orchestrator = OrchestratorManager()
-            active_connections[body.user_id] = agent_orchestrator
-        return StreamingResponse(chat_generator(body.user_input, body.user_id, body.session_id, request_id, agent_orchestrator), media_type="text/event-stream")
-    except Exception as error:
-        response = "Something went wrong"
-        error = str(error).lower()
-        if 'jailbreak' in error:
-            response = "Unable to process request: Jailbreak Detected"
-        elif 'pii' in error:
-            response = "Unable to process request: Personally Identifiable Information Detected"
-        return StreamingResponse(response, media_type="text/event-stream")
+async def orchestrated_chat(body: RequestBody):
+    started = time.perf_counter()
+    request_prefix = body.user_id + "-" + body.session_id
+    request_id = request_prefix + str(random.randint(1, 10))
+    return StreamingResponse(chat_generator(body.user_input, body.user_id, body.session_id, request_id, started),
+                             media_type="text/event-stream")
+
+@app.get("/sessions/metrics")
+def session_metrics():
+    storage = orchestrator_manager.agent_orchestrator.storage
+    if isinstance(storage, CompactingStorage):
+        return {**session_registry.metrics(), 'compaction': storage.metrics()}
+    return session_registry.metrics()
+
+@app.get("/agents/metrics")
+def agent_metrics():
+    return {agent.id: agent.response_cache.metrics()
+            for agent in orchestrator_manager.agent_orchestrator.agents.values() if agent.response_cache}
+
+@app.get("/routing/metrics")
+def routing_metrics():
+    classifier = orchestrator_manager.classifier
+    routing_cache = classifier.classifier.routing_cache
+    return {
+        'fast_path': classifier.metrics(),
+        'cache': routing_cache.metrics() if routing_cache else {}
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(latency_metrics.render() + usage_ledger.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/usage/metrics")
+def usage_metrics():
+    return usage_ledger.metrics()
@@ -0,0 +1,8 @@
+from .guard_pool import GuardPool, GuardViolationError
+from .stream_guard import StreamingGuard
+
+__all__ = [
+    'GuardPool',
+    'GuardViolationError',
+    'StreamingGuard'
+]
@@ -0,0 +1,17 @@
+from guardrails import Guard
+from guardrails.hub import DetectPII, DetectJailbreak, ProfanityFree
+
+# Module-level functions, so a GuardPool can hand them to its worker processes
+
+
+def build_input_guard() -> Guard:
+    return Guard().use_many(
+        DetectJailbreak(on_fail="exception"),
+        DetectPII(["EMAIL_ADDRESS", "PHONE_NUMBER"], on_fail="exception")
+    )
+
+
+def build_output_guard() -> Guard:
+    return Guard().use_many(
+        ProfanityFree(on_fail="exception"),
+    )
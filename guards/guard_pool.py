@@ -0,0 +1,116 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from loguru import logger
+from orchestrator_types import RequestRejectedError
+
+# Guards built by the worker's initializer; every pool worker runs its tasks on the thread that built them
+_worker = threading.local()
+
+
+def _load_guards(factories: Dict[str, Callable[[], Any]], ready: Any) -> None:
+    _worker.guards = {name: factory() for name, factory in factories.items()}
+    ready.put(os.getpid())
+
+
+def _validate(name: str, text: str) -> Optional[str]:
+    """Validate text with the worker's guard; returns the failure message, None if it passed."""
+    try:
+        _worker.guards[name].validate(text)
+        return None
+    except Exception as error:
+        # guardrails errors do not always survive pickling, their message does
+        return str(error) or type(error).__name__
+
+
+def _noop() -> None:
+    return None
+
+
+class GuardViolationError(RequestRejectedError):
+    """Raised when text fails a guard; the message is the guard's own."""
+    def __init__(self, guard: str, message: str):
+        super().__init__(message)
+        self.guard = guard
+
+
+class GuardPool:
+    """
+    Runs guardrails validation in a pool of worker processes (or threads), so the ML
+    validators neither block the event loop nor contend for its GIL.
+
+    Every worker builds each guard once, when it starts, from the given factories;
+    with processes the factories must be module-level functions. Call start at server
+    startup so the models are loaded before the first request, not during it.
+    """
+    def __init__(self,
+                 factories: Dict[str, Callable[[], Any]],
+                 workers: int = 2,
+                 use_processes: bool = True,
+                 startup_timeout: float = 600.0):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.factories = factories
+        self.workers = workers
+        self.use_processes = use_processes
+        self.startup_timeout = startup_timeout
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the workers and block until every one of them has built its guards."""
+        with self._lock:
+            if self._executor is not None:
+                return
+            if self.use_processes:
+                # spawn rather than fork: the validators' ML runtimes do not survive a fork of a threaded server
+                context = multiprocessing.get_context('spawn')
+                ready = context.Queue()
+                executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                               initializer=_load_guards, initargs=(self.factories, ready))
+            else:
+                ready = queue.Queue()
+                executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="guard",
+                                              initializer=_load_guards, initargs=(self.factories, ready))
+
+            # Workers are started on demand: one task each starts all of them now
+            futures = [executor.submit(_noop) for _ in range(self.workers)]
+            deadline = time.monotonic() + self.startup_timeout
+            started = 0
+            while started < self.workers:
+                failed = next((future for future in futures if future.done() and future.exception()), None)
+                if failed is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise RuntimeError(f"Guard worker failed to start: {failed.exception()}")
+                if time.monotonic() > deadline:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise TimeoutError(f"Guard workers did not start within {self.startup_timeout} seconds")
+                try:
+                    ready.get(timeout=0.5)
+                    started += 1
+                except queue.Empty:
+                    pass
+            self._executor = executor
+            logger.info(f"Started {self.workers} guard {'processes' if self.use_processes else 'threads'} "
+                        f"with guards {', '.join(self.factories)}")
+
+    async def validate(self, name: str, text: str) -> None:
+        """Validate text with the named guard, raising GuardViolationError if it fails."""
+        if name not in self.factories:
+            raise ValueError(f"Unknown guard: {name}")
+        if self._executor is None:
+            await asyncio.to_thread(self.start)
+        error = await asyncio.get_running_loop().run_in_executor(self._executor, _validate, name, text)
+        if error is not None:
+            raise GuardViolationError(name, error)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,58 @@
+import re
+from typing import Awaitable, Callable, List, Optional
+
+# A sentence ends at terminal punctuation (and any closing quotes or brackets) followed by
+# whitespace, or at a line break. The whitespace must have arrived: "3." may go on as "3.5".
+SENTENCE_END = re.compile(r'[.!?]["\'’”)\]]*\s+|\n+')
+
+
+class StreamingGuard:
+    """
+    Validates streamed text in sentence-sized windows as it arrives, so validated text
+    can be sent on while the rest of the answer is still being generated.
+
+    push takes the next chunk and returns the windows it completed, each validated
+    before it is returned; only the tail after the last sentence end is held back.
+    Windows are at least min_window_chars long (short sentences are validated
+    together) and are cut at a word boundary once max_window_chars pass without a
+    sentence end. flush validates and returns the tail once the stream has ended.
+    A failing window raises whatever the validate function raises, and the stream
+    should be aborted.
+    """
+    def __init__(self,
+                 validate: Callable[[str], Awaitable[None]],
+                 min_window_chars: int = 40,
+                 max_window_chars: int = 600):
+        if min_window_chars < 1 or max_window_chars < min_window_chars:
+            raise ValueError("window sizes must satisfy 1 <= min_window_chars <= max_window_chars")
+        self.validate = validate
+        self.min_window_chars = min_window_chars
+        self.max_window_chars = max_window_chars
+        self.pending = ""
+
+    def _window_end(self) -> Optional[int]:
+        for match in SENTENCE_END.finditer(self.pending):
+            if match.end() >= self.min_window_chars:
+                return match.end()
+        if len(self.pending) >= self.max_window_chars:
+            space = self.pending.rfind(" ", 0, self.max_window_chars)
+            return space + 1 if space > 0 else self.max_window_chars
+        return None
+
+    async def push(self, text: str) -> List[str]:
+        self.pending += text
+        windows: List[str] = []
+        end = self._window_end()
+        while end is not None:
+            window, self.pending = self.pending[:end], self.pending[end:]
+            await self.validate(window)
+            windows.append(window)
+            end = self._window_end()
+        return windows
+
+    async def flush(self) -> List[str]:
+        if not self.pending:
+            return []
+        window, self.pending = self.pending, ""
+        await self.validate(window)
+        return [window]
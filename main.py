@@ -4,8 +4,9 @@ from orchestrator import Orchestrator
 from orchestrator_types import FinalResponse, ExpectedResult
 from chat_storage import MemoryStorage
 from classifiers import OpenAIClassifier, OpenAIClassifierOptions
+from metrics import LatencyMetrics
 import asyncio
-from typing import List
+from typing import List, Optional
 from loguru import logger
 from guardrails.hub import DetectPII, DetectJailbreak, ProfanityFree
 from guardrails import Guard
@@ -19,7 +20,7 @@ load_dotenv()
 
 
 class MainClass():
-    def __init__(self):
+    def __init__(self, metrics: Optional[LatencyMetrics] = None):
         # Create classifier
         open_ai_classifier = OpenAIClassifier(
             OpenAIClassifierOptions(
@@ -81,25 +82,34 @@ class MainClass():
         )
 
         # Create AgentOrchestrator
-        self.agent_orchestrator = Orchestrator(storage=MemoryStorage(),classifier=open_ai_classifier)
+        self.agent_orchestrator = Orchestrator(storage=MemoryStorage(),classifier=open_ai_classifier, metrics=metrics)
 
         # Add agents
         self.agent_orchestrator.add_agent(text_classification_agent)
         self.agent_orchestrator.add_agent(reasoning_agent)
         self.agent_orchestrator.add_agent(data_retrieval_agent)
 
+        # One long-lived event loop so the shared LLM connection pool is reused across runs
+        self.loop = asyncio.new_event_loop()
+
     def run(self, user_input: str, user_id: str, session_id: str, request_id: str):
-        return asyncio.run(self.agent_orchestrator.route_request(user_input,user_id,session_id,request_id))
+        return self.loop.run_until_complete(self.agent_orchestrator.route_request(user_input,user_id,session_id,request_id))
     
     def evaluationMetric(self, user_input: str, results: List[FinalResponse], expectedResult: ExpectedResult, file: TextIOWrapper):
         try:
             total_output_token = 0
+            total_prompt_token = 0
+            total_completion_token = 0
+            total_cost = 0.0
             agents_called_set = set()
             agent_output = []
             for result in results:
                 agents_called_set.add(result.AGENT_SELECTED)
                 agent_output.append(result.AGENT_OUTPUT)
                 total_output_token = total_output_token + result.OUTPUT_TOKENS
+                total_prompt_token = total_prompt_token + result.PROMPT_TOKENS
+                total_completion_token = total_completion_token + result.COMPLETION_TOKENS
+                total_cost = total_cost + (result.COST_USD or 0.0)
 
 
             agent_result_set = set()
@@ -115,6 +125,9 @@ class MainClass():
             print(f"Number of agent calls: {len(results)}")
             print(f"Agents called: {list(agents_called_set)}")
             print(f"Total output tokens: {total_output_token}")
+            print(f"Total prompt tokens (all model calls): {total_prompt_token}")
+            print(f"Total completion tokens (all model calls): {total_completion_token}")
+            print(f"Estimated cost: ${total_cost:.6f}")
             print(f"----------------------------- End of Evaluation Metric for Request : {results[0].REQUEST_ID} --------------------------\n")
 
             file.write(
@@ -125,6 +138,9 @@ class MainClass():
                         Number of agent calls: {len(results)}
                         Agents called: {list(agents_called_set)}
                         Total output tokens: {total_output_token}
+                        Total prompt tokens (all model calls): {total_prompt_token}
+                        Total completion tokens (all model calls): {total_completion_token}
+                        Estimated cost: ${total_cost:.6f}
                         ----------------------------- End of Evaluation Metric for Request : {results[0].REQUEST_ID} --------------------------\n
                 '''
             )
@@ -0,0 +1,12 @@
+from .latency_metrics import Histogram, LatencyMetrics, Span, DEFAULT_BUCKETS, PROMETHEUS_CONTENT_TYPE
+from .usage_ledger import UsageLedger, UsageTotals
+
+__all__ = [
+    'Histogram',
+    'LatencyMetrics',
+    'Span',
+    'DEFAULT_BUCKETS',
+    'PROMETHEUS_CONTENT_TYPE',
+    'UsageLedger',
+    'UsageTotals'
+]
@@ -0,0 +1,137 @@
+import time
+from bisect import bisect_left
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds, from a local storage read to a long multi-tool agent call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class Histogram:
+    """Cumulative histogram per label combination, rendered in the Prometheus text format."""
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 label_names: Sequence[str],
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        if list(buckets) != sorted(buckets):
+            raise ValueError("buckets must be sorted in increasing order")
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [per bucket counts (the last one is +Inf), sum, count]
+        self.series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, label_values: Tuple[str, ...]) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(label_values, list(counts), total, count)
+                      for label_values, (counts, total, count) in sorted(self.series.items())]
+        for label_values, counts, total, count in series:
+            labels = ",".join(f'{name}="{self._escape(value)}"' for name, value in zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Span:
+    """Times the block it wraps and records it as one observation of a stage."""
+    __slots__ = ('metrics', 'stage', 'context', 'agent', 'start')
+
+    def __init__(self, metrics: "LatencyMetrics", stage: str, context: Optional[Any], agent: Optional[str]):
+        self.metrics = metrics
+        self.stage = stage
+        self.context = context
+        self.agent = agent
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        # Failed and cancelled calls are timed too, they cost the request as much
+        self.metrics.observe(self.stage, time.perf_counter() - self.start, self.context, self.agent)
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class LatencyMetrics:
+    """
+    Latency of the stages of a request (classification, storage reads and writes,
+    agent calls, guards, time to first token) as one histogram labelled by stage,
+    agent and hop index.
+
+    Stages are timed with span, or reported with observe when they were timed
+    elsewhere. When a request context is given, its hop index labels the observation
+    and the duration is also added to the context's execution_times, keyed by stage,
+    agent and hop. A disabled instance hands out one shared span that does nothing,
+    so instrumented code costs a method call per stage.
+    """
+    STAGE_HISTOGRAM = "orchestrator_stage_duration_seconds"
+
+    def __init__(self, enabled: bool = True, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.stages = Histogram(self.STAGE_HISTOGRAM,
+                                "Time spent in each stage of a request, by agent and hop index.",
+                                ("stage", "agent", "hop"),
+                                buckets)
+        self._labels: Dict[Tuple[str, Optional[str], Optional[int]], Tuple[Tuple[str, str, str], str]] = {}
+
+    def span(self, stage: str, context: Optional[Any] = None, agent: Optional[str] = None):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, stage, context, agent)
+
+    def observe(self, stage: str, seconds: float, context: Optional[Any] = None, agent: Optional[str] = None) -> None:
+        if not self.enabled:
+            return
+        hop = getattr(context, 'hop', None)
+        labels = self._labels.get((stage, agent, hop))
+        if labels is None:
+            labels = self._labels[(stage, agent, hop)] = self._build_labels(stage, agent, hop)
+        self.stages.observe(seconds, labels[0])
+        execution_times = getattr(context, 'execution_times', None)
+        if execution_times is not None:
+            execution_times[labels[1]] = execution_times.get(labels[1], 0.0) + seconds
+
+    @staticmethod
+    def _build_labels(stage: str, agent: Optional[str], hop: Optional[int]) -> Tuple[Tuple[str, str, str], str]:
+        """Histogram label values and execution_times key of a stage, built once per combination."""
+        agent = agent or ""
+        label_values = (stage, agent, "" if hop is None else str(hop))
+        return label_values, stage + (f":{agent}" if agent else "") + (f"#{hop}" if hop is not None else "")
+
+    def render(self) -> str:
+        """All histograms in the Prometheus text exposition format."""
+        return "\n".join(self.stages.render()) + "\n"
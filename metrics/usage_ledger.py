@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from token_counting import RequestUsage, TokenUsage, estimate_cost
+
+class UsageTotals:
+    """Requests, model calls, tokens and estimated cost added up for one key."""
+    __slots__ = ('requests', 'calls', 'prompt_tokens', 'completion_tokens', 'cost_usd')
+
+    def __init__(self):
+        self.requests = 0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+
+    def add(self, usage: TokenUsage, cost: Optional[float]) -> None:
+        self.calls += 1
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        self.cost_usd += cost or 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'calls': self.calls,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cost_usd': round(self.cost_usd, 6)
+        }
+
+class UsageLedger:
+    """
+    Token usage and estimated cost of all requests served, added up by source (the
+    classifier or an agent id), model, API key and user.
+
+    Per source and model totals are exported as Prometheus counters; users are left
+    out of the export to keep label cardinality bounded, and only the max_users most
+    recently active users are kept. API keys are only ever kept by their label.
+    """
+    TOKENS_COUNTER = "orchestrator_tokens_total"
+    COST_COUNTER = "orchestrator_cost_usd_total"
+
+    def __init__(self,
+                 max_users: int = 10000,
+                 prices: Optional[Mapping[str, Tuple[float, float]]] = None):
+        self.max_users = max_users
+        self.prices = prices
+        self.total = UsageTotals()
+        self.by_source_model: Dict[Tuple[str, str], UsageTotals] = {}
+        self.by_api_key: Dict[str, UsageTotals] = {}
+        self.by_user: "OrderedDict[str, UsageTotals]" = OrderedDict()
+        self._lock = Lock()
+
+    def record_request(self, user_id: str, usage: Optional[RequestUsage]) -> None:
+        self._record(user_id, usage, count_request=True)
+
+    def record_calls(self, user_id: str, usage: Optional[RequestUsage]) -> None:
+        """Add model calls made for a user outside of a request (such as history compaction) without counting a request."""
+        self._record(user_id, usage, count_request=False)
+
+    def _record(self, user_id: str, usage: Optional[RequestUsage], count_request: bool) -> None:
+        if usage is None or not usage.records:
+            return
+        with self._lock:
+            user = self.by_user.pop(user_id, None) or UsageTotals()
+            self.by_user[user_id] = user
+            while len(self.by_user) > self.max_users:
+                self.by_user.popitem(last=False)
+
+            counted = set()
+            for record in usage.records:
+                cost = estimate_cost(record.usage, self.prices)
+                source_model = self.by_source_model.setdefault((record.source, record.usage.model or "unknown"), UsageTotals())
+                api_key = self.by_api_key.setdefault(record.api_key, UsageTotals())
+                for totals in (self.total, user, source_model, api_key):
+                    totals.add(record.usage, cost)
+                    if count_request and id(totals) not in counted:
+                        totals.requests += 1
+                        counted.add(id(totals))
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'total': self.total.as_dict(),
+                'by_source': {f"{source}/{model}": totals.as_dict()
+                              for (source, model), totals in self.by_source_model.items()},
+                'by_api_key': {label: totals.as_dict() for label, totals in self.by_api_key.items()},
+                'by_user': {user_id: totals.as_dict() for user_id, totals in self.by_user.items()}
+            }
+
+    def render(self) -> str:
+        """Token and cost counters by source and model in the Prometheus text exposition format."""
+        lines: List[str] = [
+            f"# HELP {self.TOKENS_COUNTER} Tokens reported by the models, by source, model and kind.",
+            f"# TYPE {self.TOKENS_COUNTER} counter"
+        ]
+        with self._lock:
+            series = sorted((source, model, totals.prompt_tokens, totals.completion_tokens, totals.cost_usd)
+                            for (source, model), totals in self.by_source_model.items())
+        for source, model, prompt_tokens, completion_tokens, _ in series:
+            lines.append(f'{self.TOKENS_COUNTER}{{source="{source}",model="{model}",kind="prompt"}} {prompt_tokens}')
+            lines.append(f'{self.TOKENS_COUNTER}{{source="{source}",model="{model}",kind="completion"}} {completion_tokens}')
+        lines.append(f"# HELP {self.COST_COUNTER} Estimated cost in USD of the model calls, by source and model.")
+        lines.append(f"# TYPE {self.COST_COUNTER} counter")
+        for source, model, _, _, cost in series:
+            lines.append(f'{self.COST_COUNTER}{{source="{source}",model="{model}"}} {cost}')
+        return "\n".join(lines) + "\n"
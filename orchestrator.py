@@ -1,18 +1,24 @@
-from typing import Dict, Any, AsyncIterable, Optional, Union, List
+import asyncio
+from typing import Dict, Any, AsyncIterable, Awaitable, Optional, Tuple, Union, List
 from dataclasses import dataclass, fields, asdict, replace
 from loguru import logger
-from orchestrator_types import ConversationMessage, ConversationRole, OrchestratorConfig, FinalResponse
-from classifiers import Classifier,ClassifierResult
-from agents import Agent, AgentResponse
+from orchestrator_types import (ConversationMessage, ConversationRole, OrchestratorConfig, FinalResponse, RequestContext,
+                                RequestBudget, BudgetExceededError, RequestRejectedError)
+from classifiers import Classifier,ClassifierResult, PlanStep
+from agents import Agent, AgentResponse, AgentCallbacks
 from chat_storage import ChatStorage
 from chat_storage import MemoryStorage
+from metrics import LatencyMetrics, UsageLedger
+from token_counting import RequestUsage
 
 @dataclass
 class Orchestrator:
     def __init__(self,
                  options: Optional[OrchestratorConfig] = None,
                  storage: Optional[ChatStorage] = None,
-                 classifier: Optional[Classifier] = None):
+                 classifier: Optional[Classifier] = None,
+                 metrics: Optional[LatencyMetrics] = None,
+                 usage_ledger: Optional[UsageLedger] = None):
 
         DEFAULT_CONFIG=OrchestratorConfig()
 
@@ -31,13 +37,15 @@ class Orchestrator:
 
         self.agents: Dict[str, Agent] = {}
         self.storage = storage or MemoryStorage()
+        # Stage latencies are only recorded when an enabled LatencyMetrics is passed in
+        self.metrics = metrics or LatencyMetrics(enabled=False)
+        # Token usage and cost of every request are added to the ledger when one is passed in
+        self.usage_ledger = usage_ledger
 
         if classifier:
             self.classifier = classifier
         else:
             raise ValueError("No classifier provided. Please provide a classifier.")
-   
-        self.execution_times: Dict[str, float] = {}
 
 
     def add_agent(self, agent: Agent):
@@ -56,113 +64,217 @@ class Orchestrator:
                                 params: Dict[str, Any]) -> Union[
                                     ConversationMessage, AsyncIterable[Any]
                                 ]:
-        original_user_input = params['original_user_input']
+        context: RequestContext = params['context']
         user_input = params['user_input']
-        user_id = params['user_id']
-        session_id = params['session_id']
         classifier_result:ClassifierResult = params['classifier_result']
-        additional_params = params.get('additional_params', {})
 
         if not classifier_result.agent_selected:
             return "I'm sorry, but I need more information to understand your request. \
                 Could you please be more specific?"
 
         agent_selected = classifier_result.agent_selected
-        agent_chat_history = await self.storage.fetch_chat(user_id, session_id, agent_selected.id)
+        if self.accepts_fused_answer(classifier_result):
+            # Answered by the classifier in the agent's persona: no agent call
+            logger.info(f"Classifier answered for {agent_selected.id} in the routing call")
+            return await agent_selected.deliver_answer(context,
+                                                       classifier_result.output,
+                                                       classifier_result.short_output or classifier_result.output,
+                                                       agent_selected.output_tokens(None, classifier_result.output))
 
-        response = await agent_selected.handle_request(
-                                                   original_user_input,
-                                                   user_input,
-                                                   user_id,
-                                                   session_id,
-                                                   agent_chat_history,
-                                                   additional_params)
+        with self.metrics.span("fetch_chat", context, agent_selected.id):
+            agent_chat_history = await self.storage.fetch_chat(context.user_id, context.session_id, agent_selected.id,
+                                                               max_tokens=self.history_token_budget(agent_selected))
+
+        with self.metrics.span("handle_request", context, agent_selected.id):
+            response = await self.within_deadline(agent_selected.process_request(context, user_input, agent_chat_history),
+                                                  context.budget)
 
         return response
 
+    @staticmethod
+    def accepts_fused_answer(classifier_result: ClassifierResult) -> bool:
+        """A fused answer is used only for a single-hop routing to an agent that allows it."""
+        return bool(classifier_result.output
+                    and classifier_result.agent_selected
+                    and classifier_result.agent_selected.supports_fused_answer()
+                    and classifier_result.next_action in ("respond_to_user", "unknown"))
+
+    def history_token_budget(self, agent: Agent) -> Optional[int]:
+        """Token budget of the history sent to an agent: its own, else the orchestrator's."""
+        if agent.history_token_budget is not None:
+            return agent.history_token_budget
+        return self.config.AGENT_HISTORY_TOKEN_BUDGET
+
     async def classify_request(self,
                              user_input: str,
-                             user_id: str,
-                             session_id: str) -> ClassifierResult:
-        """Classify user request with conversation history."""
+                             context: RequestContext,
+                             fused: bool = False) -> ClassifierResult:
+        """Classify user request with conversation history; with fused, the classifier may answer it too."""
         try:
-            chat_history = await self.storage.fetch_all_chats(user_id, session_id) or []
-            classifier_result = await self.classifier.classify(user_input, chat_history)
+            with self.metrics.span("fetch_all_chats", context):
+                chat_history = await self.storage.fetch_all_chats(
+                    context.user_id, context.session_id, max_tokens=self.config.CLASSIFIER_HISTORY_TOKEN_BUDGET) or []
+            with self.metrics.span("classify_request", context):
+                classifier_result = await self.within_deadline(self.classifier.classify(user_input, chat_history, context, fused=fused),
+                                                               context.budget)
 
             return classifier_result
 
+        except BudgetExceededError:
+            raise
         except Exception as error:
             logger.error(f"Error during intent classification: {str(error)}")
             raise error
         
     async def agent_handle_request(self,
-                               original_user_input: str,
+                               context: RequestContext,
                                current_user_input: str,
-                               user_id: str,
-                               session_id: str,
-                               classifier_result: ClassifierResult,
-                               additional_params: Dict[str, str] = {}) -> AgentResponse:
+                               classifier_result: ClassifierResult) -> AgentResponse:
         """Process agent response and handle chat storage."""
         try:
             agent_response = await self.dispatch_request_to_agent({
-                "original_user_input": original_user_input,
+                "context": context,
                 "user_input": current_user_input,
-                "user_id": user_id,
-                "session_id": session_id,
-                "classifier_result": classifier_result,
-                "additional_params": additional_params
+                "classifier_result": classifier_result
             })
 
             logger.info(f"Output of the request is: {agent_response.content}")
 
-            await self.save_message(
-                ConversationMessage(
-                    role=ConversationRole.USER.value,
-                    original_user_input=original_user_input,
-                    short_output="",
-                    tokens=len(current_user_input.split(' ')),
-                    content=[{'text': current_user_input}]
-                ),
-                user_id,
-                session_id,
-                classifier_result.agent_selected
+            user_message = ConversationMessage(
+                role=ConversationRole.USER.value,
+                original_user_input=context.original_user_input,
+                short_output="",
+                tokens=self.storage.tokenizer.count(current_user_input),
+                content=[{'text': current_user_input}]
             )
-            if isinstance(agent_response, ConversationMessage):
-                await self.save_message(agent_response,
-                                    user_id,
-                                    session_id,
-                                    classifier_result.agent_selected)
+            with self.metrics.span("save_message", context, classifier_result.agent_selected.id):
+                if isinstance(agent_response, ConversationMessage):
+                    # Saved as one pair so concurrent sub-tasks on the same agent cannot interleave
+                    await self.save_messages([user_message, agent_response],
+                                             context.user_id,
+                                             context.session_id,
+                                             classifier_result.agent_selected)
+                else:
+                    await self.save_message(user_message,
+                                            context.user_id,
+                                            context.session_id,
+                                            classifier_result.agent_selected)
 
             return AgentResponse(
                 output=agent_response,
                 streaming=classifier_result.agent_selected.is_streaming_enabled()
             )
 
+        except BudgetExceededError:
+            raise
         except Exception as error:
             logger.error(f"Error during agent processing: {str(error)}")
             raise error
+
+    def create_budget(self) -> RequestBudget:
+        return RequestBudget(max_hops=self.config.MAX_HOPS_PER_REQUEST,
+                             max_tokens=self.config.MAX_TOKENS_PER_REQUEST,
+                             timeout_seconds=self.config.REQUEST_TIMEOUT_SECONDS)
+
+    @staticmethod
+    async def within_deadline(awaitable: Awaitable[Any], budget: Optional[RequestBudget]) -> Any:
+        """Await a classifier or agent call, cancelling it if the request's deadline passes first."""
+        if budget is None or budget.deadline is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, budget.remaining_seconds())
+        except asyncio.TimeoutError:
+            budget.fail(RequestBudget.DEADLINE)
+
+    @staticmethod
+    async def admitted(awaitable: Awaitable[Any], admission: Optional["asyncio.Future[Any]"]) -> Any:
+        """
+        Await a classifier (or planner) call once the request's admission check has
+        passed too. The two run concurrently; if the check fails, the call is cancelled
+        and the check's error raised.
+        """
+        if admission is None:
+            return await awaitable
+        call = asyncio.ensure_future(awaitable)
+        try:
+            await admission
+        except BaseException:
+            call.cancel()
+            raise
+        return await call
+
+    def usage_fields(self, context: RequestContext) -> Dict[str, Any]:
+        """Reported tokens and estimated cost of the model calls of the context's hop, for its FinalResponse."""
+        if context.usage is None:
+            return {}
+        usage = context.usage.total(context.hop)
+        return {
+            'PROMPT_TOKENS': usage.prompt_tokens,
+            'COMPLETION_TOKENS': usage.completion_tokens,
+            'COST_USD': context.usage.cost(context.hop, self.config.MODEL_PRICES)
+        }
+
+    def budget_exceeded_response(self, reason: str, request_id: str) -> FinalResponse:
+        return FinalResponse(
+            AGENT_OUTPUT=self.config.BUDGET_EXCEEDED_LOG,
+            AGENT_SELECTED="none",
+            OUTPUT_TOKENS=0,
+            REQUEST_ID=request_id,
+            BUDGET_EXCEEDED=reason
+        )
         
     async def route_request(self,
                        user_input: str,
                        user_id: str,
                        session_id: str, 
                        request_id: str,
-                       additional_params: Dict[str, str] = {}) -> AgentResponse:
-        """Route user request to appropriate agent."""
-        self.execution_times.clear()
+                       additional_params: Dict[str, str] = {},
+                       callbacks: Optional[AgentCallbacks] = None,
+                       budget: Optional[RequestBudget] = None,
+                       execution_times: Optional[Dict[str, float]] = None,
+                       admission: Optional[Awaitable[Any]] = None) -> AgentResponse:
+        """
+        Route user request to appropriate agent.
+        When the request's budget runs out, the responses so far are returned followed
+        by one whose BUDGET_EXCEEDED names the limit that was hit.
+        Pass execution_times to get the request's stage timings back (they are only
+        recorded when the orchestrator has enabled metrics).
+        An admission check (such as the input guard) runs alongside the first
+        classifier call and must pass before any agent is called; when it raises
+        RequestRejectedError, routing is cancelled and the error re-raised.
+        """
+        admission = asyncio.ensure_future(admission) if admission is not None else None
+        context = RequestContext(
+            user_id=user_id,
+            session_id=session_id,
+            request_id=request_id,
+            original_user_input=user_input,
+            additional_params=additional_params,
+            callbacks=callbacks,
+            execution_times=execution_times if execution_times is not None else {},
+            budget=budget or self.create_budget(),
+            usage=RequestUsage()
+        )
+        final_response: List[FinalResponse] = []
 
         try:
             logger.info(f"User input: {user_input}")
-            self.classifier.set_original_user_input(user_input)
+            if self.config.EXECUTION_MODE == "plan":
+                planned_response = await self.route_planned_request(user_input, context, admission)
+                if planned_response is not None:
+                    return planned_response
+
             last_output_from_agent = ""
-            final_response: List[FinalResponse] = []
             #---------------------Main Core Logic of Orchestrator Routing-------------------------
             while True:
-                classifier_result = await self.classify_request(user_input, user_id, session_id)
+                context.budget.start_hop()
+                # A request that looks single-hop may be answered in the routing call itself
+                fused = self.config.FUSED_SINGLE_HOP and context.hop == 0 and self.classifier.predict_single_hop(user_input)
+                classifier_result = await self.admitted(self.classify_request(user_input, context, fused), admission)
                 if not classifier_result.agent_selected:
                     return AgentResponse(
                         output=ConversationMessage(
-                            original_user_input=self.classifier.original_user_input,
+                            original_user_input=context.original_user_input,
                             role=ConversationRole.ASSISTANT.value,
                             short_output="",
                             tokens=0,
@@ -177,12 +289,9 @@ class Orchestrator:
                 logger.info(f"Current Input to be executed: {user_input}")
 
                 agent_output = await self.agent_handle_request(
-                        self.classifier.original_user_input,
-                        user_input, 
-                        user_id,
-                        session_id, 
-                        classifier_result,
-                        additional_params
+                        context,
+                        user_input,
+                        classifier_result
                 )
 
                 if isinstance(agent_output.output, ConversationMessage):
@@ -190,12 +299,14 @@ class Orchestrator:
                         tokens=agent_output.output.tokens
                 else:
                         current_output = agent_output.output
+                        tokens = 0
 
                 final_response.append(FinalResponse(
                     AGENT_OUTPUT=current_output,
                     AGENT_SELECTED=classifier_result.agent_selected.name,
                     OUTPUT_TOKENS=tokens,
-                    REQUEST_ID=request_id
+                    REQUEST_ID=request_id,
+                    **self.usage_fields(context)
                 ))
 
                 if classifier_result.next_action == "respond_to_user":                
@@ -211,17 +322,174 @@ class Orchestrator:
                         user_input = current_output
                     else:
                         user_input = classifier_result.next_action_input
-                    self.classifier.set_sutask_input(user_input)
+                    context = replace(context, subtask_input=user_input, hop=context.hop + 1)
                     logger.info(f"Performing next action with agent: {classifier_result.next_action}")
                     logger.info(f"Providing input to the agent: {user_input}")
             
             return final_response
 
+        except BudgetExceededError as error:
+            logger.warning(f"Request {request_id} stopped: {str(error)}")
+            return final_response + [self.budget_exceeded_response(error.reason, request_id)]
+        except RequestRejectedError:
+            raise
         except Exception as error:
             return AgentResponse(
                 output=self.config.ROUTING_ERROR_LOG or str(error),
                 streaming=False
             )
+        finally:
+            # cancel() fails once the check is done; then mark an outcome nobody awaited as seen
+            if admission is not None and not admission.cancel() and not admission.cancelled():
+                admission.exception()
+            usage = context.usage.total()
+            logger.info(f"Request {request_id} used {usage.prompt_tokens} prompt and {usage.completion_tokens} completion tokens")
+            if self.usage_ledger:
+                self.usage_ledger.record_request(user_id, context.usage)
+
+    async def route_planned_request(self,
+                                    user_input: str,
+                                    context: RequestContext,
+                                    admission: Optional["asyncio.Future[Any]"] = None) -> Optional[List[FinalResponse]]:
+        """
+        Plan the whole request with one classifier call and run the sub-tasks as a
+        dependency graph: independent sub-tasks run concurrently and each one starts as
+        soon as the sub-tasks it depends on have finished.
+        Returns None when no usable plan is available, so the caller can fall back to
+        hop by hop routing.
+        """
+        try:
+            with self.metrics.span("fetch_all_chats", context):
+                chat_history = await self.storage.fetch_all_chats(
+                    context.user_id, context.session_id, max_tokens=self.config.CLASSIFIER_HISTORY_TOKEN_BUDGET) or []
+
+            async def plan_request() -> List[PlanStep]:
+                with self.metrics.span("plan_request", context):
+                    return await self.within_deadline(self.classifier.plan(user_input, chat_history, context),
+                                                      context.budget)
+
+            plan = await self.admitted(plan_request(), admission)
+        except NotImplementedError:
+            return None
+        except (BudgetExceededError, RequestRejectedError):
+            raise
+        except Exception as error:
+            logger.error(f"Error during request planning, falling back to hop by hop routing: {str(error)}")
+            return None
+
+        plan = self.order_plan(plan)
+        if not plan:
+            return None
+
+        tasks: Dict[str, asyncio.Task] = {}
+        for index, step in enumerate(plan):
+            tasks[step.id] = asyncio.create_task(self.run_plan_step(step, tasks, replace(context, hop=index)))
+        try:
+            agent_outputs = await self.within_deadline(asyncio.gather(*tasks.values()), context.budget)
+        except BudgetExceededError as error:
+            # Sub-tasks that finished in time are kept, the others are cancelled
+            finished = [(index, step, task.result()) for index, (step, task) in enumerate(zip(plan, tasks.values()))
+                        if task.done() and not task.cancelled() and task.exception() is None]
+            for task in tasks.values():
+                task.cancel()
+            logger.warning(f"Request {context.request_id} stopped: {str(error)}")
+            return self.plan_responses(finished, context) + \
+                [self.budget_exceeded_response(error.reason, context.request_id)]
+        except Exception:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+        return self.plan_responses([(index, step, agent_output)
+                                    for index, (step, agent_output) in enumerate(zip(plan, agent_outputs))], context)
+
+    def plan_responses(self,
+                       step_outputs: List[Tuple[int, PlanStep, AgentResponse]],
+                       context: RequestContext) -> List[FinalResponse]:
+        final_response: List[FinalResponse] = []
+        for index, step, agent_output in step_outputs:
+            output = agent_output.output
+            final_response.append(FinalResponse(
+                AGENT_OUTPUT=output.content[0]['text'] if isinstance(output, ConversationMessage) else output,
+                AGENT_SELECTED=step.agent_selected.name if step.agent_selected else "unknown",
+                OUTPUT_TOKENS=output.tokens if isinstance(output, ConversationMessage) else 0,
+                REQUEST_ID=context.request_id,
+                **self.usage_fields(replace(context, hop=index))
+            ))
+        return final_response
+
+    async def run_plan_step(self,
+                            step: PlanStep,
+                            tasks: Dict[str, asyncio.Task],
+                            context: RequestContext) -> AgentResponse:
+        dependency_outputs = [await tasks[step_id] for step_id in step.depends_on]
+        if context.budget:
+            context.budget.start_hop()
+        step_input = "\n".join([step.input, *[dependency.output.short_output for dependency in dependency_outputs
+                                              if isinstance(dependency.output, ConversationMessage)]])
+
+        if not step.agent_selected:
+            return AgentResponse(
+                output=ConversationMessage(
+                    original_user_input=context.original_user_input,
+                    role=ConversationRole.ASSISTANT.value,
+                    short_output="",
+                    tokens=0,
+                    content=[{'text': self.config.AGENT_NOT_SELECTED_LOG}]
+                ),
+                streaming=False
+            )
+
+        logger.info(f"Running planned sub-task {step.id} with agent: {step.agent_selected.name}")
+        classifier_result = ClassifierResult(
+            input=step.input,
+            agent_selected=step.agent_selected,
+            accuracy=1.0,
+            action="plan",
+            next_action="respond_to_user",
+            next_action_input="unknown"
+        )
+        return await self.agent_handle_request(replace(context, subtask_input=step.input),
+                                               step_input,
+                                               classifier_result)
+
+    @staticmethod
+    def order_plan(plan: List[PlanStep]) -> Optional[List[PlanStep]]:
+        """
+        Order plan steps so dependencies come first, dropping references to unknown steps.
+        Returns None for an empty plan, duplicate ids or circular dependencies.
+        """
+        steps = {step.id: step for step in plan}
+        if not plan or len(steps) != len(plan):
+            return None
+        for step in plan:
+            step.depends_on = [step_id for step_id in dict.fromkeys(step.depends_on)
+                               if step_id in steps and step_id != step.id]
+
+        ordered: List[PlanStep] = []
+        done = set()
+        pending = list(plan)
+        while pending:
+            ready = [step for step in pending if all(step_id in done for step_id in step.depends_on)]
+            if not ready:
+                logger.error("Request plan has circular dependencies")
+                return None
+            for step in ready:
+                ordered.append(step)
+                done.add(step.id)
+            pending = [step for step in pending if step.id not in done]
+        return ordered
+
+    async def save_messages(self,
+                            messages: List[ConversationMessage],
+                            user_id: str, session_id: str,
+                            agent: Agent):
+        if agent and agent.save_chat:
+            return await self.storage.save_messages(user_id,
+                                                    session_id,
+                                                    agent.id,
+                                                    messages,
+                                                    self.config.MAX_MESSAGE_PAIRS_PER_AGENT)
 
     async def save_message(self,
                            message: ConversationMessage,
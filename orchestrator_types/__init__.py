@@ -2,6 +2,10 @@ from .orchestrator_types import (
     ConversationMessage,
     ConversationRole,
     TimestampedMessage,
+    RequestContext,
+    RequestBudget,
+    BudgetExceededError,
+    RequestRejectedError,
     OrchestratorConfig,
     OrchestratorConfig,
     FinalResponse,
@@ -12,6 +16,10 @@ __all__ = [
     'ConversationMessage',
     'ConversationRole',
     'TimestampedMessage',
+    'RequestContext',
+    'RequestBudget',
+    'BudgetExceededError',
+    'RequestRejectedError',
     'OrchestratorConfig',
     'OrchestratorConfig',
     'FinalResponse',
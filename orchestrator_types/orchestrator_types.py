@@ -1,36 +1,175 @@
 from enum import Enum
-from typing import List, Optional, Any
-from dataclasses import dataclass
+from typing import List, Optional, Any, Dict, Tuple
+from dataclasses import dataclass, field
 import time
+from token_counting import RequestUsage
 
 class ConversationRole(Enum):
     ASSISTANT = "assistant"
     USER = "user"
+    SYSTEM = "system" #notes the orchestrator adds to a history, such as a rolling summary; never saved
 
 class ConversationMessage:
+    """
+    Immutable chat message. Slotted and frozen, so storages can hand the stored
+    instances to readers instead of copying them.
+    """
+    __slots__ = ('role', 'original_user_input', 'short_output', 'tokens', 'content')
+
     role: ConversationRole
     original_user_input: str
     short_output: str
     tokens: Optional[int]
-    content: List[Any]
+    content: Optional[Tuple[Any, ...]]
 
     def __init__(self, role: ConversationRole, original_user_input: str, short_output: str, tokens: Optional[int], content: Optional[List[Any]] = None):
-        self.role = role
-        self.original_user_input = original_user_input
-        self.short_output = short_output
-        self.tokens = tokens
-        self.content = content
+        object.__setattr__(self, 'role', role)
+        object.__setattr__(self, 'original_user_input', original_user_input)
+        object.__setattr__(self, 'short_output', short_output)
+        object.__setattr__(self, 'tokens', tokens)
+        object.__setattr__(self, 'content', tuple(content) if content is not None else None)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return (ConversationMessage, (self.role, self.original_user_input, self.short_output, self.tokens, self.content))
+
+    def __repr__(self) -> str:
+        return (f"{type(self).__name__}(role={self.role!r}, original_user_input={self.original_user_input!r}, "
+                f"short_output={self.short_output!r}, tokens={self.tokens!r}, content={self.content!r})")
 
 class TimestampedMessage(ConversationMessage):
+    """
+    Message as kept by a chat storage: with the time it was saved, the agent it was saved
+    for and the number of tokens its content adds to a prompt, counted once at save time.
+    """
+    __slots__ = ('timestamp', 'agent_id', 'content_tokens')
+
     def __init__(self,
                  role: ConversationRole,
                  original_user_input: str,
                  short_output: str,
                  content: Optional[List[Any]] = None,
                  tokens: Optional[int] = 0,
-                 timestamp: Optional[int] = None):
+                 timestamp: Optional[int] = None,
+                 agent_id: Optional[str] = None,
+                 content_tokens: int = 0):
         super().__init__(role, original_user_input, short_output, tokens, content)
-        self.timestamp = timestamp or int(time.time() * 1000) 
+        object.__setattr__(self, 'timestamp', timestamp or int(time.time() * 1000))
+        object.__setattr__(self, 'agent_id', agent_id)
+        object.__setattr__(self, 'content_tokens', content_tokens)
+
+    def __reduce__(self):
+        return (TimestampedMessage, (self.role, self.original_user_input, self.short_output, self.content,
+                                     self.tokens, self.timestamp, self.agent_id, self.content_tokens))
+
+class BudgetExceededError(Exception):
+    """Raised when a request runs out of hops, tokens or time."""
+    def __init__(self, reason: str):
+        super().__init__(f"Request budget exceeded: {reason}")
+        self.reason = reason
+
+class RequestRejectedError(Exception):
+    """Raised by a request's admission check (its input guard) to stop routing the request."""
+
+class RequestBudget:
+    """
+    Hops, tokens and time one request may spend, shared by all of its hops and sub-tasks.
+    Limits left as None are not enforced. Tokens are charged from the usage the model
+    reports, so calls that report none (cache hits, the local fast path) are free.
+    """
+    MAX_HOPS = "max_hops"
+    MAX_TOKENS = "max_tokens"
+    DEADLINE = "deadline"
+
+    def __init__(self,
+                 max_hops: Optional[int] = None,
+                 max_tokens: Optional[int] = None,
+                 timeout_seconds: Optional[float] = None):
+        self.max_hops = max_hops
+        self.max_tokens = max_tokens
+        self.deadline = time.monotonic() + timeout_seconds if timeout_seconds is not None else None
+        self.hops = 0
+        self.tokens_used = 0
+        self.exceeded: Optional[str] = None
+
+    def remaining_seconds(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def remaining_tokens(self) -> Optional[int]:
+        if self.max_tokens is None:
+            return None
+        return max(0, self.max_tokens - self.tokens_used)
+
+    def check(self) -> None:
+        """Raise BudgetExceededError if no tokens or time are left."""
+        if self.max_tokens is not None and self.tokens_used >= self.max_tokens:
+            self.fail(self.MAX_TOKENS)
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.fail(self.DEADLINE)
+
+    def start_hop(self) -> None:
+        """Count a hop, raising BudgetExceededError if the budget does not allow another one."""
+        self.check()
+        if self.max_hops is not None and self.hops >= self.max_hops:
+            self.fail(self.MAX_HOPS)
+        self.hops += 1
+
+    def fail(self, reason: str) -> None:
+        self.exceeded = self.exceeded or reason
+        raise BudgetExceededError(reason)
+
+    def max_output_tokens(self, configured: Optional[int]) -> Optional[int]:
+        """max_tokens for the next model call: the configured one, lowered to what is left."""
+        self.check()
+        remaining = self.remaining_tokens()
+        if remaining is None:
+            return configured
+        return remaining if configured is None else min(configured, remaining)
+
+    def check_output(self, finish_reason: Optional[str], configured: Optional[int], max_tokens: Optional[int]) -> None:
+        """
+        Raise BudgetExceededError if a call stopped at a max_tokens lowered by this budget:
+        its output, a tool call's arguments in particular, is cut off.
+        """
+        if finish_reason == "length" and max_tokens is not None and (configured is None or max_tokens < configured):
+            self.fail(self.MAX_TOKENS)
+
+    def record_usage(self, usage: Any) -> None:
+        """Charge the usage of a model call: an OpenAI usage object, a dict like it, or None."""
+        if usage is None:
+            return
+        if isinstance(usage, dict):
+            total = usage.get('total_tokens') or (usage.get('prompt_tokens') or 0) + (usage.get('completion_tokens') or 0)
+        else:
+            total = getattr(usage, 'total_tokens', None) or \
+                (getattr(usage, 'prompt_tokens', 0) or 0) + (getattr(usage, 'completion_tokens', 0) or 0)
+        self.tokens_used += int(total or 0)
+
+@dataclass(frozen=True)
+class RequestContext:
+    """
+    Per-request state handed down through classification, dispatch and agent handling.
+    Immutable, so one orchestrator can serve concurrent requests; derive the
+    context of the next hop with dataclasses.replace.
+    """
+    user_id: str
+    session_id: str
+    request_id: str
+    original_user_input: str
+    subtask_input: str = ""
+    additional_params: Dict[str, str] = field(default_factory=dict)
+    callbacks: Optional[Any] = None
+    execution_times: Dict[str, float] = field(default_factory=dict)
+    budget: Optional[RequestBudget] = None
+    hop: int = 0 #index of the classifier and agent round trip, or of the planned sub-task
+    usage: Optional[RequestUsage] = None
 
 @dataclass
 class FinalResponse:
@@ -38,6 +177,10 @@ class FinalResponse:
     AGENT_OUTPUT: str
     OUTPUT_TOKENS: int
     REQUEST_ID: str
+    BUDGET_EXCEEDED: Optional[str] = None #set on the entry that ends a request cut short by its budget: max_hops, max_tokens or deadline
+    PROMPT_TOKENS: int = 0 #prompt tokens the models reported for this hop, classifier (or planner, on the first entry) included
+    COMPLETION_TOKENS: int = 0 #completion tokens the models reported for this hop, classifier (or planner, on the first entry) included
+    COST_USD: Optional[float] = None #estimated cost of this hop's model calls, None if no model called has a known price
 
 @dataclass
 class ExpectedResult:
@@ -50,4 +193,13 @@ class OrchestratorConfig:
     AGENT_NOT_SELECTED_LOG: str = "I am sorry, I couldn't determine how to handle your request.\
     Could you please rephrase it?"
     ROUTING_ERROR_LOG: str = "I am Sorry, I couldn't determine the agent to handle your request"
-    MAX_MESSAGE_PAIRS_PER_AGENT: int = 100 #required to limit message storage per agent and user_id, session_id
\ No newline at end of file
+    MAX_MESSAGE_PAIRS_PER_AGENT: int = 100 #required to limit message storage per agent and user_id, session_id
+    AGENT_HISTORY_TOKEN_BUDGET: Optional[int] = None #tokens of an agent's newest history sent with a request, None sends all of it; an agent's history_token_budget overrides it
+    CLASSIFIER_HISTORY_TOKEN_BUDGET: Optional[int] = None #tokens of the session's newest history sent to the classifier, None sends all of it
+    BUDGET_EXCEEDED_LOG: str = "I stopped before finishing your request because it ran out of its processing budget. Above are the results so far."
+    MAX_HOPS_PER_REQUEST: Optional[int] = 10 #classifier and agent round trips (or planned sub-tasks) one request may take, None for no limit
+    MAX_TOKENS_PER_REQUEST: Optional[int] = None #prompt and completion tokens one request may use, as reported by the model, None for no limit
+    REQUEST_TIMEOUT_SECONDS: Optional[float] = None #wall-clock deadline of a request; calls still running at the deadline are cancelled, None for no limit
+    MODEL_PRICES: Optional[Dict[str, Tuple[float, float]]] = None #USD per million prompt and completion tokens by model for cost estimates, None uses token_counting.MODEL_PRICES
+    EXECUTION_MODE: str = "loop" #"loop" classifies and runs one hop at a time, "plan" plans a dependency graph of sub-tasks once and runs independent ones concurrently
+    FUSED_SINGLE_HOP: bool = False #in loop mode, let the classifier answer a request predicted to need one agent in that agent's persona in the routing call; the agent is called when it declines
\ No newline at end of file
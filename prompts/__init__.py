@@ -0,0 +1,7 @@
+from .prompt_template import PromptTemplate, compile_template, DYNAMIC_VARIABLES
+
+__all__ = [
+    'PromptTemplate',
+    'compile_template',
+    'DYNAMIC_VARIABLES'
+]
@@ -0,0 +1,130 @@
+import inspect
+import re
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+from token_counting import Tokenizer, default_tokenizer
+
+PLACEHOLDER = re.compile(r'{{(\w+)}}')
+SECTION_BREAK = re.compile(r'\n(?:[ \t]*\n)+')
+
+# Placeholders that change with every request
+DYNAMIC_VARIABLES = ("ORIGINAL_USER_INPUT", "HISTORY", "SUBTASK_INPUT")
+
+Variables = Mapping[str, Union[str, List[str]]]
+
+class PromptTemplate:
+    """
+    Prompt template compiled once, so rendering it is a join instead of a regex pass
+    over the whole text.
+
+    The template is dedented and otherwise rendered as written, in its own order. The
+    text before its first per-request value is rendered once, as a prefix that is
+    byte-identical for every user and request, which providers can cache; templates
+    that want a long cacheable prefix put their per-request blocks last. Values that
+    are fixed for a deployment, such as the agent descriptions, are rendered into that
+    prefix once with bind.
+
+    Bound values take precedence over the ones passed to render. Placeholders without a
+    value are left in place, and list values are joined with newlines.
+    """
+    def __init__(self,
+                 template: str,
+                 dynamic_variables: Sequence[str] = DYNAMIC_VARIABLES,
+                 bound: Optional[Mapping[str, str]] = None):
+        self.template = template
+        self.dynamic_variables = tuple(dynamic_variables)
+        self.bound: Dict[str, str] = dict(bound or {})
+        self.text = inspect.cleandoc(template)
+        # Sections only label the token report; the template is never reordered
+        sections = [section.strip('\n').rstrip() for section in SECTION_BREAK.split(self.text)]
+        self.sections: Tuple[str, ...] = tuple(section for section in sections if section)
+
+        # Text up to the first placeholder still unbound is rendered now; the rest is
+        # kept as literal text and placeholder names, rendered per call
+        self.prefix = ""
+        self.parts: List[Tuple[str, Optional[str]]] = []
+        position = 0
+        for match in PLACEHOLDER.finditer(self.text):
+            literal = self.text[position:match.start()]
+            name = match.group(1)
+            if self.parts:
+                self.parts.append((literal, name))
+            elif name in self.bound:
+                self.prefix += literal + self.bound[name]
+            else:
+                # The literal before the first unbound placeholder is static too
+                self.prefix += literal
+                self.parts.append(("", name))
+            position = match.end()
+        tail = self.text[position:]
+        if self.parts:
+            self.parts.append((tail, None))
+        else:
+            self.prefix += tail
+        self._bound_templates: Dict[Tuple[Tuple[str, str], ...], "PromptTemplate"] = {}
+
+    def bind(self, **values: Union[str, List[str]]) -> "PromptTemplate":
+        """
+        Template with values rendered into its static text. Bound templates are kept, so
+        binding the same values again costs one lookup.
+        """
+        key = tuple(sorted((name, self._value(value)) for name, value in values.items()))
+        bound_template = self._bound_templates.get(key)
+        if bound_template is None:
+            if len(self._bound_templates) >= 16:
+                self._bound_templates.clear()
+            bound_template = PromptTemplate(self.template, self.dynamic_variables, {**self.bound, **dict(key)})
+            self._bound_templates[key] = bound_template
+        return bound_template
+
+    def render(self, variables: Optional[Variables] = None) -> str:
+        variables = variables or {}
+        rendered = [self.prefix]
+        for literal, name in self.parts:
+            rendered.append(literal)
+            if name is None:
+                continue
+            if name in self.bound:
+                rendered.append(self.bound[name])
+            elif name in variables:
+                rendered.append(self._value(variables[name]))
+            else:
+                rendered.append("{{" + name + "}}")
+        return "".join(rendered)
+
+    @property
+    def cacheable_prefix(self) -> str:
+        """Text every rendering starts with, whatever the request."""
+        return self.prefix
+
+    def token_report(self,
+                     variables: Optional[Variables] = None,
+                     tokenizer: Optional[Tokenizer] = None) -> Dict[str, int]:
+        """
+        Tokens of every section of the rendered prompt, in template order: sections with
+        per-request values are named by their placeholders, the others by their first
+        line. Also the cacheable prefix and the total.
+        """
+        tokenizer = tokenizer or default_tokenizer()
+        values = {**{name: self._value(value) for name, value in (variables or {}).items()}, **self.bound}
+        report: Dict[str, int] = {}
+        for section in self.sections:
+            dynamic_names = [name for name in PLACEHOLDER.findall(section) if name in self.dynamic_variables]
+            label = "+".join(dynamic_names) if dynamic_names else section.splitlines()[0].strip()[:40]
+            rendered = PLACEHOLDER.sub(lambda match: values.get(match.group(1), match.group(0)), section)
+            report[label] = report.get(label, 0) + tokenizer.count(rendered)
+        report['cacheable_prefix'] = tokenizer.count(self.prefix)
+        report['total'] = tokenizer.count(self.render(variables))
+        return report
+
+    @staticmethod
+    def _value(value: Union[str, List[str]]) -> str:
+        return '\n'.join(value) if isinstance(value, list) else value
+
+@lru_cache(maxsize=256)
+def compile_template(template: str, dynamic_variables: Sequence[str] = DYNAMIC_VARIABLES) -> PromptTemplate:
+    """
+    Compiled template for a template string, compiled on first use only. The string's
+    hash is cached by Python, so looking up the same template again is constant time.
+    """
+    return PromptTemplate(template, dynamic_variables)
@@ -0,0 +1,6 @@
+from .session_registry import SessionRegistry, SessionEntry
+
+__all__ = [
+    'SessionRegistry',
+    'SessionEntry'
+]
@@ -0,0 +1,108 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+SessionKey = Tuple[str, str]
+
+@dataclass
+class SessionEntry:
+    last_access: float
+    size_bytes: int = 0
+
+class SessionRegistry:
+    """
+    Tracks the live (user_id, session_id) pairs served by the shared orchestrator and
+    decides which of them to evict. Sessions are kept in access order, so the least
+    recently used one is always first: TTL expiry, the session count cap and the
+    memory cap all evict from the front.
+
+    The registry does not own any session data. The evicted keys are returned to the
+    caller, which is expected to drop the matching chat history from storage.
+    """
+    def __init__(self,
+                 max_sessions: Optional[int] = 10000,
+                 ttl_seconds: Optional[float] = 3600,
+                 max_memory_bytes: Optional[int] = 256 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.sessions: "OrderedDict[SessionKey, SessionEntry]" = OrderedDict()
+        self.memory_bytes = 0
+        self.counters: Dict[str, int] = {
+            'sessions_created': 0,
+            'evictions_ttl': 0,
+            'evictions_lru': 0,
+            'evictions_memory': 0
+        }
+        self._lock = Lock()
+
+    def touch(self, user_id: str, session_id: str) -> List[SessionKey]:
+        """
+        Mark the session as used now, registering it if unseen.
+        Returns:
+            List[SessionKey]: The sessions evicted to make room or because they expired.
+        """
+        key = (user_id, session_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self.sessions.get(key)
+            if entry is None:
+                self.sessions[key] = SessionEntry(last_access=now)
+                self.counters['sessions_created'] += 1
+            else:
+                entry.last_access = now
+                self.sessions.move_to_end(key)
+            return self._evict(now, protected=key)
+
+    def update_size(self, user_id: str, session_id: str, size_bytes: int) -> List[SessionKey]:
+        """
+        Record the approximate history size of a session.
+        Returns:
+            List[SessionKey]: The sessions evicted to bring memory back under the cap.
+        """
+        key = (user_id, session_id)
+        with self._lock:
+            entry = self.sessions.get(key)
+            if entry is None:
+                return []
+            self.memory_bytes += size_bytes - entry.size_bytes
+            entry.size_bytes = size_bytes
+            return self._evict(time.monotonic(), protected=key)
+
+    def evict_expired(self) -> List[SessionKey]:
+        with self._lock:
+            return self._evict(time.monotonic())
+
+    def _evict(self, now: float, protected: Optional[SessionKey] = None) -> List[SessionKey]:
+        evicted = []
+        while self.sessions:
+            key, entry = next(iter(self.sessions.items()))
+            if key == protected:
+                # The session being served is never evicted by its own request
+                if len(self.sessions) == 1:
+                    break
+                self.sessions.move_to_end(key)
+                continue
+            if self.ttl_seconds is not None and now - entry.last_access > self.ttl_seconds:
+                reason = 'evictions_ttl'
+            elif self.max_sessions is not None and len(self.sessions) > self.max_sessions:
+                reason = 'evictions_lru'
+            elif self.max_memory_bytes is not None and self.memory_bytes > self.max_memory_bytes:
+                reason = 'evictions_memory'
+            else:
+                break
+            self.sessions.popitem(last=False)
+            self.memory_bytes -= entry.size_bytes
+            self.counters[reason] += 1
+            evicted.append(key)
+        return evicted
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'sessions_active': len(self.sessions),
+                'memory_bytes': self.memory_bytes,
+                **self.counters
+            }
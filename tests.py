@@ -6,6 +6,7 @@ from dspy.datasets.gsm8k import GSM8K
 
 from dotenv import load_dotenv
 import random
+import os
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,6 +14,8 @@ load_dotenv()
 if __name__ == '__main__':
     try:
         file = open("log.txt", "w")
+        # A fixed seed picks the same dataset items and sessions, so a recorded run can be replayed
+        random.seed(os.getenv('EVAL_SEED') or None)
         
         # init GSM8k dataset
         datasetGSM = GSM8K()
@@ -0,0 +1,5 @@
+from .char_ngram_index import CharNgramIndex
+
+__all__ = [
+    'CharNgramIndex'
+]
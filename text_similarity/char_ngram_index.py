@@ -0,0 +1,110 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+class CharNgramIndex:
+    """
+    Small in-process TF-IDF index over character n-grams, used to score short texts
+    against each other without a model call.
+
+    Entries are stored in an inverted index (n-gram -> entry -> term frequency), so a query
+    only touches the entries that share at least one n-gram with it. Inverse document
+    frequencies follow the current contents: a new entry is normed with the current
+    frequencies, and all norms are recomputed once the index has grown or shrunk by
+    more than a tenth since they were last computed.
+    """
+    def __init__(self, ngram_range: Tuple[int, int] = (3, 5)):
+        self.ngram_range = ngram_range
+        self.entries: Dict[str, Tuple[Counter, Any]] = {}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.norms: Dict[str, float] = {}
+        self._norms_size = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", text or "").strip().lower()
+
+    def ngrams(self, text: str) -> Counter:
+        padded = f" {self.normalize(text)} "
+        low, high = self.ngram_range
+        return Counter(padded[i:i + n]
+                       for n in range(low, high + 1)
+                       for i in range(len(padded) - n + 1))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def add(self, key: str, text: str, payload: Any) -> None:
+        """Index text under key, replacing any previous entry with the same key."""
+        self.remove(key)
+        counts = self.ngrams(text)
+        self.entries[key] = (counts, payload)
+        for gram, count in counts.items():
+            self.postings.setdefault(gram, {})[key] = self.tf(count)
+        self.norms[key] = self.norm(counts)
+
+    def remove(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for gram in entry[0]:
+            posting = self.postings[gram]
+            del posting[key]
+            if not posting:
+                del self.postings[gram]
+        del self.norms[key]
+
+    def idf(self, gram: str) -> float:
+        return math.log((1 + len(self.entries)) / (1 + len(self.postings.get(gram, ())))) + 1
+
+    @staticmethod
+    def tf(count: int) -> float:
+        return 1 + math.log(count)
+
+    def norm(self, counts: Counter) -> float:
+        return math.sqrt(sum((self.tf(count) * self.idf(gram)) ** 2 for gram, count in counts.items())) or 1.0
+
+    def query(self, text: str, limit: int = 1) -> List[Tuple[float, str, Any]]:
+        """
+        Score text against every indexed entry by cosine similarity.
+        Returns:
+            List[Tuple[float, str, Any]]: Up to limit (score, key, payload) tuples, best first.
+        """
+        if not self.entries:
+            return []
+        if abs(len(self.entries) - self._norms_size) > self._norms_size / 10:
+            self._compute_norms()
+
+        scores: Dict[str, float] = {}
+        query_norm = 0.0
+        for gram, count in self.ngrams(text).items():
+            posting = self.postings.get(gram)
+            idf = self.idf(gram)
+            weight = self.tf(count) * idf
+            query_norm += weight * weight
+            if not posting:
+                continue
+            weight *= idf
+            for key, entry_tf in posting.items():
+                scores[key] = scores.get(key, 0.0) + weight * entry_tf
+        if not scores or query_norm == 0:
+            return []
+
+        query_norm = math.sqrt(query_norm)
+        ranked = heapq.nlargest(limit, ((score / (query_norm * self.norms[key]), key)
+                                        for key, score in scores.items()))
+        return [(score, key, self.entries[key][1]) for score, key in ranked]
+
+    def _compute_norms(self) -> None:
+        squares: Dict[str, float] = dict.fromkeys(self.entries, 0.0)
+        for gram, posting in self.postings.items():
+            idf = self.idf(gram)
+            for key, entry_tf in posting.items():
+                squares[key] += (entry_tf * idf) ** 2
+        self.norms = {key: math.sqrt(value) or 1.0 for key, value in squares.items()}
+        self._norms_size = len(self.entries)
@@ -0,0 +1,17 @@
+from .tokenizer import Tokenizer, WhitespaceTokenizer, TiktokenTokenizer, default_tokenizer
+from .pricing import MODEL_PRICES, model_price, estimate_cost
+from .usage import TokenUsage, UsageRecord, RequestUsage, api_key_label
+
+__all__ = [
+    'Tokenizer',
+    'WhitespaceTokenizer',
+    'TiktokenTokenizer',
+    'default_tokenizer',
+    'MODEL_PRICES',
+    'model_price',
+    'estimate_cost',
+    'TokenUsage',
+    'UsageRecord',
+    'RequestUsage',
+    'api_key_label'
+]
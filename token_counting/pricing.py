@@ -0,0 +1,33 @@
+from typing import Any, Mapping, Optional, Tuple
+
+# USD per million (prompt, completion) tokens, from the providers' public price lists.
+# Dated snapshots (e.g. gpt-4o-mini-2024-07-18) are priced as their base model.
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "o4-mini": (1.10, 4.40),
+    "o3-mini": (1.10, 4.40),
+    "o3": (2.00, 8.00),
+    "gpt-3.5-turbo": (0.50, 1.50)
+}
+
+def model_price(model: Optional[str],
+                prices: Optional[Mapping[str, Tuple[float, float]]] = None) -> Optional[Tuple[float, float]]:
+    """Price of a model, matching dated snapshots by the longest known model name they start with."""
+    if not model:
+        return None
+    prices = MODEL_PRICES if prices is None else prices
+    if model in prices:
+        return prices[model]
+    matches = [name for name in prices if model.startswith(name + "-")]
+    return prices[max(matches, key=len)] if matches else None
+
+def estimate_cost(usage: Any, prices: Optional[Mapping[str, Tuple[float, float]]] = None) -> Optional[float]:
+    """Estimated cost in USD of a TokenUsage, None if its model has no known price."""
+    price = model_price(getattr(usage, 'model', None), prices)
+    if price is None:
+        return None
+    return (usage.prompt_tokens * price[0] + usage.completion_tokens * price[1]) / 1_000_000
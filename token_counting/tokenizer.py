@@ -0,0 +1,54 @@
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+from loguru import logger
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+class Tokenizer(ABC):
+    """Counts tokens locally, so prompt sizes can be budgeted without calling the model."""
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        """Number of tokens in text."""
+
+    def count_content(self, content: Optional[Iterable[Any]]) -> int:
+        """Number of tokens in the text parts of a message's content."""
+        if not content:
+            return 0
+        return sum(self.count(part.get('text') or '') for part in content if isinstance(part, dict))
+
+class WhitespaceTokenizer(Tokenizer):
+    """
+    Approximate count without any dependency: words and punctuation marks are one token
+    each, which is close to what BPE vocabularies give for English text.
+    """
+    TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+    def count(self, text: str) -> int:
+        return len(self.TOKEN_PATTERN.findall(text or ""))
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact count for OpenAI models with a tiktoken encoding."""
+    def __init__(self, encoding_name: str = "o200k_base"):
+        if tiktoken is None:
+            raise ImportError("tiktoken is required for TiktokenTokenizer")
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        # Special tokens in user text are counted as plain text instead of raising
+        return len(self.encoding.encode(text or "", disallowed_special=()))
+
+@lru_cache(maxsize=None)
+def default_tokenizer() -> Tokenizer:
+    """tiktoken when it is installed and its encoding can be loaded, the whitespace approximation otherwise."""
+    if tiktoken is not None:
+        try:
+            return TiktokenTokenizer()
+        except Exception as error:
+            logger.warning(f"Could not load the tiktoken encoding, counting tokens approximately: {str(error)}")
+    return WhitespaceTokenizer()
@@ -0,0 +1,87 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from .pricing import estimate_cost
+
+@dataclass(frozen=True)
+class TokenUsage:
+    """Prompt and completion tokens reported by the model for one or more calls."""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    model: Optional[str] = None
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def __add__(self, other: "TokenUsage") -> "TokenUsage":
+        return TokenUsage(prompt_tokens=self.prompt_tokens + other.prompt_tokens,
+                          completion_tokens=self.completion_tokens + other.completion_tokens,
+                          model=self.model if self.model == other.model else None)
+
+    @staticmethod
+    def from_response(usage: Any, model: Optional[str] = None) -> Optional["TokenUsage"]:
+        """
+        Usage of a model call from the usage field of an OpenAI response (or a dict like
+        it, or a TokenUsage). Returns None when the call reported no usage.
+        """
+        if usage is None:
+            return None
+        if isinstance(usage, TokenUsage):
+            return usage if usage.model or not model else TokenUsage(usage.prompt_tokens, usage.completion_tokens, model)
+        if isinstance(usage, Mapping):
+            prompt_tokens = usage.get('prompt_tokens')
+            completion_tokens = usage.get('completion_tokens')
+        else:
+            prompt_tokens = getattr(usage, 'prompt_tokens', None)
+            completion_tokens = getattr(usage, 'completion_tokens', None)
+        return TokenUsage(prompt_tokens=int(prompt_tokens or 0), completion_tokens=int(completion_tokens or 0), model=model)
+
+@dataclass(frozen=True)
+class UsageRecord:
+    """One model call of a request: who made it, in which hop, on which API key."""
+    source: str
+    hop: int
+    usage: TokenUsage
+    api_key: str
+
+def api_key_label(api_key: Optional[str]) -> str:
+    """Label of an API key that is safe to log and export: its last four characters."""
+    if not api_key:
+        return "default"
+    return "..." + api_key[-4:]
+
+class RequestUsage:
+    """
+    Token usage of every model call made for one request, by its classifier and agents,
+    in all of its hops and sub-tasks. Shared through the request context like its budget.
+    """
+    def __init__(self):
+        self.records: List[UsageRecord] = []
+
+    def record(self, source: str, hop: int, usage: TokenUsage, api_key: Optional[str] = None) -> None:
+        self.records.append(UsageRecord(source=source, hop=hop, usage=usage, api_key=api_key_label(api_key)))
+
+    def total(self, hop: Optional[int] = None) -> TokenUsage:
+        """Usage of the whole request, or of one hop."""
+        total = TokenUsage()
+        for record in self.records:
+            if hop is None or record.hop == hop:
+                total = total + record.usage
+        return total
+
+    def by_hop(self) -> Dict[int, TokenUsage]:
+        hops: Dict[int, TokenUsage] = {}
+        for record in self.records:
+            hops[record.hop] = hops.get(record.hop, TokenUsage()) + record.usage
+        return hops
+
+    def cost(self,
+             hop: Optional[int] = None,
+             prices: Optional[Mapping[str, Tuple[float, float]]] = None) -> Optional[float]:
+        """
+        Estimated cost in USD of the request, or of one hop. Calls of models without a
+        price are left out; None if no call had one.
+        """
+        costs = [estimate_cost(record.usage, prices) for record in self.records if hop is None or record.hop == hop]
+        known = [cost for cost in costs if cost is not None]
+        return round(sum(known), 8) if known else None